@@ -0,0 +1,82 @@
+"""
+bench_broker.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Shows how a broker scales with the number of client processes, for a read
+which can be coalesced (button_a.is_pressed()) and a write which can't
+(display.set_pixel()).
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from microperi.broker import Broker, BrokerDevice
+from microperi.microperi import Device
+
+from benchmarks.common import parser, port
+
+
+def client(path, call, runs, start, results):
+    device = BrokerDevice(path)
+    device.open()
+    display = device.microbit.display
+    calls = {
+        'read': device.microbit.button_a.is_pressed,
+        'write': lambda: display.set_pixel(2, 2, 9),
+    }
+    fn = calls[call]
+    start.wait()
+    for _ in range(runs):
+        fn()
+    results.put(time.perf_counter())
+    device.close()
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16, 32],
+                   help='numbers of client processes to try (default: '
+                        '%(default)s)')
+    args = p.parse_args()
+    path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+    device = Device(port=port(args))
+    device.open()
+    broker = Broker(device, path)
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    try:
+        for call in ('read', 'write'):
+            for clients in args.clients:
+                broker.stats.update(requests=0, coalesced=0)
+                start = multiprocessing.Event()
+                results = multiprocessing.Queue()
+                processes = [multiprocessing.Process(
+                    target=client,
+                    args=(path, call, args.runs, start, results))
+                    for _ in range(clients)]
+                for process in processes:
+                    process.start()
+                time.sleep(0.5)  # Let every client connect.
+                began = time.perf_counter()
+                start.set()
+                finished = max(results.get() for _ in processes)
+                for process in processes:
+                    process.join()
+                print('{:<5} {:3d} clients {:9.1f} calls/s  {:5.1f}% '
+                      'coalesced'.format(
+                          call, clients,
+                          clients * args.runs / (finished - began),
+                          100.0 * broker.stats['coalesced'] /
+                          max(1, broker.stats['requests'])))
+    finally:
+        broker.close()
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+bench_bus.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares reading --samples samples of 6 bytes from an I2C peripheral (a
+register write followed by a read, as for an accelerometer) with a Shim call
+per operation, with a batch of them and with one transaction. With --sim a
+peripheral is attached to the simulated micro:bit.
+"""
+from microperi.microperi import Device
+
+from benchmarks.common import parser, port, report, timed
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--addr', type=lambda a: int(a, 0), default=0x1d,
+                   help='address of the I2C peripheral (default: 0x1d)')
+    p.add_argument('--register', type=lambda r: int(r, 0), default=0x01,
+                   help='register to read from (default: 0x01)')
+    p.add_argument('--samples', type=int, default=20,
+                   help='samples read each time (default: %(default)s)')
+    args = p.parse_args()
+    device = Device(port=port(args))
+    device.open()
+    if args.sim:
+        device.connection.microbit.i2c.devices[args.addr] = {
+            register: register for register in range(256)}
+    i2c = device.microbit.i2c
+    register = bytes((args.register,))
+    runs = max(1, args.runs // 10)
+
+    def shims():
+        samples = []
+        for _ in range(args.samples):
+            i2c.write(args.addr, register)
+            samples.append(i2c.read(args.addr, 6))
+        return samples
+
+    def batch():
+        with device.batch():
+            futures = []
+            for _ in range(args.samples):
+                i2c.write(args.addr, register)
+                futures.append(i2c.read(args.addr, 6))
+        return [future.result() for future in futures]
+
+    def transaction():
+        with device.transaction() as t:
+            futures = []
+            for _ in range(args.samples):
+                t.i2c_write(args.addr, register)
+                futures.append(t.i2c_read(args.addr, 6))
+        return [future.result() for future in futures]
+
+    try:
+        assert shims() == batch() == transaction()
+        for label, fn in (('Shim per operation', shims), ('batch', batch),
+                          ('transaction', transaction)):
+            timings = timed(fn, runs)
+            report(label, timings)
+            print('    {:.0f} samples/s'.format(
+                args.samples / sorted(timings)[len(timings) // 2]))
+    finally:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+bench_cache.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Times calls of rarely changing values with and without a ResultCache, and
+the cost of a state-changing call which invalidates them.
+"""
+from microperi.cache import ResultCache
+from microperi.microperi import Device
+
+from benchmarks.common import parser, port, timed, report
+
+
+def main():
+    p = parser(__doc__)
+    args = p.parse_args()
+    device = Device(port=port(args))
+    device.open()
+    try:
+        compass = device.microbit.compass
+        display = device.microbit.display
+        cases = [
+            ('is_calibrated()', compass.is_calibrated),
+            ('read_light_level()', display.read_light_level),
+            ('get_pixel(2, 2)', lambda: display.get_pixel(2, 2)),
+        ]
+        for label, fn in cases:
+            fn()  # Warm up.
+            report('uncached ' + label, timed(fn, args.runs))
+        device.cache = ResultCache({
+            'microbit.compass.is_calibrated': 60,
+            'microbit.display.read_light_level': 1,
+            'microbit.display.get_pixel': 1,
+        })
+        for label, fn in cases:
+            report('cached ' + label, timed(fn, args.runs))
+
+        def write_then_read():
+            display.set_pixel(2, 2, 9)
+            display.get_pixel(2, 2)
+        report('set_pixel() + get_pixel()', timed(write_then_read, args.runs))
+        print(device.cache.stats)
+    finally:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+bench_decode.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares the time taken to decode a result of each common type with the
+fast-path decoder and with ast.literal_eval. Needs no micro:bit.
+"""
+import ast
+import time
+
+from microperi.decoder import Decoder
+
+from benchmarks.common import parser
+
+RESULTS = [
+    ('bool', b'True\r\n'),
+    ('none', b'None\r\n'),
+    ('int', b'512\r\n'),
+    ('float', b'-0.4375\r\n'),
+    ('str', b"'face up'\r\n"),
+    ('int_tuple', b'(12, -40, 1020)\r\n'),
+    ('int_list', b'[0, 0, 9, 0, 0]\r\n'),
+    ('literal_eval', b"{'x': (1, 'a')}\r\n"),
+]
+
+
+def per_result(fn, data, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(data)
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    p = parser(__doc__)
+    args = p.parse_args()
+    runs = args.runs * 1000
+    decode = Decoder()
+    print('{:<14} {:>12} {:>14}'.format('type', 'decoder', 'literal_eval'))
+    for label, data in RESULTS:
+        fast = per_result(decode, data, runs)
+        slow = per_result(lambda d: ast.literal_eval(d.decode('utf-8')),
+                          data, runs)
+        print('{:<14} {:9.3f} us {:11.3f} us'.format(label, fast * 1e6,
+                                                      slow * 1e6))
+    print('paths taken:', dict(decode.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+bench_display.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares the frames per second achievable on the display by showing each
+frame with one round trip (display.show()), by setting each pixel which
+changed with its own round trip (display.set_pixel()) and by streaming
+frames with Device.display_stream(), as fast as the link allows and paced
+to --fps with frames dropped when it falls behind. The frames count from 0
+to 9.
+"""
+import time
+
+from microperi.microperi import Device
+
+from benchmarks.common import parser, port
+
+# The digits 0 to 9 in the format of Image.
+DIGITS = [
+    '09900:90090:90090:90090:09900',
+    '00900:09900:00900:00900:09990',
+    '99900:00090:09900:90000:99990',
+    '99900:00090:09900:00090:99900',
+    '90090:90090:99990:00090:00090',
+    '99990:90000:99900:00090:99900',
+    '09900:90000:99900:90090:09900',
+    '99990:00090:00900:09000:90000',
+    '09900:90090:09900:90090:09900',
+    '09900:90090:09990:00090:09900',
+]
+
+
+def fps(label, frames, start):
+    print('{:<24} {:8.1f} frames/s'.format(
+        label, frames / (time.perf_counter() - start)))
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--fps', type=float, default=30,
+                   help='rate to pace the stream to, to show dropping '
+                        '(default: %(default)s)')
+    args = p.parse_args()
+    frames = [DIGITS[i % 10] for i in range(args.runs)]
+    device = Device(port=port(args))
+    device.open()
+    microbit = device.microbit
+    try:
+        microbit.display.clear()
+        start = time.perf_counter()
+        for frame in frames:
+            device.execute('from microbit import *\n'
+                           'display.show(Image({!r}))'.format(frame))
+        fps('display.show()', len(frames), start)
+
+        shown = '0' * 25
+        start = time.perf_counter()
+        for frame in frames:
+            frame = frame.replace(':', '')
+            for i in range(25):
+                if frame[i] != shown[i]:
+                    microbit.display.set_pixel(i % 5, i // 5, int(frame[i]))
+            shown = frame
+        fps('display.set_pixel()', len(frames), start)
+
+        for rate, drop in ((None, False), (args.fps, True)):
+            stream = device.display_stream(fps=rate, drop=drop)
+            start = time.perf_counter()
+            with stream:
+                for frame in frames:
+                    stream.show(frame)
+            fps('display_stream(fps={})'.format(rate), stream.sent, start)
+            print('    {} sent, {} dropped, {:.1f} bytes/frame'.format(
+                stream.sent, stream.dropped,
+                stream.bytes_sent / max(1, stream.sent)))
+    finally:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
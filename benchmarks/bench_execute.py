@@ -0,0 +1,34 @@
+"""
+bench_execute.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares the per-call latency of execute() reading responses as they arrive
+with the old loop, which slept for a fixed delay between polls.
+"""
+from microperi.microperi import execute
+
+from benchmarks.common import parser, connect, disconnect, timed, report
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--delay', type=float, default=0.1,
+                   help='sleep used by the polling loop (default: '
+                        '%(default)s)')
+    args = p.parse_args()
+    connection = connect(args)
+    try:
+        execute('x = 1', connection)  # Warm up.
+        report('event-driven', timed(
+            lambda: execute('print(repr(x))', connection), args.runs))
+        report('polling (delay={})'.format(args.delay), timed(
+            lambda: execute('print(repr(x))', connection, delay=args.delay),
+            args.runs))
+    finally:
+        disconnect(connection)
+
+
+if __name__ == '__main__':
+    main()
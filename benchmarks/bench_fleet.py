@@ -0,0 +1,57 @@
+"""
+bench_fleet.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Shows how opening and broadcasting to a Fleet scales from one micro:bit to
+all of the attached ones (or, with --sim, to --devices simulated ones).
+"""
+import time
+
+from microperi.fleet import Fleet
+from microperi.microperi import Device, find_microbits
+
+from benchmarks.common import parser, port, report
+
+
+def fleets(args):
+    """
+    Yields fleets of 1 to N devices.
+    """
+    if args.sim:
+        # Every simulated micro:bit has the same URL, so key them by number.
+        for n in range(1, args.devices + 1):
+            yield Fleet(devices=[('sim{}'.format(i), Device(port=port(args)))
+                                 for i in range(n)])
+        return
+    ports = find_microbits()
+    for n in range(1, len(ports) + 1):
+        yield Fleet(ports[:n])
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--devices', type=int, default=8,
+                   help='number of simulated micro:bits (default: '
+                        '%(default)s)')
+    args = p.parse_args()
+    for fleet in fleets(args):
+        n = len(fleet)
+        start = time.perf_counter()
+        opened = fleet.open()
+        open_time = time.perf_counter() - start
+        failed = [key for key, result in opened.items() if result.error]
+        print('{} device(s): open {:.3f} ms, {} failed'.format(
+            n, open_time * 1000, len(failed)))
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            fleet.broadcast('microbit.accelerometer.get_x')
+            timings.append(time.perf_counter() - start)
+        report('  broadcast get_x() x{}'.format(n), timings)
+        fleet.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+bench_handle.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares passing a large value (a str of --size characters) to a call each
+time with passing a RemoteHandle to a copy kept on the micro:bit.
+"""
+from microperi.microperi import Device
+
+from benchmarks.common import parser, port, report, timed
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--size', type=int, default=1000,
+                   help='characters in the value (default: %(default)s)')
+    args = p.parse_args()
+    text = 'micro:bit ' * (args.size // 10)
+    for rpc in (False, True):
+        label = 'rpc' if rpc else 'source'
+        device = Device(port=port(args))
+        device.open(rpc=rpc)
+        scroll = device.microbit.display.scroll
+        try:
+            scroll('')
+            report('{}, value'.format(label),
+                   timed(lambda: scroll(text, delay=0), args.runs))
+            handle = device.handle(repr(text))
+            report('{}, handle'.format(label),
+                   timed(lambda: scroll(handle, delay=0), args.runs))
+        finally:
+            device.close()
+
+
+if __name__ == '__main__':
+    main()
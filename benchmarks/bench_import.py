@@ -0,0 +1,65 @@
+"""
+bench_import.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Times opening a device and making a first call on each of four modules:
+with an import round trip per module (as Device used to), importing along
+with the first calls, and preloading all of them at open().
+"""
+import time
+
+from microperi.microperi import Device, Shim
+
+from benchmarks.common import parser, port, report
+
+MODULES = ['microbit', 'radio', 'music', 'neopixel']
+
+
+class EagerDevice(Device):
+    """
+    Device as it was before imports were batched: each module is imported
+    with its own round trip when it's first used.
+    """
+
+    def __getattr__(self, attr_name):
+        if attr_name.startswith('__'):
+            raise AttributeError(attr_name)
+        if attr_name in self.modules:
+            return self.modules[attr_name]
+        _, err = self.execute('import ' + attr_name)
+        if err:
+            raise IOError(err)
+        shim = Shim(attr_name, self.connection, self)
+        self.modules[attr_name] = shim
+        return shim
+
+
+def startup(args, device_class, **kwargs):
+    device = device_class(port=port(args))
+    start = time.perf_counter()
+    device.open(**kwargs)
+    device.microbit.temperature()
+    device.radio.on()
+    device.music.stop()
+    device.neopixel.NeoPixel(device.microbit.pin0, 4)
+    elapsed = time.perf_counter() - start
+    device.close()
+    return elapsed
+
+
+def main():
+    p = parser(__doc__)
+    args = p.parse_args()
+    runs = max(1, args.runs // 5)
+    for label, device_class, kwargs in [
+            ('import per module', EagerDevice, {}),
+            ('import with first call', Device, {}),
+            ('preload', Device, {'preload': MODULES})]:
+        report(label, [startup(args, device_class, **kwargs)
+                       for _ in range(runs)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+bench_mirror.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Times a UI-style polling loop reading three values, with every read making
+a round trip and with the values mirrored on the host.
+"""
+import time
+
+from microperi.microperi import Device
+
+from benchmarks.common import parser, port, timed, report
+
+PATHS = ['microbit.button_a.is_pressed', 'microbit.accelerometer.get_values',
+         'microbit.temperature']
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--interval', type=float, default=0.05,
+                   help='seconds between mirror refreshes (default: '
+                        '%(default)s)')
+    args = p.parse_args()
+    device = Device(port=port(args))
+    device.open()
+    try:
+        shims = [device.shim(path) for path in PATHS]
+
+        def poll():
+            for shim in shims:
+                shim()
+        poll()  # Warm up.
+        report('poll, round trips', timed(poll, args.runs))
+        mirror = device.mirror(PATHS, interval=args.interval)
+        start = time.perf_counter()
+        report('poll, mirrored', timed(poll, args.runs * 100))
+        elapsed = time.perf_counter() - start
+        print('{} hits, {} misses, {} refreshes in {:.3f} s'.format(
+            mirror.hits, mirror.misses, mirror.refreshes, elapsed))
+    finally:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
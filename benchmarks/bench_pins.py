@@ -0,0 +1,61 @@
+"""
+bench_pins.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares reading every pin (digital values of all 19, analog values of the
+6 analog pins) and writing every pin with a Shim call per pin, with a batch
+of them and with Device.pins.
+"""
+from microperi.microperi import Device
+from microperi.pins import DIGITAL_PINS, ANALOG_PINS
+
+from benchmarks.common import parser, port, report, timed
+
+
+def main():
+    p = parser(__doc__)
+    args = p.parse_args()
+    device = Device(port=port(args))
+    device.open()
+    microbit = device.microbit
+    pins = [getattr(microbit, 'pin{}'.format(n)) for n in range(21)]
+    runs = max(1, args.runs // 5)
+
+    def read_each():
+        return ([pins[n].read_digital() for n in DIGITAL_PINS],
+                [pins[n].read_analog() for n in ANALOG_PINS])
+
+    def read_batch():
+        with device.batch():
+            digital = [pins[n].read_digital() for n in DIGITAL_PINS]
+            analog = [pins[n].read_analog() for n in ANALOG_PINS]
+        return ([f.result() for f in digital], [f.result() for f in analog])
+
+    def write_each():
+        for n in DIGITAL_PINS:
+            pins[n].write_digital(1)
+
+    def write_batch():
+        with device.batch():
+            for n in DIGITAL_PINS:
+                pins[n].write_digital(1)
+
+    values = dict.fromkeys(DIGITAL_PINS, 1)
+    try:
+        device.pins.snapshot()
+        report('read, Shim per pin', timed(read_each, runs))
+        report('read, batch', timed(read_batch, runs))
+        report('read, pins.snapshot()', timed(device.pins.snapshot,
+                                              args.runs))
+        report('write, Shim per pin', timed(write_each, runs))
+        report('write, batch', timed(write_batch, runs))
+        report('write, pins.apply()', timed(
+            lambda: device.pins.apply(values), args.runs))
+    finally:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+bench_poll.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares polling for responses every fixed delay with the AdaptivePoller's
+learned schedule, for a fast call (display.get_pixel()) and a slow one
+(sleep()), by latency and by the number of polls made per call. Reading
+responses as they arrive is included for reference.
+"""
+import itertools
+
+from microperi.microperi import Device
+from microperi.poller import AdaptivePoller
+
+from benchmarks.common import parser, port, report, timed
+
+
+def counted(delays, counts):
+    for delay in delays:
+        counts[0] += 1
+        yield delay
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--delays', type=float, nargs='+', default=[0.01, 0.05],
+                   help='fixed delays to try (default: %(default)s)')
+    p.add_argument('--sleep', type=int, default=50,
+                   help='ms the slow call sleeps for (default: %(default)s)')
+    args = p.parse_args()
+    device = Device(port=port(args))
+    device.open()
+    microbit = device.microbit
+    calls = {
+        'get_pixel': (microbit.display.get_pixel, (0, 0)),
+        'sleep': (microbit.sleep, (args.sleep,)),
+    }
+    try:
+        microbit.running_time()
+        for label, (shim, shim_args) in calls.items():
+            report('{}, blocking reads'.format(label),
+                   timed(lambda: shim(*shim_args), args.runs))
+            for delay in args.delays:
+                counts = [0]
+                report('{}, every {} s'.format(label, delay), timed(
+                    lambda: shim(*shim_args, _delay=counted(
+                        itertools.repeat(delay), counts)), args.runs))
+                print('    {:.1f} polls per call'.format(
+                    counts[0] / args.runs))
+            device.poller = AdaptivePoller()
+            timed(lambda: shim(*shim_args), 10)  # Learn the estimate.
+            device.poller.reset_counts()
+            report('{}, adaptive'.format(label),
+                   timed(lambda: shim(*shim_args), args.runs))
+            stats = device.poller.snapshot()[shim.name]
+            print('    {:.1f} polls per call, estimate {:.2f} ms'.format(
+                stats['polls'] / stats['calls'], 1000 * stats['estimate']))
+            device.poller = None
+    finally:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+bench_probe.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Measures what instrumenting a Device costs, then prints what the probe
+recorded for each path.
+"""
+from microperi.microperi import Device
+
+from benchmarks.common import parser, connect, disconnect, timed, report
+
+
+def main():
+    p = parser(__doc__)
+    args = p.parse_args()
+    connection = connect(args)
+    try:
+        device = Device(connection)
+        get_x = device.microbit.accelerometer.get_x
+        get_values = device.microbit.accelerometer.get_values
+        get_x()  # Warm up.
+        report('get_x() uninstrumented', timed(get_x, args.runs))
+        probe = device.instrument()
+        report('get_x() instrumented', timed(get_x, args.runs))
+        timed(get_values, args.runs)
+        device.gather(get_x, get_values)
+        device.uninstrument()
+        print()
+        print('{:<32} {:>6} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+            'path', 'calls', 'sent', 'recv', 'write', 'first', 'response',
+            'decode'))
+        for path, stats in sorted(probe.snapshot().items()):
+            print('{:<32} {:>6} {:>8} {:>8}'.format(
+                path, stats['calls'], stats['bytes_sent'],
+                stats['bytes_received']) + ''.join(
+                ' {:>7.3f} ms'.format((stats[name]['p50'] or 0) * 1000)
+                for name in ('write', 'first_byte', 'response', 'decode')))
+    finally:
+        disconnect(connection)
+
+
+if __name__ == '__main__':
+    main()
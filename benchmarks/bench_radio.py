@@ -0,0 +1,89 @@
+"""
+bench_radio.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares receiving radio messages by polling radio.receive_full() through a
+Shim with receiving them through Device.radio_gateway(), for --seconds each.
+With --sim, messages are delivered to the simulated micro:bit at --rate a
+second; otherwise another micro:bit has to be sending them.
+"""
+import threading
+import time
+
+from microperi.microperi import Device
+
+from benchmarks.common import parser, port
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--seconds', type=float, default=2.0,
+                   help='seconds to receive for (default: %(default)s)')
+    p.add_argument('--rate', type=float, default=500,
+                   help='messages a second delivered with --sim '
+                        '(default: %(default)s)')
+    p.add_argument('--queue', type=int, default=10,
+                   help="length of the radio's queue (default: %(default)s)")
+    args = p.parse_args()
+    device = Device(port=port(args))
+    device.open()
+    sim_radio = device.connection.radio if args.sim else None
+
+    def deliver(stop):
+        n = 0
+        start = time.monotonic()
+        while not stop.is_set():
+            n += 1
+            sim_radio.inject(b'message %d' % n)
+            time.sleep(max(0, start + n / args.rate - time.monotonic()))
+        return n
+
+    def run(label, receive):
+        stop = threading.Event()
+        delivered = []
+        if sim_radio is not None:
+            sim_radio.dropped = 0
+            sender = threading.Thread(
+                target=lambda: delivered.append(deliver(stop)))
+            sender.start()
+        try:
+            received, extra = receive()
+        finally:
+            stop.set()
+            if sim_radio is not None:
+                sender.join()
+        print('{}: {:.0f} messages/s received{}'.format(
+            label, received / args.seconds, extra))
+        if sim_radio is not None:
+            print('    {} delivered, {} dropped by the radio'.format(
+                delivered[0], sim_radio.dropped))
+
+    def poll():
+        radio = device.radio
+        radio.config(queue=args.queue)
+        radio.on()
+        received = 0
+        end = time.monotonic() + args.seconds
+        while time.monotonic() < end:
+            if radio.receive_full() is not None:
+                received += 1
+        radio.off()
+        return received, ''
+
+    def gateway():
+        with device.radio_gateway(args.queue, 10 ** 6) as g:
+            time.sleep(args.seconds)
+        return g.received, ' ({} overflows, {} dropped on the host)'.format(
+            g.overflows, g.dropped)
+
+    try:
+        run('Shim polling', poll)
+        run('gateway', gateway)
+    finally:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
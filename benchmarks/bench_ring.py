@@ -0,0 +1,50 @@
+"""
+bench_ring.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares the host-side cost per sample of decoding streamed sample frames
+into namedtuples with decoding them into a SampleRing. Needs no micro:bit.
+"""
+import time
+from collections import namedtuple
+
+from microperi.ringbuffer import SampleRing
+
+from benchmarks.common import parser
+
+FIELDS = ('accelerometer_x', 'accelerometer_y', 'accelerometer_z')
+
+
+def per_sample(fn, batches, batch_size):
+    start = time.perf_counter()
+    for _ in range(batches):
+        fn()
+    return (time.perf_counter() - start) / (batches * batch_size)
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--batch', type=int, default=20,
+                   help='samples received together (default: %(default)s)')
+    args = p.parse_args()
+    batches = max(1, args.runs * 1000 // args.batch)
+    frames = [b'$%d,%d,%d,%d' % (1000 + 20 * i, i, -i, 1020)
+              for i in range(args.batch)]
+    Sample = namedtuple('Sample', ('timestamp',) + FIELDS)
+    cases = [
+        ('namedtuple', lambda: [Sample(*map(int, frame[1:].split(b',')))
+                                for frame in frames]),
+    ]
+    for use_numpy in (True, False):
+        ring = SampleRing(FIELDS, capacity=10000, use_numpy=use_numpy)
+        label = 'SampleRing ({})'.format('numpy' if ring.numpy else 'array')
+        cases.append((label, lambda ring=ring: ring.extend(frames)))
+    for label, fn in cases:
+        print('{:<22} {:8.3f} us/sample'.format(
+            label, per_sample(fn, batches, args.batch) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+bench_rpc.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares Shim calls per second sent as Python source with those sent through
+the resident dispatcher's binary format.
+"""
+import time
+
+from microperi.microperi import Device
+
+from benchmarks.common import parser, connect, disconnect
+
+
+def calls_per_second(fn, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return runs / (time.perf_counter() - start)
+
+
+def main():
+    p = parser(__doc__)
+    args = p.parse_args()
+    connection = connect(args)
+    try:
+        device = Device(connection)
+        accelerometer = device.microbit.accelerometer
+        display = device.microbit.display
+        cases = [
+            ('get_x()', lambda: accelerometer.get_x()),
+            ('get_values()', lambda: accelerometer.get_values()),
+            ('set_pixel(2, 2, 9)', lambda: display.set_pixel(2, 2, 9)),
+        ]
+        for mode in ('source', 'rpc'):
+            if mode == 'rpc':
+                device.open(rpc=True)
+            for label, fn in cases:
+                fn()  # Warm up (and register the slot, for rpc).
+                print('{:<8} {:<22} {:9.1f} calls/s'.format(
+                    mode, label, calls_per_second(fn, args.runs)))
+        device.close()
+    finally:
+        disconnect(connection)
+
+
+if __name__ == '__main__':
+    main()
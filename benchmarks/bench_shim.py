@@ -0,0 +1,94 @@
+"""
+bench_shim.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Measures the host-side cost of a Shim call, against a connection which
+answers instantly, so that only MicroPeri's own overhead is timed. Needs no
+micro:bit.
+
+For comparison, UncachedShim makes new child shims and formats the whole
+command on every call, as Shims used to.
+"""
+import ast
+import time
+
+from microperi.microperi import Shim, execute, repr_args
+
+from benchmarks.common import parser
+
+RESPONSE = b'OK512\r\n\x04\x04>'
+
+
+class NullConnection:
+    """
+    Answers every command with the same response, straight away.
+    """
+    is_open = True
+
+    def __init__(self):
+        self._pending = b''
+
+    @property
+    def in_waiting(self):
+        return len(self._pending)
+
+    def write(self, data):
+        self._pending = RESPONSE
+        return len(data)
+
+    def read(self, size=1):
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+class UncachedShim:
+    """
+    Shim as it was before children were kept and commands pre-encoded.
+    """
+
+    def __init__(self, name, connection):
+        self.name = name
+        self.connection = connection
+
+    def __call__(self, *args, **kwargs):
+        complete_args = repr_args(args, kwargs)
+        command = "print(repr({}({})))".format(self.name, complete_args)
+        underscore_args = {k[1:]: v for k, v in kwargs.items() if k[0] == '_'}
+        out, err = execute(command, self.connection, **underscore_args)
+        return ast.literal_eval(out.decode('utf-8'))
+
+    def __getattr__(self, attr_name):
+        return UncachedShim('{}.{}'.format(self.name, attr_name),
+                            self.connection)
+
+
+def per_call(fn, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    p = parser(__doc__)
+    args = p.parse_args()
+    runs = args.runs * 1000
+    connection = NullConnection()
+    microbit = Shim('microbit', connection)
+    uncached = UncachedShim('microbit', connection)
+    cases = [
+        ('uncached get_x()', lambda: uncached.accelerometer.get_x()),
+        ('Shim get_x()', lambda: microbit.accelerometer.get_x()),
+        ('uncached set_pixel(2, 2, 9)',
+         lambda: uncached.display.set_pixel(2, 2, 9)),
+        ('Shim set_pixel(2, 2, 9)',
+         lambda: microbit.display.set_pixel(2, 2, 9)),
+    ]
+    for label, fn in cases:
+        print('{:<28} {:8.3f} us/call'.format(label, per_call(fn, runs) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+bench_stream.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Compares how soon the first line of a program's output is available with
+Device.execute(), which waits for the program to finish, and with
+Device.stream().
+"""
+import time
+
+from microperi.microperi import Device
+
+from benchmarks.common import parser, port, report
+
+PROGRAM = """\
+from microbit import sleep
+for i in range({lines}):
+    print(i)
+    sleep({delay})
+"""
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--lines', type=int, default=20,
+                   help='lines the program prints (default: %(default)s)')
+    p.add_argument('--delay', type=int, default=10,
+                   help='ms between lines (default: %(default)s)')
+    args = p.parse_args()
+    program = PROGRAM.format(lines=args.lines, delay=args.delay)
+    device = Device(port=port(args))
+    device.open()
+    try:
+        runs = max(1, args.runs // 5)
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            device.execute(program)
+            timings.append(time.perf_counter() - start)
+        report('execute, first line', timings)
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            with device.stream(program) as lines:
+                next(iter(lines))
+                timings.append(time.perf_counter() - start)
+        report('stream, first line', timings)
+    finally:
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+bench_threads.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Shows how the throughput of several threads sharing one micro:bit scales,
+comparing a lock around each call with a Device in threaded mode.
+"""
+import threading
+import time
+
+from microperi.microperi import Device
+
+from benchmarks.common import parser, port
+
+
+def calls_per_second(call, threads, runs):
+    """
+    Makes runs calls from each of threads threads at once and returns the
+    total calls per second.
+    """
+    def work():
+        for _ in range(runs):
+            call()
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * runs / (time.perf_counter() - start)
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--threads', type=int, default=8,
+                   help='most threads to share the device (default: '
+                        '%(default)s)')
+    args = p.parse_args()
+
+    device = Device(port=port(args))
+    device.open()
+    lock = threading.Lock()
+    get_x = device.microbit.accelerometer.get_x
+
+    def locked():
+        with lock:
+            return get_x()
+    for threads in range(1, args.threads + 1):
+        print('{} thread(s): locked {:8.1f} calls/s'.format(
+            threads, calls_per_second(locked, threads, args.runs)))
+    device.close()
+
+    device = Device(port=port(args))
+    device.open(threaded=True)
+    get_x = device.microbit.accelerometer.get_x
+    for threads in range(1, args.threads + 1):
+        print('{} thread(s): threaded {:6.1f} calls/s'.format(
+            threads, calls_per_second(get_x, threads, args.runs)))
+    device.close()
+
+
+if __name__ == '__main__':
+    main()
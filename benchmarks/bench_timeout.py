@@ -0,0 +1,52 @@
+"""
+bench_timeout.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Measures how long a timed out call takes to give up and recover (be
+interrupted and get back to the raw REPL prompt), with and without the
+resident dispatcher, and how long the next call takes once it has.
+"""
+import time
+
+from microperi.microperi import Device, Timeout
+
+from benchmarks.common import parser, port, report
+
+
+def main():
+    p = parser(__doc__)
+    p.add_argument('--timeout', type=float, default=0.1,
+                   help='seconds each hung call is allowed (default: '
+                        '%(default)s)')
+    args = p.parse_args()
+    runs = max(1, args.runs // 5)
+    for rpc in (False, True):
+        label = 'rpc' if rpc else 'source'
+        device = Device(port=port(args))
+        device.open(rpc=rpc)
+        microbit = device.microbit
+        try:
+            microbit.running_time()
+            overruns, recoveries, next_calls = [], [], []
+            for _ in range(runs):
+                start = time.perf_counter()
+                try:
+                    microbit.sleep(10 ** 6, _timeout=args.timeout)
+                except Timeout as e:
+                    overruns.append(time.perf_counter() - start -
+                                    args.timeout)
+                    recoveries.append(e.recovery)
+                start = time.perf_counter()
+                microbit.running_time()
+                next_calls.append(time.perf_counter() - start)
+            report('{}, past the timeout'.format(label), overruns)
+            report('{}, recovery'.format(label), recoveries)
+            report('{}, next call'.format(label), next_calls)
+        finally:
+            device.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+common.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Helpers shared by the MicroPeri benchmarks. Run them from the root of the
+repository, e.g:
+
+    python3 -m benchmarks.bench_execute
+
+or without hardware, against a simulated micro:bit:
+
+    python3 -m benchmarks.bench_execute --sim --latency 0.005
+"""
+import argparse
+import time
+
+from microperi.microperi import get_connection, close_connection
+from microperi.sim import SCHEME
+
+
+def parser(description):
+    """
+    Returns an argument parser with the options every benchmark understands.
+    """
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument('-n', '--runs', type=int, default=50,
+                   help='number of calls to time (default: %(default)s)')
+    p.add_argument('--port', help='port of the micro:bit to use')
+    p.add_argument('--sim', action='store_true',
+                   help='use a simulated micro:bit instead of hardware')
+    p.add_argument('--latency', type=float, default=0.0,
+                   help='seconds the simulated micro:bit takes to start '
+                        'each command (default: %(default)s)')
+    p.add_argument('--baudrate', type=int, default=115200,
+                   help='throughput limit of the simulated serial line, '
+                        'or 0 for none (default: %(default)s)')
+    return p
+
+
+def port(args):
+    """
+    Returns the port to benchmark against: a microbit-sim:// URL with --sim,
+    otherwise --port (None meaning the first micro:bit found).
+    """
+    if args.sim:
+        return '{}?latency={}&baudrate={}'.format(SCHEME, args.latency,
+                                                  args.baudrate)
+    return args.port
+
+
+def connect(args):
+    """
+    Returns a raw REPL connection to the micro:bit to benchmark against.
+    """
+    return get_connection(port(args))
+
+
+def disconnect(connection):
+    close_connection(connection)
+
+
+def timed(fn, runs):
+    """
+    Calls fn runs times and returns a list of how long each call took.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    """
+    Prints a one line summary of timings (in seconds) as milliseconds.
+    """
+    timings = sorted(timings)
+    n = len(timings)
+    median = timings[n // 2]
+    p95 = timings[min(n - 1, int(n * 0.95))]
+    print('{:<28} n={:<5d} median {:9.3f} ms  p95 {:9.3f} ms  '
+          'min {:9.3f} ms'.format(label, n, median * 1000, p95 * 1000,
+                                  timings[0] * 1000))
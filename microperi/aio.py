@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+aio.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+asyncio support: an AsyncDevice whose Shims are awaited rather than
+blocking, so that one event loop can drive several micro:bits and many
+concurrent callers without any threads sleeping.
+
+    device = AsyncDevice()
+    await device.open()
+    x = await device.microbit.accelerometer.get_x()
+
+Posix only, like serial.aio which it's built on, except with a simulated
+micro:bit (a microbit-sim:// port, see sim.py).
+"""
+import asyncio
+import threading
+from collections import deque
+
+from serial import Serial
+from serial.aio import SerialTransport
+
+from .microperi import find_microbit, repr_args, RAW_REPL_PROMPT, \
+    RECOVERY_TIMEOUT
+from .decoder import decode
+
+
+__all__ = ['AsyncDevice', 'AsyncShim', 'RawReplProtocol', 'ThreadTransport']
+
+
+class RawReplProtocol(asyncio.Protocol):
+    """
+    Splits the output of a micro:bit in raw mode into responses.
+
+    Requests are queued and written one at a time, each as soon as the
+    response to the previous one is complete. A request's future gets the
+    raw response (from OK up to the final prompt). Futures which have been
+    cancelled, for example by a timeout, still have their response read off
+    the connection so that the ones behind them stay in step.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.connected = asyncio.get_running_loop().create_future()
+        self._buffer = bytearray()
+        self._queue = deque()  # (data, future) pairs not yet written
+        self._current = None  # Future of the request being answered
+        self._expecting = None  # (prompt, future) during the handshake
+        self._interrupted = None  # (request future, future) for interrupt()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.connected.set_result(True)
+
+    def connection_lost(self, exc):
+        error = exc or IOError('Connection to micro:bit lost.')
+        futures = [f for _, f in self._queue]
+        if self._current is not None:
+            futures.append(self._current)
+        if self._expecting is not None:
+            futures.append(self._expecting[1])
+        if self._interrupted is not None:
+            futures.append(self._interrupted[1])
+        self._queue.clear()
+        self._current = self._expecting = self._interrupted = None
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    def data_received(self, data):
+        self._buffer.extend(data)
+        if self._expecting is not None:
+            prompt, future = self._expecting
+            end = self._buffer.find(prompt)
+            if end >= 0:
+                del self._buffer[:end + len(prompt)]
+                self._expecting = None
+                if not future.done():
+                    future.set_result(True)
+        while self._current is not None:
+            # A response is complete once the CTRL-D after stdout is
+            # followed by the CTRL-D and prompt after stderr.
+            first = self._buffer.find(b'\x04')
+            if first < 0:
+                break
+            end = self._buffer.find(b'\x04>', first + 1)
+            if end < 0:
+                break
+            response = bytes(self._buffer[:end + 2])
+            del self._buffer[:end + 2]
+            future, self._current = self._current, None
+            if not future.done():
+                future.set_result(response)
+            if self._interrupted is not None and \
+                    self._interrupted[0] is future:
+                self._interrupted[1].set_result(True)
+                self._interrupted = None
+            self._write_next()
+
+    def expect(self, prompt, keys):
+        """
+        Writes keys and returns a future which is resolved once prompt has
+        been received. Used for the handshake.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.clear()
+        self._expecting = (prompt, future)
+        self.transport.write(keys)
+        return future
+
+    def request(self, data):
+        """
+        Queues data (a command ending with CTRL-D) to be written, and returns
+        a future for its response.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((data, future))
+        self._write_next()
+        return future
+
+    def interrupt(self, future):
+        """
+        Interrupts the request whose future is given with CTRL-C, if it's
+        the one being answered. Returns a future which is resolved once
+        its response has been read, and the requests behind it can go
+        ahead.
+        """
+        done = asyncio.get_running_loop().create_future()
+        if future is self._current:
+            self._interrupted = (future, done)
+            self.transport.write(b'\x03')
+        else:
+            done.set_result(True)  # Answered already, or never sent.
+        return done
+
+    def _write_next(self):
+        while self._current is None and self._queue:
+            data, future = self._queue.popleft()
+            if future.done():
+                continue  # Cancelled before it was sent.
+            self._current = future
+            self.transport.write(data)
+
+
+class ThreadTransport(asyncio.Transport):
+    """
+    A transport for a serial-like connection without a file descriptor for
+    the event loop to watch, such as a simulated micro:bit. A thread reads
+    from it, handing what arrives to the protocol on the loop.
+    """
+
+    def __init__(self, loop, protocol, serial):
+        asyncio.Transport.__init__(self)
+        self._loop = loop
+        self._protocol = protocol
+        self.serial = serial
+        self._closing = False
+        self._thread = threading.Thread(target=self._read,
+                                        name='microperi-aio', daemon=True)
+        loop.call_soon(protocol.connection_made, self)
+        # Only start reading when connection_made() has been called.
+        loop.call_soon(self._thread.start)
+
+    def _read(self):
+        serial = self.serial
+        while not self._closing:
+            try:
+                data = serial.read(max(1, serial.in_waiting))
+                if data and not self._closing:
+                    self._loop.call_soon_threadsafe(
+                        self._protocol.data_received, data)
+            except (IOError, RuntimeError):
+                break  # Closed, or the loop has gone.
+
+    def write(self, data):
+        self.serial.write(data)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self.serial.close()
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+
+class AsyncShim:
+    """
+    The asyncio equivalent of Shim: attributes make child shims, and calling
+    one returns a coroutine for the result.
+
+    As with Shim, keyword arguments starting with an underscore are not sent.
+    _timeout overrides the device's default timeout for the call.
+    """
+
+    def __init__(self, name, device):
+        self.name = name
+        self.device = device
+
+    async def __call__(self, *args, **kwargs):
+        return await self.device._call(self, args, kwargs)
+
+    def __getattr__(self, attr_name):
+        if attr_name.startswith('__'):
+            raise AttributeError(attr_name)
+        child = AsyncShim('{}.{}'.format(self.name, attr_name), self.device)
+        self.__dict__[attr_name] = child
+        return child
+
+    def __repr__(self):
+        return self.name
+
+
+class AsyncDevice:
+    """
+    Represents a micro:bit device, driven from an asyncio event loop.
+
+    If port is not given, the first micro:bit found is used, and a
+    microbit-sim:// URL uses a simulated one. timeout is the default number
+    of seconds to wait for a response, or None to wait forever.
+
+    Modules are imported on the micro:bit as part of the first call which
+    uses them, so they cost no extra round trip.
+    """
+
+    def __init__(self, port=None, timeout=None):
+        self.port = port
+        self.timeout = timeout
+        self.transport = None
+        self.protocol = None
+        self.modules = {}
+        self._imported = set()
+
+    async def open(self, timeout=2.0, soft_reset=True):
+        """
+        Connects and brings the micro:bit into raw mode, reacting to its
+        prompts like Handshake does. Raises IOError if that takes longer
+        than timeout seconds.
+        """
+        port = self.port or find_microbit()
+        if port is None:
+            raise IOError('Could not find micro:bit.')
+        self.protocol = RawReplProtocol()
+        loop = asyncio.get_running_loop()
+        if port.startswith('microbit-sim://'):
+            from . import sim
+            self.transport = ThreadTransport(loop, self.protocol,
+                                             sim.from_url(port))
+        else:
+            serial = Serial(port, 115200, parity='N')
+            self.transport = SerialTransport(loop, self.protocol, serial)
+        try:
+            await asyncio.wait_for(self._handshake(soft_reset), timeout)
+        except asyncio.TimeoutError:
+            self.transport.close()
+            raise IOError('micro:bit did not respond to the handshake.')
+        self._imported.clear()
+
+    async def _handshake(self, soft_reset):
+        await self.protocol.connected
+        await self.protocol.expect(b'>>> ', b'\x03\x03\x02')
+        await self.protocol.expect(RAW_REPL_PROMPT, b'\x01')
+        if soft_reset:
+            await self.protocol.expect(RAW_REPL_PROMPT, b'\x04')
+
+    def close(self):
+        if self.transport is not None:
+            # CTRL-B to get out of raw mode, then CTRL-D for soft reset.
+            self.transport.write(b'\x02\x04')
+            self.transport.close()
+            self.transport = None
+
+    async def execute(self, command, timeout=None):
+        """
+        Runs command (Python source) on the micro:bit.
+
+        Returns the stdout and stderr output from the micro:bit. Raises
+        asyncio.TimeoutError if no response arrives within timeout seconds
+        (by default, the device's timeout). By then the command has been
+        interrupted with CTRL-C, so the requests behind it can go ahead. If
+        the micro:bit doesn't get back to the prompt within
+        RECOVERY_TIMEOUT seconds, the connection is closed instead.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        protocol = self.protocol
+        future = protocol.request(command.encode('utf-8') + b'\x04')
+        try:
+            response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            try:
+                await asyncio.wait_for(protocol.interrupt(future),
+                                       RECOVERY_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.transport.close()
+            raise
+        out, err = response[2:-2].split(b'\x04', 1)
+        return out, err
+
+    async def _call(self, shim, args, kwargs):
+        command = 'print(repr({}({})))'.format(shim.name,
+                                               repr_args(args, kwargs))
+        module = shim.name.split('.', 1)[0]
+        if module not in self._imported:
+            command = 'import {}\n{}'.format(module, command)
+        out, err = await self.execute(command, kwargs.get('_timeout'))
+        if err:
+            raise IOError(err)
+        self._imported.add(module)
+        return decode(out)
+
+    def __getattr__(self, attr_name):
+        if attr_name.startswith('__'):
+            raise AttributeError(attr_name)
+        shim = self.modules.get(attr_name)
+        if shim is None:
+            shim = self.modules[attr_name] = AsyncShim(attr_name, self)
+        return shim
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+broker.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Shares one micro:bit between many processes. Only one process can hold the
+serial port, so the broker holds it and serves calls made by clients over a
+Unix domain socket:
+
+    $ microperi-broker --socket /tmp/microperi.sock
+
+and then, in any number of processes:
+
+    device = BrokerDevice('/tmp/microperi.sock')
+    device.open()
+    print(device.microbit.button_a.is_pressed())
+
+The broker's Device runs in threaded mode (see worker.py), so calls from
+different clients which arrive together share round trips. Identical reads
+which are in flight at the same time, such as several clients polling
+button_a.is_pressed(), are only made once.
+
+Frames in both directions are a little-endian unsigned int length followed
+by a tuple in the format of wire.py. Requests are (id, kind, name, args,
+kwargs), where kind is C to call name, E to evaluate name as an expression
+or X to execute name as source. The only underscore keyword argument a C
+request passes on is _timeout, and the args of an E request are its
+timeout. The args of an X request are the modules the client has used but
+not had imported, the name and source of the helper it needs (see
+Device._execute_helped()) and its timeout: the broker keeps track of what
+its micro:bit has, since that can be reset without clients knowing.
+Responses are (id, status, value), with a status of 0 for a result, 1 for
+an error message or 2 for a Timeout, whose value is its arguments. Values
+wire.py can't pack are sent as their repr, tagged R with a four-byte
+length.
+"""
+import argparse
+import itertools
+import os
+import re
+import socket
+import stat
+import struct
+import tempfile
+import threading
+from concurrent.futures import Future
+
+from .decoder import decode
+from .microperi import Device, MODULE_NAME, Timeout, repr_args
+from .wire import pack, unpack, Unencodable
+
+
+__all__ = ['Broker', 'BrokerDevice', 'DEFAULT_PATH', 'main']
+
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'microperi.sock')
+
+# The error Device raises for a module it couldn't import.
+IMPORT_ERROR = re.compile(r'Could not import (\w+) ')
+
+# Calls which only read state, so that concurrent identical ones can share a
+# single result. Reads which also clear what they return, such as
+# button_a.get_presses(), aren't among them: only one caller should get it.
+READS = re.compile(r'\.(get_(?!presses$|gestures$|events$)\w+|is_\w+|'
+                   r'read_\w+|current_\w+|temperature|running_time|heading|'
+                   r'scan)$')
+
+
+def pack_any(value, out):
+    """
+    Like wire.pack(), but anything it can't pack is sent as its repr.
+    """
+    kind = type(value)
+    if (kind is tuple or kind is list) and len(value) <= 0xff:
+        out += (b't' if kind is tuple else b'l') + bytes((len(value),))
+        for item in value:
+            pack_any(item, out)
+        return
+    try:
+        pack(value, out)
+    except Unencodable:
+        data = repr(value).encode('utf-8')
+        out += b'R' + struct.pack('<I', len(data)) + data
+
+
+def send_frame(sock, message):
+    body = bytearray()
+    pack_any(message, body)
+    sock.sendall(struct.pack('<I', len(body)) + body)
+
+
+def read_frame(stream):
+    """
+    Returns the next message from stream (a binary file), or None at the
+    end of the stream.
+    """
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    length = struct.unpack('<I', header)[0]
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    return unpack(body)[0]
+
+
+class Broker:
+    """
+    Serves the micro:bit behind device (which it opens in threaded mode) to
+    clients connecting to the Unix domain socket at path.
+
+    stats counts the requests served, and how many of them were coalesced
+    with an identical read already in flight.
+    """
+
+    def __init__(self, device, path=DEFAULT_PATH):
+        self.device = device
+        self.path = path
+        self.stats = {'requests': 0, 'coalesced': 0}
+        self._socket = None
+        self._inflight = {}  # (name, repr(args)) to the Future of a read
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        """
+        Accepts clients until close() is called.
+
+        A socket left at path by a broker which has gone is replaced, but
+        IOError is raised if a broker is still listening there or path is
+        something else.
+        """
+        self._remove_stale()
+        self.device.open(threaded=True)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.path)
+        self._socket.listen(64)
+        while True:
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                break  # Closed.
+            threading.Thread(target=self._serve, args=(client,),
+                             daemon=True).start()
+
+    def _remove_stale(self):
+        try:
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise IOError('{} exists and is not a socket.'.format(self.path))
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except ConnectionRefusedError:
+            os.unlink(self.path)  # Nothing is listening.
+            return
+        finally:
+            probe.close()
+        raise IOError('A broker is already listening on {}.'.format(
+            self.path))
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _serve(self, client):
+        stream = client.makefile('rb')
+        lock = threading.Lock()  # Responses are written from many threads.
+
+        def respond(request_id, future):
+            error = future.exception()
+            if error is None:
+                message = (request_id, 0, future.result())
+            elif isinstance(error, Timeout):
+                message = (request_id, 2, (error.timeout, error.output,
+                                           error.recovery))
+            elif len(error.args) == 1 and \
+                    isinstance(error.args[0], (bytes, bytearray)):
+                # The micro:bit's own error output, as Device raises it.
+                message = (request_id, 1, bytes(error.args[0]))
+            else:
+                message = (request_id, 1, str(error))
+            with lock:
+                try:
+                    send_frame(client, message)
+                except OSError:
+                    pass  # The client has gone.
+                except Exception as e:
+                    # Otherwise the client would wait for ever.
+                    try:
+                        send_frame(client, (request_id, 1,
+                                            'Could not send result: {}: {}'
+                                            .format(type(e).__name__, e)))
+                    except OSError:
+                        pass
+        try:
+            while True:
+                message = read_frame(stream)
+                if message is None:
+                    break
+                request_id = message[0]
+                future = self._handle(*message[1:])
+                future.add_done_callback(
+                    lambda f, request_id=request_id: respond(request_id, f))
+        finally:
+            stream.close()
+            client.close()
+
+    def _handle(self, kind, name, args, kwargs):
+        with self._lock:
+            self.stats['requests'] += 1
+        try:
+            if kind == 'X':
+                return self.device.submit(self._execute, name, *args)
+            if kind == 'E':
+                return self.device.submit(self._evaluate, name)
+            kwargs = dict(kwargs)
+            if kwargs or not READS.search(name):
+                return self.device.submit(self.device.shim(name), *args,
+                                          **kwargs)
+            return self._read(name, args)
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    def _read(self, name, args):
+        key = (name, repr(args))
+        shim = self.device.shim(name)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return future
+            future = self._inflight[key] = Future()
+        call = self.device.submit(shim, *args)
+
+        def done(call):
+            with self._lock:
+                del self._inflight[key]
+            error = call.exception()
+            if error is None:
+                future.set_result(call.result())
+            else:
+                future.set_exception(error)
+        call.add_done_callback(done)
+        return future
+
+    def _execute(self, command, modules=(), helper=None, source='',
+                 timeout=None):
+        for module in modules:
+            if not MODULE_NAME.match(module):
+                raise ValueError('Not a module name: {}'.format(module))
+            # Imported along with the command, if it hasn't been already.
+            self.device.shim(module)
+        kwargs = {} if timeout is None else {'timeout': timeout}
+        try:
+            if helper:
+                out, err = self.device._execute_helped(helper, source,
+                                                       command, **kwargs)
+            else:
+                out, err = self.device._run(command, **kwargs)
+        finally:
+            # The client's source could have changed anything.
+            if self.device.cache is not None:
+                self.device.cache.clear()
+        return bytes(out), bytes(err)
+
+    def _evaluate(self, expression, timeout=None):
+        # Imports the module, if it hasn't been already.
+        self.device.shim(expression.split('.', 1)[0])
+        kwargs = {} if timeout is None else {'timeout': timeout}
+        try:
+            out, err = self.device._run('print(repr({}))'.format(expression),
+                                        **kwargs)
+        finally:
+            if self.device.cache is not None:
+                self.device.cache.forget(expression.partition('(')[0])
+        if err:
+            raise IOError(err)
+        return decode(out)
+
+
+class BrokerDevice(Device):
+    """
+    A Device whose calls are made by a broker, so that it can share a
+    micro:bit with other processes. path is the broker's socket.
+
+    It can be used from several threads at once. Sampling, streaming
+    (including to the display), handles, transactions and the radio gateway
+    aren't possible through a broker.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        Device.__init__(self)
+        self.path = path
+        self._socket = None
+        self._receiver = None
+        self._connected = False
+        self._pending = {}  # Request id to Future
+        self._lock = threading.Lock()  # Guards _pending and _connected
+        self._ids = itertools.count()
+        self._send_lock = threading.Lock()
+
+    def open(self, rpc=False, threaded=False):
+        """
+        Connects to the broker, or connects again if the connection was
+        lost. rpc and threaded are accepted for compatibility with Device,
+        but it's up to the broker how calls are made.
+        """
+        if not self._connected:
+            self.close()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._socket = sock
+            self._connected = True
+            self._receiver = threading.Thread(target=self._receive,
+                                              args=(sock,), daemon=True)
+            self._receiver.start()
+
+    def close(self):
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # Ends _receive().
+            except OSError:
+                pass
+            sock.close()
+            self._receiver.join()
+            self._receiver = None
+
+    def _run(self, command, **kwargs):
+        return self._execute_helped(None, '', command, **kwargs)
+
+    def _execute_helped(self, name, helper, command, **kwargs):
+        modules = tuple(sorted(self._unimported))
+        timeout = kwargs.get('timeout', self.timeout)
+        try:
+            result = self._request('X', command,
+                                   (modules, name, helper, timeout), ())
+        except IOError as e:
+            # Forgets a module the broker couldn't import, as Device does.
+            failed = IMPORT_ERROR.match(str(e))
+            if failed is not None:
+                self._unimported.discard(failed.group(1))
+                self.modules.pop(failed.group(1), None)
+            raise
+        self._unimported.difference_update(modules)
+        return result
+
+    def sample(self, sensors=('accelerometer',), rate=50):
+        raise IOError('Sampling is not possible through a broker.')
+
+    def stream(self, code, lines=True):
+        raise IOError('Streaming is not possible through a broker.')
+
+    def display_stream(self, fps=None, window=2, drop=True):
+        raise IOError('Display streaming is not possible through a broker.')
+
+    def handle(self, expression, **kwargs):
+        raise IOError('Handles are not possible through a broker.')
+
+    def transaction(self):
+        raise IOError('Transactions are not possible through a broker.')
+
+    def radio_gateway(self, queue=10, max_messages=1000):
+        raise IOError('The radio gateway is not possible through a broker.')
+
+    def _send_call(self, shim, args, kwargs):
+        timeout = kwargs.get('_timeout', self.timeout)
+        kwargs = tuple((k, v) for k, v in kwargs.items()
+                       if not k.startswith('_'))
+        try:
+            pack((args, kwargs), bytearray())
+        except Unencodable:
+            # Send it as source instead, as Shim would.
+            return self._request('E', '{}({})'.format(
+                shim.name, repr_args(args, dict(kwargs))), (timeout,), ())
+        if timeout is not None:
+            kwargs += (('_timeout', timeout),)
+        return self._request('C', shim.name, args, kwargs)
+
+    def _request(self, kind, name, args, kwargs):
+        if self._socket is None:
+            self.open()
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            if not self._connected:
+                # Nothing would ever resolve the future.
+                raise IOError('Connection to broker lost.')
+            self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                send_frame(self._socket,
+                           (request_id, kind, name, args, kwargs))
+        except OSError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+        return future.result()
+
+    def _receive(self, sock):
+        stream = sock.makefile('rb')
+        try:
+            while True:
+                message = read_frame(stream)
+                if message is None:
+                    break
+                request_id, status, value = message
+                with self._lock:
+                    future = self._pending.pop(request_id)
+                if status == 2:
+                    future.set_exception(Timeout(*value))
+                elif status:
+                    future.set_exception(IOError(value))
+                else:
+                    future.set_result(value)
+        except OSError:
+            pass
+        finally:
+            stream.close()
+            with self._lock:
+                self._connected = False
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(IOError('Connection to broker lost.'))
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Shares a micro:bit between processes, serving calls '
+                    'over a Unix domain socket.')
+    p.add_argument('--port', help='port of the micro:bit (default: the '
+                                  'first one found)')
+    p.add_argument('--socket', default=DEFAULT_PATH,
+                   help='path of the socket (default: %(default)s)')
+    p.add_argument('--rpc', action='store_true',
+                   help='use the resident dispatcher (see wire.py)')
+    args = p.parse_args()
+    device = Device(port=args.port)
+    device.open(rpc=args.rpc)
+    broker = Broker(device, args.socket)
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
+        device.close()
+
+
+if __name__ == '__main__':
+    main()
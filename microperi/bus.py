@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+bus.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Queues I2C and SPI operations and runs them back to back on the micro:bit,
+costing one round trip for the lot rather than one per operation.
+
+    with device.transaction() as t:
+        t.i2c_write(0x1d, b'\\x01')
+        reading = t.i2c_read(0x1d, 6)
+        t.write_digital(16, 0)  # Chip select
+        reply = t.spi_write_readinto(b'\\x9f\\x00\\x00\\x00')
+        t.write_digital(16, 1)
+    print(reading.result(), reply.result())
+
+The operations are sent as a binary frame, read by the micro:bit from
+stdin, and the bytes read come back as one binary response. Both are
+escaped as the dispatcher's frames are (see wire.py), rather than being
+written out as bytes literals. The buses are used as they've been set up,
+e.g. with microbit.spi.init().
+"""
+import struct
+from concurrent.futures import Future
+
+from .pins import pin_number
+from .wire import escape, unescape
+
+
+__all__ = ['Transaction']
+
+
+# Runs on the micro:bit before the first transaction. _mpt(n) reads a frame
+# of n bytes from stdin, runs its operations in order and writes all of the
+# bytes they read to stdout, escaped. Each operation is a byte saying what
+# it is (W/R I2C write/read, w/r/x SPI write/read/write_readinto, P pin
+# write, S sleep) followed by its arguments; lengths are two bytes, little
+# endian.
+HELPER = """\
+import microbit as _mpm
+def _mpq(n):
+    b = bytearray()
+    e = 0
+    while len(b) < n:
+        while not _mpm.uart.any():
+            pass
+        for c in _mpm.uart.read(n - len(b)):
+            if e:
+                b.append(c ^ 64)
+                e = 0
+            elif c == 16:
+                e = 1
+            else:
+                b.append(c)
+    return b
+def _mpt(n):
+    b = _mpq(n)
+    o = bytearray()
+    i = 0
+    k = 0
+    while i < n:
+        t = b[i]
+        try:
+            if t == 87 or t == 82:
+                a = b[i + 1]
+                r = b[i + 2]
+                m = b[i + 3] | b[i + 4] << 8
+                i += 5
+                if t == 87:
+                    _mpm.i2c.write(a, b[i:i + m], r)
+                    i += m
+                else:
+                    o.extend(_mpm.i2c.read(a, m, r))
+            elif t == 119 or t == 120:
+                m = b[i + 1] | b[i + 2] << 8
+                d = b[i + 3:i + 3 + m]
+                i += 3 + m
+                if t == 119:
+                    _mpm.spi.write(d)
+                else:
+                    x = bytearray(m)
+                    _mpm.spi.write_readinto(d, x)
+                    o.extend(x)
+            elif t == 114:
+                o.extend(_mpm.spi.read(b[i + 1] | b[i + 2] << 8, b[i + 3]))
+                i += 4
+            elif t == 80:
+                getattr(_mpm, 'pin%d' % b[i + 1]).write_digital(b[i + 2])
+                i += 3
+            else:
+                _mpm.sleep(b[i + 1] | b[i + 2] << 8)
+                i += 3
+        except Exception as e:
+            raise RuntimeError('operation %d: %s' % (k, e))
+        k += 1
+    if 3 in o or 4 in o or 16 in o:
+        x = bytearray()
+        for c in o:
+            if c == 3 or c == 4 or c == 16:
+                x.append(16)
+                x.append(c ^ 64)
+            else:
+                x.append(c)
+        o = x
+    _mpm.uart.write(o)
+"""
+
+
+def check_length(n):
+    if not 0 <= n <= 0xffff:
+        raise ValueError('Too many bytes: {}'.format(n))
+    return n
+
+
+class Transaction:
+    """
+    Queues I2C and SPI operations to be run on the micro:bit together.
+
+    Operations which read return a Future, resolved with the bytes read
+    once the transaction is sent. Arguments are checked as operations are
+    queued, raising ValueError if they can't be sent.
+
+    If an operation fails on the micro:bit, those after it aren't run and
+    send() raises IOError, naming the operation by its position.
+
+    Use it via Device.transaction().
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.frame = bytearray()
+        self.reads = []  # (bytes expected, future) pairs
+        self.operations = 0
+
+    def i2c_write(self, addr, buf, repeat=False):
+        self._i2c(b'W', addr, len(buf), repeat)
+        self.frame += buf
+
+    def i2c_read(self, addr, n, repeat=False):
+        self._i2c(b'R', addr, n, repeat)
+        return self._read(n)
+
+    def spi_write(self, buf):
+        self.frame += b'w' + struct.pack('<H', check_length(len(buf))) + buf
+        self.operations += 1
+
+    def spi_read(self, n, out=0):
+        self.frame += b'r' + struct.pack('<HB', check_length(n), out)
+        self.operations += 1
+        return self._read(n)
+
+    def spi_write_readinto(self, buf):
+        """
+        Writes buf while reading as many bytes, which the Future returned
+        is resolved with.
+        """
+        self.frame += b'x' + struct.pack('<H', check_length(len(buf))) + buf
+        self.operations += 1
+        return self._read(len(buf))
+
+    def write_digital(self, pin, value):
+        if value not in (0, 1):
+            raise ValueError('Not a digital value: {!r}'.format(value))
+        self.frame += b'P' + bytes((pin_number(pin), int(value)))
+        self.operations += 1
+
+    def sleep(self, ms):
+        self.frame += b'S' + struct.pack('<H', check_length(ms))
+        self.operations += 1
+
+    def send(self):
+        """
+        Sends the queued operations and resolves their futures. Returns a
+        list of the bytes read, in order.
+        """
+        frame, reads = bytes(self.frame), self.reads
+        self.frame, self.reads, self.operations = bytearray(), [], 0
+        if not frame:
+            return []
+        try:
+            return self._send(frame, reads)
+        finally:
+            cache = self.device.cache
+            if cache is not None:
+                for prefix in ('microbit.i2c.', 'microbit.spi.',
+                               'microbit.pin'):
+                    cache.invalidate(prefix)
+
+    def _send(self, frame, reads):
+        try:
+            out, err = self.device._execute_helped(
+                '_mpt', HELPER, '_mpt({})'.format(len(frame)),
+                data=escape(frame))
+            if err:
+                raise IOError(err)
+            out = unescape(out)
+            if len(out) != sum(n for n, _ in reads):
+                raise IOError('Received {} bytes, not as many as were read.'
+                              .format(len(out)))
+        except IOError as e:
+            for _, future in reads:
+                future.set_exception(e)
+            raise
+        results = []
+        start = 0
+        for n, future in reads:
+            result = out[start:start + n]
+            start += n
+            future.set_result(result)
+            results.append(result)
+        return results
+
+    def cancel(self):
+        """
+        Discards the queued operations without sending them.
+        """
+        reads = self.reads
+        self.frame, self.reads, self.operations = bytearray(), [], 0
+        for _, future in reads:
+            future.cancel()
+
+    def _i2c(self, kind, addr, n, repeat):
+        if not 0 <= addr <= 0x7f:
+            raise ValueError('Not an I2C address: {!r}'.format(addr))
+        self.frame += kind + struct.pack('<BBH', addr, bool(repeat),
+                                         check_length(n))
+        self.operations += 1
+
+    def _read(self, n):
+        future = Future()
+        self.reads.append((n, future))
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.send()
+        else:
+            self.cancel()
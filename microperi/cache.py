@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+cache.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Caches the results of Shim calls which rarely change, so that repeating
+them doesn't cost a round trip.
+
+    device.cache = ResultCache({
+        'microbit.compass.is_calibrated': 60,
+        'microbit.display.read_light_level': 1,
+    })
+
+Only the paths given a time to live are cached. Any other call is assumed
+to change state, and removes the cached results it could affect: by
+default, those of its siblings (so display.show() forgets
+display.read_light_level(), and compass.calibrate() forgets
+compass.is_calibrated()). Calls of module-level functions such as
+microbit.sleep() forget nothing unless told to.
+
+Calls made in a batch forget in the same way once it's sent. Writes made
+through device.pins or a transaction forget the results of the pins or
+buses they use, and device.execute() forgets everything, since it could
+change anything.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .microperi import repr_args
+
+
+__all__ = ['ResultCache']
+
+
+class ResultCache:
+    """
+    A least recently used cache of up to maxsize results, keyed by path and
+    arguments.
+
+    ttls maps dotted Shim names to the seconds their results stay valid.
+    invalidates maps dotted names to the prefixes of the cached paths a
+    call of them should forget, replacing the default of its siblings,
+    e.g. {'microbit.reset': ['microbit.'], 'microbit.display.scroll': []}.
+
+    Results are shared between callers, so they shouldn't be modified.
+    """
+
+    def __init__(self, ttls, maxsize=256, invalidates=None):
+        self.ttls = dict(ttls)
+        self.maxsize = maxsize
+        self.invalidates = dict(invalidates or {})
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # (path, args) to (value, expiry)
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self, prefix):
+        """
+        Forgets the cached results of every path starting with prefix.
+        """
+        with self._lock:
+            stale = [key for key in self._entries
+                     if key[0].startswith(prefix)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def call(self, shim, args, kwargs, call):
+        """
+        Returns the cached result of shim(*args, **kwargs) if there's one,
+        otherwise call(shim, args, kwargs), caching it if shim's path has a
+        time to live.
+        """
+        path = shim.name
+        ttl = self.ttls.get(path)
+        if ttl is None:
+            try:
+                return call(shim, args, kwargs)
+            finally:
+                # Afterwards, so that a read racing with the call can't
+                # leave a result from before it behind.
+                self.forget(path)
+        key = (path, repr_args(args, kwargs))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = call(shim, args, kwargs)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def forget(self, path):
+        """
+        Forgets the cached results a call of path could have changed. A
+        path which is cached itself changes nothing.
+        """
+        if not self._entries or path in self.ttls:
+            return
+        prefixes = self.invalidates.get(path)
+        if prefixes is None:
+            parent = path.rpartition('.')[0]
+            # Module-level functions (microbit.sleep) have no siblings.
+            prefixes = [parent + '.'] if '.' in parent else []
+        for prefix in prefixes:
+            self.invalidate(prefix)
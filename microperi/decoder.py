@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+decoder.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Turns the repr of a result printed by the micro:bit back into a value.
+
+ast.literal_eval builds a whole syntax tree, even for True or 512. Most
+results are simpler than that (ints, floats, bools, None, plain strings and
+flat tuples or lists of ints, like accelerometer readings), so those are
+recognised and converted directly, with literal_eval kept for the rest.
+"""
+import ast
+import re
+from collections import Counter
+
+
+__all__ = ['Decoder', 'decode']
+
+
+INT = re.compile(rb'-?\d+\Z')
+FLOAT = re.compile(rb'-?(\d+\.\d*|\.\d+|\d+(?=[eE]))([eE][-+]?\d+)?\Z')
+INTS = re.compile(rb'-?\d+(, -?\d+)*\Z')
+
+CONSTANTS = {
+    b'True': ('bool', True),
+    b'False': ('bool', False),
+    b'None': ('none', None),
+    # MicroPython prints these for floats, but they aren't Python literals.
+    b'inf': ('float', float('inf')),
+    b'-inf': ('float', float('-inf')),
+    b'nan': ('float', float('nan')),
+}
+
+
+class Decoder:
+    """
+    Decodes results, counting in stats how many took each path: bool, none,
+    int, float, str, int_tuple, int_list or literal_eval.
+    """
+
+    def __init__(self):
+        self.stats = Counter()
+
+    def reset(self):
+        self.stats.clear()
+
+    def __call__(self, data):
+        """
+        Returns the value of data, the bytes (or bytearray) printed by
+        print(repr(...)).
+
+        Raises ValueError or SyntaxError, as literal_eval does, if data
+        isn't the repr of a literal.
+        """
+        data = bytes(data).strip()
+        path, value = self._decode(data)
+        self.stats[path] += 1
+        return value
+
+    def _decode(self, data):
+        constant = CONSTANTS.get(data)
+        if constant is not None:
+            return constant
+        if INT.match(data):
+            return 'int', int(data)
+        first = data[:1]
+        if first in (b'(', b'['):
+            inner = data[1:-1]
+            closing = b')' if first == b'(' else b']'
+            if data[-1:] == closing:
+                if first == b'(' and inner.endswith(b','):
+                    inner = inner[:-1]  # A tuple of one.
+                    if INT.match(inner):
+                        return 'int_tuple', (int(inner),)
+                elif not inner:
+                    return ('int_tuple', ()) if first == b'(' \
+                        else ('int_list', [])
+                elif INTS.match(inner):
+                    values = [int(v) for v in inner.split(b', ')]
+                    if first == b'(':
+                        return 'int_tuple', tuple(values)
+                    return 'int_list', values
+        elif first in (b"'", b'"'):
+            inner = data[1:-1]
+            # Only strings which needed no escaping can be taken as they are.
+            if data[-1:] == first and b'\\' not in inner and \
+                    first not in inner:
+                return 'str', inner.decode('utf-8')
+        elif FLOAT.match(data):
+            return 'float', float(data)
+        return 'literal_eval', ast.literal_eval(data.decode('utf-8'))
+
+
+# The decoder used for all Shim results.
+decode = Decoder()
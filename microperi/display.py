@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+display.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Streams frames to the micro:bit's display from a receiver running on it,
+rather than with a round trip per frame (display.show()) or per pixel
+(display.set_pixel()).
+
+    with device.display_stream(fps=30) as display:
+        for frame in frames:
+            display.show(frame)  # e.g. '09090:90909:90009:09090:00900'
+
+Each frame is compared with the last one sent, and only the pixels which
+changed are sent, as a letter for the pixel and a digit for its brightness.
+When more than half of them changed, the whole frame is sent instead, as 25
+digits. Frames are lines, so they never contain the bytes the raw REPL
+treats specially.
+
+The receiver acknowledges each frame once it's on the display. If the link
+falls behind, show() drops frames rather than let them queue up, so what's
+displayed stays current. The latest frame is always sent in the end.
+
+While streaming the micro:bit is busy, so the device can't be used for
+anything else until the stream is closed.
+"""
+import time
+
+from .stream import finish
+
+
+__all__ = ['DisplayStream', 'encode_frame']
+
+
+# Runs on the micro:bit. Applies each frame line received, writing a . once
+# it's on the display, until it receives Q.
+RECEIVER = """\
+from microbit import display, uart
+_b = b''
+_q = 0
+while not _q:
+    if not uart.any():
+        continue
+    _b += uart.read()
+    while not _q and b'\\n' in _b:
+        _l, _b = _b.split(b'\\n', 1)
+        if _l == b'Q':
+            _q = 1
+        elif len(_l) == 25:
+            for _i in range(25):
+                display.set_pixel(_i % 5, _i // 5, _l[_i] - 48)
+        else:
+            for _i in range(0, len(_l), 2):
+                _n = _l[_i] - 97
+                display.set_pixel(_n % 5, _n // 5, _l[_i + 1] - 48)
+        uart.write('.')
+"""
+
+DIGITS = b'0123456789'
+# Brightnesses 0 to 9 as digits, and anything else as a byte which isn't one.
+TO_DIGITS = DIGITS + bytes(246)
+
+
+def encode_frame(frame):
+    """
+    Returns frame as 25 bytes, b'0' to b'9', one per pixel row by row.
+
+    frame may be a str in the format of Image (e.g. '09090:90909:...'), a
+    sequence of 25 brightnesses or a sequence of 5 rows of 5. Raises
+    ValueError for anything else.
+    """
+    if isinstance(frame, str):
+        data = frame.replace(':', '').encode('ascii')
+    elif isinstance(frame, (bytes, bytearray)):
+        data = bytes(frame).translate(TO_DIGITS)
+    else:
+        try:
+            if len(frame) == 5:
+                frame = [value for row in frame for value in row]
+            data = bytes(48 + value for value in frame)
+        except (TypeError, ValueError):
+            data = b''
+    if len(data) != 25 or data.strip(DIGITS):
+        raise ValueError('Not a 5x5 frame: {!r}'.format(frame))
+    return data
+
+
+class DisplayStream:
+    """
+    Shows frames (see encode_frame()) on the micro:bit's display.
+
+    If fps is given, show() waits so that frames are sent no faster than
+    that. Once window frames are waiting to be acknowledged, the link is
+    behind and show() drops frames until it catches up, or if drop is false
+    waits for it to.
+
+    sent, dropped and unchanged count the frames sent, dropped and skipped
+    because nothing changed, and bytes_sent the bytes they took.
+
+    Use it via Device.display_stream().
+    """
+
+    def __init__(self, device, fps=None, window=2, drop=True):
+        self.device = device
+        self.period = 1.0 / fps if fps else 0.0
+        self.window = window
+        self.drop = drop
+        self.running = False
+        self.sent = 0
+        self.dropped = 0
+        self.unchanged = 0
+        self.bytes_sent = 0
+        self._shown = None  # The last frame sent
+        self._pending = None  # The latest frame dropped, if not sent since
+        self._in_flight = 0
+        self._next = 0.0
+
+    def start(self):
+        if self.running:
+            return
+        self.device._start_program(RECEIVER, 'Display streaming',
+                                   'display receiver')
+        self.running = True
+        self._shown = None
+        self._pending = None
+        self._in_flight = 0
+        self._next = time.monotonic()
+
+    def show(self, frame):
+        """
+        Sends frame to the display, unless the link is behind and frames are
+        being dropped. Returns whether it was sent.
+        """
+        frame = encode_frame(frame)
+        self.start()
+        if self.period:
+            wait = self._next - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+                self._next += self.period
+            else:
+                self._next = time.monotonic() + self.period
+        self._read_acks(False)
+        if self._in_flight >= self.window:
+            if self.drop:
+                self._pending = frame
+                self.dropped += 1
+                return False
+            while self._in_flight >= self.window:
+                self._read_acks(True)
+        self._send(frame)
+        return True
+
+    def flush(self, timeout=1.0):
+        """
+        Sends the latest frame if it was dropped, and waits (for up to
+        timeout seconds) until every frame sent is on the display.
+        """
+        if not self.running:
+            return
+        deadline = time.monotonic() + timeout
+        if self._pending is not None:
+            while self._in_flight >= self.window:
+                self._read_acks(True, deadline)
+            self._send(self._pending)
+        while self._in_flight:
+            self._read_acks(True, deadline)
+
+    def close(self, timeout=1.0):
+        """
+        Shows the latest frame, then stops the receiver and waits (for up to
+        timeout seconds) until the micro:bit is back at the raw REPL prompt.
+        """
+        if not self.running:
+            return
+        try:
+            self.flush(timeout)
+        finally:
+            self.running = False
+            connection = self.device.connection
+            connection.write(b'Q\n')
+            finish(connection, timeout)
+
+    def _send(self, frame):
+        shown = self._shown
+        self._pending = None
+        if shown is None:
+            line = frame
+        else:
+            changed = [i for i in range(25) if frame[i] != shown[i]]
+            if not changed:
+                self.unchanged += 1
+                return
+            if len(changed) > 12:
+                line = frame
+            else:
+                line = bytearray()
+                for i in changed:
+                    line.append(97 + i)
+                    line.append(frame[i])
+        self.device.connection.write(line + b'\n')
+        self._shown = frame
+        self._in_flight += 1
+        self.sent += 1
+        self.bytes_sent += len(line) + 1
+
+    def _read_acks(self, block, deadline=None):
+        connection = self.device.connection
+        waiting = connection.in_waiting
+        if not waiting and not block:
+            return
+        if deadline is not None and time.monotonic() > deadline:
+            raise IOError('micro:bit did not acknowledge the frames sent.')
+        data = connection.read(max(1, waiting))
+        end = data.find(b'\x04')
+        if end >= 0:
+            # The receiver ended by itself, so it must have failed.
+            self.running = False
+            raise IOError(self.device._program_ended(data[end + 1:]))
+        self._in_flight -= data.count(b'.')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
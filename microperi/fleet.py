@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+fleet.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Drives many micro:bits attached to the same host at once. Devices are opened
+and called concurrently from a thread pool, so the handshake and each round
+trip cost roughly the same for a whole rack as for a single micro:bit.
+
+    fleet = Fleet()
+    fleet.open()
+    for port, result in fleet.broadcast('microbit.temperature').items():
+        print(port, result.value if result.error is None else result.error)
+"""
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .microperi import Device, find_microbits
+
+
+__all__ = ['Fleet', 'Result']
+
+
+# The outcome of a call on one device: error is None if it succeeded.
+Result = namedtuple('Result', ['value', 'error'])
+
+
+class Fleet:
+    """
+    A set of micro:bits, keyed by port.
+
+    By default every attached micro:bit is used. ports restricts that to the
+    given ports, while devices (a dict of name to Device) can be given to
+    use existing Device objects instead.
+
+    Methods which call the devices take an optional list of keys to limit
+    the call to a subset, and return an OrderedDict of key to Result. One
+    device failing never stops the others.
+    """
+
+    def __init__(self, ports=None, devices=None, max_workers=None):
+        if devices is None:
+            if ports is None:
+                ports = find_microbits()
+            devices = OrderedDict((port, Device(port=port))
+                                  for port in ports)
+        self.devices = OrderedDict(devices)
+        self.max_workers = max_workers or max(1, len(self.devices))
+        self._pool = None
+
+    def open(self, keys=None, **kwargs):
+        """
+        Opens the devices in parallel, passing kwargs to Device.open().
+
+        Each Result's value is that device's handshake timings.
+        """
+        def open_device(device):
+            device.open(**kwargs)
+            return device.handshake_timings
+        return self.map(open_device, keys)
+
+    def close(self, keys=None):
+        results = self.map(lambda device: device.close(), keys)
+        if keys is None and self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        return results
+
+    def map(self, fn, keys=None):
+        """
+        Calls fn(device) for each device concurrently.
+        """
+        if keys is None:
+            keys = list(self.devices)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.max_workers)
+        futures = [(key, self._pool.submit(fn, self.devices[key]))
+                   for key in keys]
+        results = OrderedDict()
+        for key, future in futures:
+            try:
+                results[key] = Result(future.result(), None)
+            except Exception as e:
+                results[key] = Result(None, e)
+        return results
+
+    def broadcast(self, name, *args, **kwargs):
+        """
+        Calls the Shim with the dotted name (e.g. 'microbit.display.show')
+        on each device with the given arguments.
+
+        A keys keyword argument limits the call to those devices.
+        """
+        keys = kwargs.pop('keys', None)
+        return self.map(lambda device: device.shim(name)(*args, **kwargs),
+                        keys)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __getitem__(self, key):
+        return self.devices[key]
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+gateway.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Turns the micro:bit into a bridge between its radio and the host. A loop on
+the micro:bit drains the radio's queue, sending the messages it finds over
+the serial line together, and sends the messages the host passes it.
+
+    with device.radio_gateway(queue=10) as gateway:
+        gateway.send(b'hello', b'world')
+        for timestamp, payload in gateway:
+            print(timestamp, payload)
+
+Polling radio.receive() through a Shim costs a round trip per message, and
+messages arriving faster than that are lost once the radio's queue is full.
+
+Messages are dropped in two places when they can't be kept up with. If the
+radio's queue is found full, messages may have been lost on the micro:bit
+(its radio doesn't count them), which is counted in overflows. If more than
+max_messages are waiting on the host, the oldest are dropped and counted in
+dropped.
+
+While the gateway runs the micro:bit is busy, so the device can't be used
+for anything else until it's closed.
+"""
+import struct
+import threading
+from collections import deque, namedtuple
+
+from .wire import escape, unescape
+
+
+__all__ = ['RadioGateway', 'RadioMessage']
+
+
+# Runs on the micro:bit. Records from the host are S, a length and a payload
+# to send, or Q to quit. Records to the host are M, a length, the payload and
+# the timestamp radio.receive_full() gave it, or O when the radio's queue was
+# found full. Both ways they're escaped as the dispatcher's frames are.
+PROGRAM = """\
+from microbit import uart
+import radio
+import ustruct as _S
+radio.config(queue={queue})
+radio.on()
+_b = bytearray()
+_e = 0
+_q = 0
+while not _q:
+    if uart.any():
+        for _c in uart.read():
+            if _e:
+                _b.append(_c ^ 64)
+                _e = 0
+            elif _c == 16:
+                _e = 1
+            else:
+                _b.append(_c)
+        while _b:
+            if _b[0] == 81:
+                _q = 1
+                break
+            if len(_b) < 2 or len(_b) < 2 + _b[1]:
+                break
+            radio.send_bytes(bytes(_b[2:2 + _b[1]]))
+            _b = _b[2 + _b[1]:]
+    _o = bytearray()
+    _n = 0
+    while _n < {queue}:
+        _m = radio.receive_full()
+        if not _m:
+            break
+        _o.append(77)
+        _o.append(len(_m[0]))
+        _o.extend(_m[0])
+        _o.extend(_S.pack('<I', _m[2] & 0xffffffff))
+        _n += 1
+    if _n == {queue}:
+        _o.append(79)
+    if _o:
+        if 3 in _o or 4 in _o or 16 in _o:
+            _x = bytearray()
+            for _c in _o:
+                if _c == 3 or _c == 4 or _c == 16:
+                    _x.append(16)
+                    _x.append(_c ^ 64)
+                else:
+                    _x.append(_c)
+            _o = _x
+        uart.write(_o)
+radio.off()
+"""
+
+RadioMessage = namedtuple('RadioMessage', 'timestamp payload')
+
+
+class RadioGateway:
+    """
+    Runs the gateway loop on the micro:bit, with the radio's queue set to
+    hold queue messages, and iterates over the RadioMessages received.
+
+    start() (or entering it as a context manager) starts the loop, and
+    iterating ends once it has been closed and every message taken. A
+    thread reads the messages as they arrive, keeping up to max_messages
+    of them. received, dropped and overflows count the messages received,
+    those dropped on the host and the times the radio's queue was found
+    full (see gateway.py).
+
+    Use it via Device.radio_gateway().
+    """
+
+    def __init__(self, device, queue=10, max_messages=1000):
+        self.device = device
+        self.queue = queue
+        self.program = PROGRAM.format(queue=queue)
+        self.running = False
+        self.received = 0
+        self.dropped = 0
+        self.overflows = 0
+        self.error = None
+        self._messages = deque(maxlen=max_messages)
+        self._ready = threading.Condition()
+        self._partial = b''
+        self._thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.device._start_program(self.program, 'The radio gateway',
+                                   'radio gateway')
+        self.running = True
+        self.error = None
+        self._partial = b''
+        self._thread = threading.Thread(target=self._run,
+                                        name='microperi-radio', daemon=True)
+        self._thread.start()
+
+    def send(self, *payloads):
+        """
+        Sends each of payloads (bytes, up to 251 long) over the radio, all
+        passed to the micro:bit together.
+        """
+        frame = bytearray()
+        for payload in payloads:
+            if len(payload) > 251:
+                raise ValueError('Radio messages are at most 251 bytes.')
+            frame += b'S' + bytes((len(payload),)) + payload
+        if not self.running:
+            raise IOError('The radio gateway is not running.')
+        self.device.connection.write(escape(bytes(frame)))
+
+    def receive(self, timeout=None):
+        """
+        Returns the oldest RadioMessage not yet taken, waiting up to timeout
+        seconds (or for ever, if None) for one. Returns None if none
+        arrives, or the gateway has stopped.
+        """
+        with self._ready:
+            if not self._messages and self.running:
+                self._ready.wait_for(
+                    lambda: self._messages or not self.running, timeout)
+            if self._messages:
+                return self._messages.popleft()
+            if self.error is not None:
+                raise self.error
+            return None
+
+    def close(self, timeout=1.0):
+        """
+        Stops the gateway loop and waits (for up to timeout seconds) until
+        the micro:bit is back at the raw REPL prompt. Messages already
+        received can still be taken afterwards.
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        connection = self.device.connection
+        if self.running:
+            connection.write(b'Q')
+        thread.join(timeout)
+        if thread.is_alive():
+            connection.write(b'\x03')
+            thread.join(timeout)
+            if thread.is_alive():
+                raise IOError('micro:bit did not stop the radio gateway.')
+        self._thread = None
+
+    def _run(self):
+        connection = self.device.connection
+        buffer = bytearray()
+        try:
+            while True:
+                chunk = connection.read(max(1, connection.in_waiting))
+                end = chunk.find(b'\x04')
+                if end >= 0:
+                    # The loop has ended, after Q, CTRL-C or an error: the
+                    # rest is its error output up to the prompt.
+                    err = self.device._program_ended(chunk[end + 1:])
+                    if err and b'KeyboardInterrupt' not in err:
+                        self.error = IOError(err)
+                    chunk = chunk[:end]
+                buffer += chunk
+                # A trailing DLE starts an escape, so waits for its byte.
+                cut = len(buffer) - buffer.endswith(b'\x10')
+                self._parse(unescape(bytes(buffer[:cut])))
+                del buffer[:cut]
+                if end >= 0:
+                    break
+        except IOError as e:
+            self.error = e
+        except Exception as e:
+            self.error = IOError(e)
+        finally:
+            with self._ready:
+                self.running = False
+                self._ready.notify_all()
+
+    def _parse(self, data):
+        # A record split across reads is kept for the next time round.
+        data = self._partial + data
+        messages = []
+        overflows = 0
+        i = 0
+        while i < len(data):
+            if data[i] == 79:
+                overflows += 1
+                i += 1
+                continue
+            if i + 2 > len(data) or i + 6 + data[i + 1] > len(data):
+                break
+            n = data[i + 1]
+            payload = bytes(data[i + 2:i + 2 + n])
+            timestamp = struct.unpack_from('<I', data, i + 2 + n)[0]
+            messages.append(RadioMessage(timestamp, payload))
+            i += 6 + n
+        self._partial = data[i:]
+        with self._ready:
+            self.overflows += overflows
+            self.received += len(messages)
+            space = self._messages.maxlen - len(self._messages)
+            if len(messages) > space:
+                self.dropped += len(messages) - space
+            self._messages.extend(messages)
+            if messages:
+                self._ready.notify_all()
+
+    def __iter__(self):
+        while True:
+            message = self.receive()
+            if message is None:
+                return
+            yield message
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -9,47 +9,139 @@ MicroPeri is a library for using the BBC micro:bit with MicroPython as an
 external peripheral device or sensor, using an API which closely replicates
 the micro:bit's MicroPython API.
 """
+import itertools
+import re
+import threading
 import time
-import ast
+from collections import deque
+from concurrent.futures import Future
 from serial.tools.list_ports import comports as list_serial_ports
 from serial import Serial
+from .wire import Dispatcher, Unencodable
+from .sampler import Sampler
+from .stream import Stream, finish
+from .display import DisplayStream
+from .pins import Pins
+from .bus import Transaction
+from .gateway import RadioGateway
+from .probe import Probe
+from .worker import Worker
+from .mirror import Mirror
+from .decoder import decode
 
 
 __all__ = ['device']
 
 
+def find_microbits():
+    """
+    Finds the ports to which all of the attached devices are connected.
+    """
+    ports = list_serial_ports()
+    return [port[0] for port in ports
+            if "VID:PID=0D28:0204" in port[2].upper()]
+
+
 def find_microbit():
     """
     Finds the port to which the device is connected.
     """
-    ports = list_serial_ports()
-    for port in ports:
-        if "VID:PID=0D28:0204" in port[2].upper():
-            return port[0]
-    return None
+    ports = find_microbits()
+    return ports[0] if ports else None
+
+
+# What the micro:bit prints once it's ready for commands in raw mode.
+RAW_REPL_PROMPT = b'raw REPL; CTRL-B to exit\r\n>'
+
+MODULE_NAME = re.compile(r'^[A-Za-z_]\w*$')
+
+
+class Handshake:
+    """
+    Brings a micro:bit into raw mode, reacting to the prompts it prints
+    rather than sleeping for fixed periods in between.
+
+    The handshake runs through three phases:
+
+    - interrupt: CTRL-C twice to break out of any running program, then
+      CTRL-B to end up at the normal prompt whichever mode we started in.
+    - raw: CTRL-A, until the raw REPL prompt.
+    - reset: optionally, CTRL-D for a soft reset from within raw mode, which
+      comes back to the raw REPL prompt (without running main.py).
+
+    The whole handshake must finish within timeout seconds, otherwise
+    IOError is raised. The time spent in each phase is kept in timings.
+    """
+
+    def __init__(self, serial, timeout=2.0, soft_reset=True):
+        self.serial = serial
+        self.timeout = timeout
+        self.soft_reset = soft_reset
+        self.timings = {}
+        self._deadline = None
+
+    def run(self):
+        self.timings = {}
+        self._deadline = time.monotonic() + self.timeout
+        original_timeout = self.serial.timeout
+        # Read in short slices so that the deadline is honoured closely.
+        self.serial.timeout = 0.05
+        try:
+            self._phase('interrupt', b'\x03\x03\x02', [b'>>> '])
+            self.serial.reset_input_buffer()
+            self._phase('raw', b'\x01', [RAW_REPL_PROMPT])
+            if self.soft_reset:
+                self._phase('reset', b'\x04',
+                            [b'soft reboot\r\n', RAW_REPL_PROMPT])
+        finally:
+            self.serial.timeout = original_timeout
+        return self.timings
+
+    def _phase(self, name, keys, prompts):
+        start = time.monotonic()
+        self.serial.write(keys)
+        for prompt in prompts:
+            self._wait_for(name, prompt)
+        self.timings[name] = time.monotonic() - start
+
+    def _wait_for(self, name, prompt):
+        received = bytearray()
+        while not received.endswith(prompt):
+            if time.monotonic() > self._deadline:
+                raise IOError('micro:bit did not respond during the {} '
+                              'phase of the handshake.'.format(name))
+            received.extend(self.serial.read(1))
 
 
-def get_connection():
+def get_connection(port=None, timeout=2.0, soft_reset=True, timings=None):
     """
     Returns an object representing a serial connection to a BBC micro:bit
-    attached to the host computer.
+    attached to the host computer, in raw mode and ready for commands.
+
+    If port is not given, the first micro:bit found is used. A
+    microbit-sim:// URL connects to a simulated micro:bit (see sim.py)
+    instead. If a dict is given as timings, it is filled with the seconds
+    spent in each phase of the handshake (see Handshake).
 
     Otherwise, raises IOError.
     """
-    port = find_microbit()
+    if port is None:
+        port = find_microbit()
     if port is None:
         raise IOError('Could not find micro:bit.')
-    serial = Serial(port, 115200, timeout=1, parity='N')
-    serial.write(b'\x04')  # Send CTRL-D for soft reset.
-    time.sleep(0.1)
-    serial.write(b'\x03')  # Send CTRL-C to break out of potential loop.
-    time.sleep(0.1)
-    serial.read_until(b'\r\n>')  # Flush buffer until prompt.
-    time.sleep(0.1)
-    serial.write(b'\x01')  # Go into raw mode.
-    time.sleep(0.1)
-    serial.read_until(b'\r\n>OK')  # Flush buffer until raw mode prompt.
-    time.sleep(0.1)
+    if port.startswith('microbit-sim://'):
+        from . import sim
+        serial = sim.from_url(port)
+    else:
+        serial = Serial(port, 115200, timeout=1, parity='N')
+    handshake = Handshake(serial, timeout, soft_reset)
+    try:
+        handshake.run()
+    except IOError:
+        serial.close()
+        raise
+    if timings is not None:
+        timings.update(handshake.timings)
     return serial
 
 
@@ -62,26 +154,145 @@ def close_connection(serial):
     Otherwise, do nothing.
     """
     if serial.is_open:
-        serial.write(b'\x02')  # Send CTRL-B to get out of raw mode.
-        time.sleep(0.1)
-        serial.write(b'\x04')  # Finally, send CTRL-D for soft reset.
-        time.sleep(0.1)
+        # CTRL-B to get out of raw mode, then CTRL-D for soft reset. There's
+        # nothing to wait for other than the bytes leaving the host.
+        serial.write(b'\x02\x04')
+        serial.flush()
         serial.close()
 
 
-def execute(command, serial, delay=0.1):
+class Timeout(IOError):
+    """
+    Raised when the micro:bit doesn't finish a command in time.
+
+    By then the command has been interrupted with CTRL-C and the rest of
+    its response read, so the connection can be used again. timeout is the
+    number of seconds the command was allowed, output what it printed
+    before being interrupted and recovery the seconds it took to get back
+    to the raw REPL prompt afterwards. If the micro:bit didn't get back
+    there within RECOVERY_TIMEOUT seconds, recovery is None and the
+    connection should be re-opened.
+    """
+
+    def __init__(self, timeout, output=b'', recovery=None):
+        if recovery is None:
+            message = 'micro:bit did not respond within {} s, nor recover ' \
+                'from being interrupted.'.format(timeout)
+        else:
+            message = 'micro:bit did not respond within {} s (recovered ' \
+                'in {:.3f} s).'.format(timeout, recovery)
+        IOError.__init__(self, message)
+        self.timeout = timeout
+        self.output = output
+        self.recovery = recovery
+
+
+# Seconds allowed for getting back to the prompt after a Timeout.
+RECOVERY_TIMEOUT = 1.0
+
+# Longest a read blocks for while a deadline is being kept.
+READ_SLICE = 0.05
+
+
+def interrupt(serial, timeout, ctrl_ds=0):
+    """
+    Interrupts the running program with CTRL-C and reads what's left of its
+    response, of which ctrl_ds CTRL-Ds have already been read.
+
+    Returns the seconds that took, or None if the micro:bit wasn't back at
+    the raw REPL prompt within timeout seconds.
+    """
+    start = time.monotonic()
+    serial.write(b'\x03')
+    try:
+        finish(serial, timeout, ctrl_ds)
+    except IOError:
+        return None
+    return time.monotonic() - start
+
+
+def read_response(serial, timeout=None):
+    """
+    Reads a complete raw REPL response from the serial connection.
+
+    Rather than sleeping between polls, this blocks on the connection until
+    bytes arrive and returns the moment the closing CTRL-D and prompt have
+    been seen. The time taken is therefore bounded by the micro:bit instead
+    of by a fixed delay.
+
+    If the response hasn't arrived within timeout seconds, the program is
+    interrupted and Timeout raised.
+
+    Returns the raw response, including the leading OK and trailing prompt.
+    """
+    result = bytearray()
+    ctrl_ds = 0  # Number of CTRL-D characters seen so far.
+    if timeout is None:
+        while ctrl_ds < 2 or not result.endswith(b'\x04>'):
+            # Block for the first byte, then take whatever else has arrived.
+            chunk = serial.read(max(1, serial.in_waiting))
+            ctrl_ds += chunk.count(b'\x04')
+            result.extend(chunk)
+        return result
+    deadline = time.monotonic() + timeout
+    original_timeout = serial.timeout
+    serial.timeout = READ_SLICE
+    try:
+        while ctrl_ds < 2 or not result.endswith(b'\x04>'):
+            if time.monotonic() > deadline:
+                recovery = interrupt(serial, RECOVERY_TIMEOUT, ctrl_ds)
+                raise Timeout(timeout, bytes(result[2:].split(b'\x04')[0]),
+                              recovery)
+            chunk = serial.read(max(1, serial.in_waiting))
+            ctrl_ds += chunk.count(b'\x04')
+            result.extend(chunk)
+    finally:
+        serial.timeout = original_timeout
+    return result
+
+
+def execute(command, serial, delay=None, timeout=None, data=None):
     """
     Sends the command using the serial connection to a micro:bit and returns
     the result.
 
+    The command may be a str, or bytes if it's already been encoded. By
+    default the response is read as it arrives. If delay is given, the
+    connection is instead polled every delay seconds, as older versions did.
+    delay may also be an iterator of the seconds to wait before each poll,
+    such as AdaptivePoller.delays() (see poller.py) returns.
+
+    If timeout is given and the command hasn't finished within that many
+    seconds, it's interrupted and Timeout is raised.
+
+    data, if given, is written straight after the command for it to read
+    from stdin. It mustn't contain the bytes the raw REPL treats specially
+    (see wire.escape()).
+
     Returns the stdout and stderr output from the micro:bit.
     """
+    if not isinstance(command, bytes):
+        command = command.encode('utf-8')
     # Write the actual command and send CTRL-D to evaluate.
-    serial.write(command.encode('utf-8') + b'\x04')
-    result = bytearray()
-    while not result.endswith(b'\x04>'):  # Read until prompt.
-        time.sleep(delay)
-        result.extend(serial.read_all())
+    if data is None:
+        serial.write(command + b'\x04')
+    else:
+        serial.write(command + b'\x04' + data)
+    if delay is None:
+        result = read_response(serial, timeout)
+    else:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if isinstance(delay, (int, float)):
+            delay = itertools.repeat(delay)
+        result = bytearray()
+        while not result.endswith(b'\x04>'):  # Read until prompt.
+            if deadline is not None and time.monotonic() > deadline:
+                recovery = interrupt(serial, RECOVERY_TIMEOUT,
+                                     result.count(b'\x04'))
+                raise Timeout(timeout, bytes(result[2:].split(b'\x04')[0]),
+                              recovery)
+            time.sleep(next(delay))
+            result.extend(serial.read_all())
     out, err = result[2:-2].split(b'\x04', 1)  # Split stdout, stderr
     return out, err
 
@@ -92,6 +303,8 @@ def repr_args(args, kwargs):
 
     Note that keyword arguments that start with an underscore are filtered out.
     """
+    if not kwargs:
+        return ', '.join([repr(arg) for arg in args])
     # Positional args
     clean_args = []
     for arg in args:
@@ -112,54 +325,811 @@ class Shim:
     BBC micro:bit.
 
     Far too many shims (although it makes the code very very shimple).
+
+    Child shims are made once and then kept as attributes, and the parts of
+    the command which don't depend on the arguments are encoded up front,
+    so that only the arguments have to be formatted on each call.
     """
 
-    def __init__(self, name=None, connection=None):
+    def __init__(self, name=None, connection=None, device=None):
         self.name = name
         self.connection = connection
+        self.device = device
+        self._prefix = 'print(repr({}('.format(name).encode('utf-8')
 
     def __call__(self, *args, **kwargs):
-        complete_args = repr_args(args, kwargs)
-        command = "print(repr({}({})))".format(self.name, complete_args)
-        underscore_args = {k[1:]: v for k, v in kwargs.items() if k[0] == '_'}
-        out, err = execute(command, self.connection, **underscore_args)
+        if self.device is not None:
+            return self.device._call(self, args, kwargs)
+        return self._execute(self.connection, args, kwargs)
+
+    def _execute(self, connection, args, kwargs, header=b''):
+        command = header + self._prefix + \
+            repr_args(args, kwargs).encode('utf-8') + b')))'
+        if kwargs:
+            underscore_args = {k[1:]: v for k, v in kwargs.items()
+                               if k[0] == '_'}
+            out, err = execute(command, connection, **underscore_args)
+        else:
+            out, err = execute(command, connection)
         if err:
             raise IOError(err)
-        return ast.literal_eval(out.decode('utf-8'))
+        return decode(out)
 
     def __getattr__(self, attr_name):
-        return Shim('{}.{}'.format(self.name, attr_name), self.connection)
+        if attr_name.startswith('__'):
+            # Not a micro:bit attribute, e.g. copy looking for __setstate__.
+            raise AttributeError(attr_name)
+        child = Shim('{}.{}'.format(self.name, attr_name), self.connection,
+                     self.device)
+        # Remembered as a normal attribute, so __getattr__ isn't called for
+        # it again.
+        self.__dict__[attr_name] = child
+        return child
 
     def __repr__(self):
         return self.name
 
 
+class HandleRef:
+    """
+    Refers to an object kept in the handle table on the micro:bit. It's
+    released once release() is called or the ref (shared by a RemoteHandle
+    and its attributes) is garbage collected.
+    """
+
+    def __init__(self, device, key):
+        self.device = device
+        self.key = key
+        self.generation = device._generation
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            # Objects kept over an earlier connection have gone already.
+            if self.device._generation == self.generation:
+                self.device._released.append(self.key)
+
+    def __del__(self):
+        self.release()
+
+
+class RemoteHandle(Shim):
+    """
+    A Shim for an object kept on the micro:bit, such as an Image, so that
+    it's neither sent back nor sent again each time it's used. Made by
+    Device.handle() or by a call with _handle=True, e.g.
+
+        heart = device.handle('microbit.Image.HEART')
+        big = microbit.Image('90009:09090:00900:09090:90009', _handle=True)
+        microbit.display.show(big)  # Refers to the micro:bit's copy.
+        inverse = big.invert(_handle=True)
+
+    Its methods and attributes are Shims too, other than those whose names
+    start with a double underscore: MicroPython's built in types don't have
+    them as attributes, so operators have to be written out in source, as
+    in device.handle('{} * 0.5'.format(big)). The object is freed on the
+    micro:bit, with the next program or call sent, once release() is called
+    or the handle and everything got from it are garbage collected.
+    """
+
+    def __init__(self, name, connection, device, ref):
+        Shim.__init__(self, name, connection, device)
+        self.ref = ref
+
+    def release(self):
+        self.ref.release()
+
+    def __getattr__(self, attr_name):
+        if attr_name.startswith('__'):
+            raise AttributeError(attr_name)
+        child = RemoteHandle('{}.{}'.format(self.name, attr_name),
+                             self.connection, self.device, self.ref)
+        self.__dict__[attr_name] = child
+        return child
+
+
+# Runs on the micro:bit before the first handle is made. Kept objects go in
+# the _mph table, keyed by number. Defining it again leaves it as it was,
+# so a device shared through a broker keeps every client's objects.
+HANDLE_HELPER = """\
+try:
+    _mph
+except NameError:
+    _mph = {}
+    def _mpk(v, n=[0]):
+        n[0] += 1
+        _mph[n[0]] = v
+        return n[0]
+"""
+
+
+# Runs on the micro:bit before a batch. Each call's outcome is printed on its
+# own record, marked with an ASCII record separator so that anything printed
+# by the calls themselves can be told apart from the results.
+BATCH_HELPER = """\
+def _mpb(f):
+    try:
+        r = (0, f())
+    except Exception as e:
+        r = (1, '{}: {}'.format(type(e).__name__, e))
+    print('\\x1e' + repr(r))
+"""
+
+
+# Imports a module as part of the next program, stopping it with an error
+# which names the module if that fails.
+IMPORT = """\
+try: import {0}
+except ImportError as e: raise ImportError('microperi import {0}: %s' % e)
+"""
+IMPORT_FAILED = re.compile(rb'ImportError: microperi import (\w+): (.*)')
+
+
+# Runs on the micro:bit to import modules for Device.preload(), printing an
+# ASCII record separator for each followed by nothing or the error.
+PRELOAD = """\
+for _n in {!r}:
+    try:
+        globals()[_n] = __import__(_n)
+        print('\\x1e')
+    except Exception as e:
+        print('\\x1e{{}}: {{}}'.format(type(e).__name__, e))
+"""
+
+
+class Batch:
+    """
+    Records Shim calls so that they are sent to the micro:bit as a single
+    program, costing one round trip rather than one per call.
+
+    While the batch is active each Shim call returns a Future instead of a
+    value. The futures are resolved when the batch is sent, and a call which
+    failed on the micro:bit raises IOError from its own future only.
+
+    A call's _timeout applies to the whole batch, which is given the
+    smallest of them. Other underscore keyword arguments can't be batched
+    and raise ValueError. RemoteHandles passed to the calls are kept until
+    the batch has been sent, so that their objects aren't freed first.
+
+    Use it via Device.batch().
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.calls = []  # (expression, future) pairs
+        self.paths = []  # The Shim name of each call
+        self.refs = []  # HandleRefs of the RemoteHandles passed to calls
+        self.timeout = None
+        self._previous = None
+
+    def add(self, shim, args, kwargs):
+        for k in kwargs:
+            if k == '_timeout':
+                if self.timeout is None or kwargs[k] < self.timeout:
+                    self.timeout = kwargs[k]
+            elif k.startswith('_'):
+                raise ValueError('{} cannot be batched.'.format(k))
+        future = Future()
+        expression = '{}({})'.format(shim.name, repr_args(args, kwargs))
+        self.calls.append((expression, future))
+        self.paths.append(shim.name)
+        # Only the handles' names are recorded, so a handle made for the
+        # call alone would otherwise be released before the batch is sent.
+        for arg in itertools.chain(args, kwargs.values()):
+            if isinstance(arg, RemoteHandle):
+                self.refs.append(arg.ref)
+        return future
+
+    def send(self):
+        """
+        Sends all of the recorded calls and resolves their futures.
+        """
+        calls, self.calls = self.calls, []
+        paths, self.paths = self.paths, []
+        refs, self.refs = self.refs, []
+        timeout, self.timeout = self.timeout, None
+        if not calls:
+            return
+        try:
+            if self.device.probe is not None:
+                self.device.probe.measure('<batch>', self._send, calls,
+                                          timeout)
+            else:
+                self._send(calls, timeout)
+        finally:
+            # The calls may have changed what the cache holds, as they
+            # would have made one at a time.
+            cache = self.device.cache
+            if cache is not None:
+                for path in set(paths):
+                    cache.forget(path)
+            del refs  # The handles can be released from now on.
+
+    def _send(self, calls, timeout):
+        # The helper stays defined on the micro:bit until it's reset, so it
+        # only has to be sent with the first batch.
+        command = '\n'.join('_mpb(lambda: {})'.format(e) for e, _ in calls)
+        kwargs = {} if timeout is None else {'timeout': timeout}
+        try:
+            out, err = self.device._execute_helped('_mpb', BATCH_HELPER,
+                                                   command, **kwargs)
+        except IOError as e:
+            for _, future in calls:
+                future.set_exception(e)
+            raise
+        if err:
+            # The program as a whole failed, so no call can be trusted.
+            for _, future in calls:
+                future.set_exception(IOError(err))
+            return
+        records = out.split(b'\x1e')[1:]
+        for (_, future), record in zip(calls, records):
+            try:
+                failed, value = decode(record.splitlines()[0])
+            except (ValueError, SyntaxError) as e:
+                future.set_exception(e)
+                continue
+            if failed:
+                future.set_exception(IOError(value))
+            else:
+                future.set_result(value)
+        for _, future in calls[len(records):]:
+            future.set_exception(IOError('No result received for call.'))
+
+    def cancel(self):
+        """
+        Discards the recorded calls without sending them.
+        """
+        calls, self.calls = self.calls, []
+        self.paths, self.refs, self.timeout = [], [], None
+        for _, future in calls:
+            future.cancel()
+
+    def __enter__(self):
+        local = self.device._local
+        self._previous = getattr(local, 'batch', None)
+        local.batch = self
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.device._local.batch = self._previous
+        if type is None:
+            self.send()
+        else:
+            self.cancel()
+
+
 class Device:
     """
     Represents a micro:bit device.
+
+    If neither connection nor port is given, open() connects to the first
+    micro:bit found.
+
+    pins reads and writes many pins in one round trip (see pins.py).
+
+    Calls made with _handle=True return a RemoteHandle for their result,
+    which stays on the micro:bit. Such calls are made straight away, even
+    during a batch.
+
+    Setting cache to a ResultCache (see cache.py) caches the results of
+    the calls it's configured for. Setting poller to an AdaptivePoller (see
+    poller.py) polls for the responses to Shim calls sent as source on a
+    schedule learned for each path, rather than reading them as they
+    arrive.
+
+    If timeout is given, every command and Shim call which takes longer
+    than that many seconds is interrupted and raises Timeout. A single call
+    can be given its own with the _timeout keyword argument, e.g.
+    microbit.sleep(5000, _timeout=6).
     """
 
-    def __init__(self, connection=None):
+    def __init__(self, connection=None, port=None, timeout=None):
         self.connection = connection
+        self.port = port
+        self.timeout = timeout
         self.modules = {}
+        self.handshake_timings = {}
+        self.dispatcher = None
+        self.probe = None
+        self.cache = None
+        self.poller = None
+        self.worker = None
+        self._mirror = None
+        self._local = threading.local()  # The batch active in each thread
+        self._unimported = set()  # Modules to import before the next program
+        self._helpers = set()  # Helpers defined on the micro:bit, e.g. _mpb
+        self.pins = Pins(self)
+        self._generation = 0  # Connections made, so handles can tell theirs
+        self._program_modules = None  # Imported by the running program
+        self._released = deque()  # Handles to free with the next program
+
+    def open(self, rpc=False, threaded=False, preload=()):
+        """
+        Connects to the micro:bit, unless already connected.
 
-    def open(self):
-        if self.connection is None:
-            self.connection = get_connection()
-        if not self.connection.is_open:
-            self.connection = get_connection()
+        The modules named in preload are imported straight away, all in one
+        round trip (see preload()). IOError is raised if any can't be.
+
+        If rpc is true, the resident dispatcher (see wire.py) is installed
+        and Shim calls are sent in its binary format from then on. Calls it
+        can't express fall back to sending source.
+
+        If threaded is true, the device can be shared between threads: an
+        I/O thread (see worker.py) makes every call and Shim calls queued
+        at the same time are sent together. Sampling, streaming (including
+        to the display) and the radio gateway aren't possible in this
+        mode.
+        """
+        if self.connection is None or not self.connection.is_open:
+            self.handshake_timings = {}
+            self.connection = get_connection(self.port,
+                                             timings=self.handshake_timings)
+            self._helpers = set()
+            self._generation += 1
+            self._released.clear()
+            # Modules imported on an earlier connection have to be again.
+            self._unimported.update(self.modules)
+            if self.probe is not None:
+                self.connection = self.probe.wrap(self.connection)
+        if preload:
+            failures = self.preload(preload)
+            if failures:
+                raise IOError('Could not import {}'.format(', '.join(
+                    '{} ({})'.format(name, error)
+                    for name, error in failures.items())))
+        if rpc and self.dispatcher is None:
+            self.dispatcher = Dispatcher(self.connection)
+            self.dispatcher.install()
+        if threaded and self.worker is None:
+            self.worker = Worker(self)
+            self.worker.start()
 
     def close(self):
+        self.unmirror()
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+        self._stop_dispatcher()
+        self.dispatcher = None
         close_connection(self.connection)
 
+    def execute(self, command, **kwargs):
+        """
+        Runs command (Python source) on the micro:bit, stopping the
+        dispatcher first if it's running. timeout overrides the device's.
+        Any cached results are forgotten, as command could change anything.
+
+        Returns the stdout and stderr output from the micro:bit.
+        """
+        try:
+            return self._run(command, **kwargs)
+        finally:
+            if self.cache is not None:
+                self.cache.clear()
+
+    def _run(self, command, **kwargs):
+        # execute(), for programs whose effects are known.
+        if self.worker is not None and not self.worker.owns_thread():
+            return self.worker.submit(self._run, command, **kwargs).result()
+        if self.probe is not None:
+            return self.probe.measure('<execute>', self._execute, command,
+                                      kwargs)
+        return self._execute(command, kwargs)
+
+    def _execute(self, command, kwargs):
+        self._stop_dispatcher()
+        header, modules = self._import_header()
+        if header:
+            if not isinstance(command, bytes):
+                command = command.encode('utf-8')
+            command = header + command
+        if self.timeout is not None and 'timeout' not in kwargs:
+            kwargs = dict(kwargs, timeout=self.timeout)
+        out, err = execute(command, self.connection, **kwargs)
+        self._mark_imported(modules, err)
+        return out, err
+
+    def _execute_helped(self, name, helper, command, **kwargs):
+        """
+        Runs command like execute(), first defining the helper called name
+        (whose source is helper) unless it's on the micro:bit already.
+        """
+        if name not in self._helpers:
+            command = helper + command
+        out, err = self._run(command, **kwargs)
+        if not err:
+            self._helpers.add(name)
+        return out, err
+
+    def preload(self, names):
+        """
+        Imports the named modules in a single round trip, so that using
+        them later costs nothing extra.
+
+        Returns a dict of the name of each module which couldn't be
+        imported to the error message; the others are ready to use.
+        """
+        names = tuple(names)
+        for name in names:
+            if not MODULE_NAME.match(name):
+                raise ValueError('Not a module name: {}'.format(name))
+        out, err = self._run(PRELOAD.format(names))
+        if err:
+            raise IOError(err)
+        records = out.split(b'\x1e')[1:]
+        failures = {}
+        for name, record in zip(names, records):
+            error = record.strip().decode('utf-8')
+            if error:
+                failures[name] = error
+            else:
+                self._unimported.discard(name)
+                if name not in self.modules:
+                    self.modules[name] = Shim(name, self.connection, self)
+        for name in names[len(records):]:
+            failures[name] = 'No result received for import.'
+        return failures
+
+    def _import_header(self):
+        """
+        Returns the source which imports the modules used but not yet
+        imported, and the set of them. It also frees the objects of any
+        released handles.
+
+        A module which can't be imported stops the program with an error
+        naming it, which _mark_imported() turns into an IOError.
+        """
+        if not self._unimported and not self._released:
+            return b'', None
+        modules = set(self._unimported)
+        header = ''.join(IMPORT.format(name) for name in sorted(modules))
+        if self._released:
+            keys = []
+            while self._released:
+                keys.append(self._released.popleft())
+            header += 'for _k in {!r}: _mph.pop(_k, None)\n'.format(
+                tuple(keys))
+        return header.encode('utf-8'), modules or None
+
+    def _start_program(self, source, feature, program):
+        """
+        Starts source (Python source) running on the micro:bit, with the
+        imports due, without waiting for it to finish. For long-running
+        programs such as the Sampler's, whose output is read as it comes.
+
+        feature and program name them in errors: IOError is raised in
+        threaded mode, where the I/O thread owns the connection, or if the
+        micro:bit doesn't accept the program.
+        """
+        if self.worker is not None:
+            raise IOError('{} is not possible in threaded mode.'.format(
+                feature))
+        self._stop_dispatcher()
+        header, modules = self._import_header()
+        connection = self.connection
+        connection.write(header + source.encode('utf-8') + b'\x04')
+        if connection.read(2) != b'OK':
+            raise IOError('micro:bit did not accept the {}.'.format(program))
+        if modules:
+            self._unimported.difference_update(modules)
+        self._program_modules = modules
+
+    def _program_ended(self, rest, timeout=RECOVERY_TIMEOUT):
+        """
+        Reads what's left of the response of a program started by
+        _start_program() which has ended, given what followed the end of
+        its output (its first CTRL-D). Returns its error output.
+
+        Raises IOError if the micro:bit isn't back at the prompt within
+        timeout seconds, or naming the module if an import failed.
+        """
+        err = finish(self.connection, timeout, 1, rest)
+        modules, self._program_modules = self._program_modules, None
+        self._mark_imported(modules, err)
+        return err
+
+    def _mark_imported(self, modules, err):
+        """
+        Records that the modules imported by a program's header (see
+        _import_header()) have been, given the program's error output.
+
+        Raises IOError naming the module if one couldn't be imported. It's
+        forgotten, so that using it again tries again.
+        """
+        if not modules:
+            return
+        failed = IMPORT_FAILED.search(err) if err else None
+        if failed is None:
+            self._unimported.difference_update(modules)
+            return
+        name = failed.group(1).decode('utf-8')
+        self._unimported.discard(name)
+        self.modules.pop(name, None)
+        raise IOError('Could not import {} ({})'.format(
+            name, failed.group(2).decode('utf-8', 'replace').strip()))
+
+    def handle(self, expression, **kwargs):
+        """
+        Evaluates expression (Python source) on the micro:bit, keeping its
+        value there, and returns a RemoteHandle for it. kwargs are passed
+        on to execute(), e.g. timeout.
+        """
+        if self.worker is not None and not self.worker.owns_thread():
+            # Only the key comes back from the I/O thread, so that nothing
+            # there holds on to the handle.
+            key = self.worker.submit(self._keep, expression, kwargs).result()
+        else:
+            key = self._keep(expression, kwargs)
+        return RemoteHandle('_mph[{}]'.format(key), self.connection, self,
+                            HandleRef(self, key))
+
+    def _keep(self, expression, kwargs):
+        out, err = self._execute_helped(
+            '_mpk', HANDLE_HELPER, 'print(_mpk({}))'.format(expression),
+            **kwargs)
+        if err:
+            raise IOError(err)
+        return int(out)
+
+    def flush_releases(self):
+        """
+        Frees the objects of released handles on the micro:bit now, rather
+        than with the next program sent.
+        """
+        if not self._released:
+            return
+        if self.worker is not None and not self.worker.owns_thread():
+            self.worker.submit(self.flush_releases).result()
+        elif self.dispatcher is not None and self.dispatcher.running:
+            self._dispatch_releases()
+        else:
+            self._run('pass')
+
+    def _dispatch_releases(self):
+        # While the dispatcher is in use no program header is sent to free
+        # the objects, so it's asked to instead.
+        while self._released:
+            keys = []
+            while self._released and len(keys) < 255:
+                keys.append(self._released.popleft())
+            self.dispatcher.release(keys)
+
+    def shim(self, name):
+        """
+        Returns the Shim with a dotted name, e.g. 'microbit.display.show'.
+        """
+        module, _, path = name.partition('.')
+        shim = getattr(self, module)
+        for attr_name in path.split('.') if path else []:
+            shim = getattr(shim, attr_name)
+        return shim
+
+    def mirror(self, paths, interval=0.05, max_age=None):
+        """
+        Starts keeping the values of the Shims with the given dotted names
+        on the host, read every interval seconds, and returns the Mirror.
+        Calls of them are answered from the mirror while its values are no
+        older than max_age (see mirror.py).
+
+        The device is switched to threaded mode, so that the mirror can
+        read in the background.
+        """
+        self.unmirror()
+        self.open(threaded=True)
+        mirror = Mirror(self, paths, interval, max_age)
+        mirror.start()
+        self._mirror = mirror
+        return mirror
+
+    def unmirror(self):
+        """
+        Stops the mirror, if there is one.
+        """
+        mirror, self._mirror = self._mirror, None
+        if mirror is not None:
+            mirror.stop()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Returns a Future for fn(*args, **kwargs). If fn is a Shim, as in
+        device.submit(microbit.accelerometer.get_x), it can be batched with
+        calls from other threads.
+
+        Only available in threaded mode (see open()).
+        """
+        if self.worker is None:
+            raise IOError('Device was not opened with threaded=True.')
+        if isinstance(fn, Shim) and fn.device is self:
+            return self.worker.call(fn, args, kwargs)
+        return self.worker.submit(fn, *args, **kwargs)
+
+    def instrument(self, probe=None):
+        """
+        Starts recording the timings and sizes of calls into probe (by
+        default a new Probe, see probe.py), and returns it.
+        """
+        if probe is None:
+            probe = Probe()
+        self.probe = probe
+        if self.connection is not None:
+            self._set_connection(probe.wrap(self.connection))
+        return probe
+
+    def uninstrument(self):
+        """
+        Stops recording calls, returning the probe which was in use.
+        """
+        probe, self.probe = self.probe, None
+        if probe is not None and self.connection is not None:
+            self._set_connection(self.connection.connection)
+        return probe
+
+    def _set_connection(self, connection):
+        self.connection = connection
+        if self.dispatcher is not None:
+            self.dispatcher.connection = connection
+
+    def batch(self):
+        """
+        Returns a context manager which batches the Shim calls made inside
+        it into a single round trip. For example:
+
+            with device.batch():
+                x = microbit.accelerometer.get_x()
+                a = microbit.button_a.is_pressed()
+            print(x.result(), a.result())
+        """
+        return Batch(self)
+
+    def gather(self, *calls):
+        """
+        Makes each of the calls, which are callables making one Shim call
+        each (usually Shims themselves), in a single round trip.
+
+        Returns a list of the results in the same order.
+        """
+        with self.batch():
+            futures = [call() for call in calls]
+        return [future.result() for future in futures]
+
+    def sample(self, sensors=('accelerometer',), rate=50):
+        """
+        Returns a Sampler which streams readings of the given sensors from
+        a loop running on the micro:bit, rate times a second. See
+        sampler.py for the sensors which can be sampled.
+        """
+        return Sampler(self, sensors, rate)
+
+    def stream(self, code, lines=True):
+        """
+        Returns a Stream which runs code (Python source) on the micro:bit
+        and yields what it prints as it arrives, line by line if lines is
+        true or in chunks otherwise. See stream.py.
+        """
+        return Stream(self, code, lines)
+
+    def transaction(self):
+        """
+        Returns a Transaction which queues I2C and SPI operations to be run
+        on the micro:bit in one round trip. See bus.py.
+        """
+        return Transaction(self)
+
+    def display_stream(self, fps=None, window=2, drop=True):
+        """
+        Returns a DisplayStream which shows frames sent to a receiver
+        running on the micro:bit, at up to fps frames a second. Once window
+        frames are waiting to be shown, later ones are dropped (or if drop
+        is false, wait). See display.py.
+        """
+        return DisplayStream(self, fps, window, drop)
+
+    def radio_gateway(self, queue=10, max_messages=1000):
+        """
+        Returns a RadioGateway which runs a loop on the micro:bit passing
+        radio messages to and from the host in batches, with the radio's
+        queue holding queue messages. Up to max_messages received are kept
+        on the host. See gateway.py.
+        """
+        return RadioGateway(self, queue, max_messages)
+
+    def _call(self, shim, args, kwargs):
+        if kwargs and kwargs.get('_handle'):
+            try:
+                return self.handle('{}({})'.format(
+                    shim.name, repr_args(args, kwargs)), **{
+                        k[1:]: v for k, v in kwargs.items()
+                        if k[0] == '_' and k != '_handle'})
+            finally:
+                if self.cache is not None:
+                    self.cache.forget(shim.name)
+        batch = getattr(self._local, 'batch', None)
+        if batch is not None:
+            return batch.add(shim, args, kwargs)
+        if self.cache is not None:
+            return self.cache.call(shim, args, kwargs, self._call_uncached)
+        return self._call_uncached(shim, args, kwargs)
+
+    def _call_uncached(self, shim, args, kwargs):
+        mirror = self._mirror
+        if mirror is not None and shim.name in mirror.mirrored and \
+                not args and not kwargs:
+            fresh, value = mirror.get(shim.name)
+            if fresh:
+                return value
+        if self.worker is not None and not self.worker.owns_thread():
+            return self.worker.call(shim, args, kwargs).result()
+        return self._make_call(shim, args, kwargs)
+
+    def _make_call(self, shim, args, kwargs):
+        if self.probe is not None:
+            return self.probe.measure(shim.name, self._send_call, shim, args,
+                                      kwargs)
+        return self._send_call(shim, args, kwargs)
+
+    def _send_call(self, shim, args, kwargs):
+        if self.timeout is not None and '_timeout' not in kwargs:
+            kwargs = dict(kwargs, _timeout=self.timeout)
+        if self.dispatcher is not None:
+            if self._released:
+                self._dispatch_releases()
+            module = shim.name.split('.', 1)[0]
+            # The dispatcher imports the module when it looks the name up.
+            modules = {module} if module in self._unimported else None
+            try:
+                result = self.dispatcher.call(shim.name, args, kwargs)
+            except Unencodable:
+                pass
+            except IOError as e:
+                # Interrupted, it may not have got as far as the import.
+                if not isinstance(e, Timeout):
+                    self._mark_imported(modules, str(e).encode('utf-8'))
+                raise
+            else:
+                self._mark_imported(modules, b'')
+                return result
+        self._stop_dispatcher()
+        header, modules = self._import_header()
+        try:
+            if self.poller is not None and '_delay' not in kwargs:
+                result = self._poll_call(shim, args, kwargs, header)
+            else:
+                result = shim._execute(self.connection, args, kwargs, header)
+        except IOError as e:
+            err = e.args[0] if e.args else b''
+            self._mark_imported(modules, err if isinstance(
+                err, (bytes, bytearray)) else b'')
+            raise
+        self._mark_imported(modules, b'')
+        return result
+
+    def _poll_call(self, shim, args, kwargs, header):
+        schedule = self.poller.delays(shim.name)
+        try:
+            return shim._execute(self.connection, args,
+                                 dict(kwargs, _delay=schedule), header)
+        except Timeout:
+            schedule = None  # No response, so nothing to learn from.
+            raise
+        finally:
+            if schedule is not None:
+                self.poller.record(shim.name, schedule)
+
+    def _stop_dispatcher(self):
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+
     def __getattr__(self, attr_name):
+        if attr_name.startswith('__'):
+            raise AttributeError(attr_name)
         if attr_name in self.modules:
             return self.modules[attr_name]
-        # Using module for the first time, so try to import it
-        _, err = execute('import ' + attr_name, self.connection)
-        if err:
-            raise IOError(err)
-        shim = Shim(attr_name, self.connection)
+        # Using module for the first time. Rather than a round trip of its
+        # own, the import is sent along with the next program.
+        shim = Shim(attr_name, self.connection, self)
+        self._unimported.add(attr_name)
         self.modules[attr_name] = shim
         return shim
 
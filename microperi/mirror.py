@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+mirror.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Keeps a copy of chosen readings on the host, refreshed in the background,
+so that an application polling them in a loop doesn't wait on a round trip
+for each one.
+
+    device.mirror(['microbit.button_a.is_pressed',
+                   'microbit.accelerometer.get_values'], interval=0.05)
+    while True:
+        # Answered from the mirror while its copy is fresh enough.
+        if microbit.button_a.is_pressed():
+            print(microbit.accelerometer.get_values())
+
+All of the paths are read together in one batch, so the micro:bit sees one
+request per interval however often the application polls.
+"""
+import threading
+import time
+
+
+__all__ = ['Mirror']
+
+
+class Mirror:
+    """
+    Reads the Shims with the given dotted names (which must take no
+    arguments) every interval seconds on a background thread.
+
+    A call of one of them made without arguments is answered from the
+    mirror if its value is no older than max_age seconds (by default, twice
+    the interval). Otherwise the call goes to the micro:bit as usual.
+
+    hits and misses count the calls answered from the mirror and not, and
+    refreshes the round trips made to read the paths. If reading them fails
+    with anything other than an IOError, the background reads stop and the
+    exception is kept in error and raised by get() from then on.
+
+    Use it via Device.mirror().
+    """
+
+    def __init__(self, device, paths, interval=0.05, max_age=None):
+        self.device = device
+        self.paths = tuple(paths)
+        self.mirrored = frozenset(self.paths)
+        self.interval = interval
+        self.max_age = 2 * interval if max_age is None else max_age
+        self.values = {}  # Path to (value, time.monotonic() when read)
+        self.errors = {}  # Path to the exception from its last read
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.error = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self.error = None
+            self.refresh()  # So the first reads already find values.
+            self._thread = threading.Thread(target=self._run,
+                                            name='microperi-mirror',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def refresh(self):
+        """
+        Reads every path now, in a single round trip.
+        """
+        device = self.device
+        with device.batch():
+            futures = [device.shim(path)() for path in self.paths]
+        now = time.monotonic()
+        self.refreshes += 1
+        for path, future in zip(self.paths, futures):
+            error = future.exception()
+            if error is None:
+                self.values[path] = (future.result(), now)
+                self.errors.pop(path, None)
+            else:
+                self.errors[path] = error
+
+    def snapshot(self):
+        """
+        Returns a dict of each path to its latest (value, timestamp), the
+        timestamp being time.monotonic() when it was read.
+        """
+        return dict(self.values)
+
+    def get(self, path):
+        """
+        Returns (True, value) if there's a fresh enough value for path, or
+        (False, None) otherwise. Raises the error which stopped the
+        background reads, if there was one.
+        """
+        if self.error is not None:
+            raise self.error
+        entry = self.values.get(path)
+        if entry is not None and \
+                time.monotonic() - entry[1] <= self.max_age:
+            self.hits += 1
+            return True, entry[0]
+        self.misses += 1
+        return False, None
+
+    def _run(self):
+        deadline = time.monotonic()
+        while not self._stopping.is_set():
+            deadline += self.interval
+            try:
+                self.refresh()
+            except IOError:
+                pass  # Reads go to the micro:bit until this recovers.
+            except Exception as e:
+                self.error = e
+                return
+            wait = deadline - time.monotonic()
+            if wait > 0:
+                self._stopping.wait(wait)
+            else:
+                deadline = time.monotonic()
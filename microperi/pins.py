@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+pins.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Reads or writes many of the micro:bit's pins in a single round trip, rather
+than one per pin.
+
+    snapshot = device.pins.snapshot()
+    if snapshot.read_digital(5):
+        print(snapshot.read_analog(0))
+    device.pins.apply({0: 1, 'pin1': 0}, analog={2: 512})
+
+Pins are given by number or by name (e.g. 'pin0').
+"""
+from collections import namedtuple
+
+from .decoder import decode
+
+
+__all__ = ['Pins', 'PinSnapshot', 'DIGITAL_PINS', 'ANALOG_PINS']
+
+
+DIGITAL_PINS = tuple(range(17)) + (19, 20)
+ANALOG_PINS = (0, 1, 2, 3, 4, 10)
+
+# Runs on the micro:bit before the first snapshot or write. _mps reads the
+# pins set in the bitmasks d (digitally) and a (analog), returning the
+# digital values as a bitmask, a bitmask of the pins which couldn't be read
+# and the analog values (-1 if unreadable). _mpa looks every pin up before
+# writing any, so the writes happen as close together as they can.
+HELPER = """\
+import microbit as _mpm
+_mpP = [getattr(_mpm, 'pin%d' % _n, None) for _n in range(21)]
+def _mps(d, a):
+    m = 0
+    f = 0
+    r = [0, 0]
+    for n in range(21):
+        if d >> n & 1:
+            try:
+                if _mpP[n].read_digital():
+                    m |= 1 << n
+            except Exception:
+                f |= 1 << n
+    for n in range(21):
+        if a >> n & 1:
+            try:
+                r.append(_mpP[n].read_analog())
+            except Exception:
+                f |= 1 << n
+                r.append(-1)
+    r[0] = m
+    r[1] = f
+    return tuple(r)
+def _mpa(d, a):
+    w = [(_mpP[d[i]].write_digital, d[i + 1]) for i in range(0, len(d), 2)]
+    w += [(_mpP[a[i]].write_analog, a[i + 1]) for i in range(0, len(a), 2)]
+    for f, v in w:
+        f(v)
+"""
+
+
+def pin_number(pin):
+    """
+    Returns the number of pin, given as a number or a name such as 'pin0'.
+
+    Raises ValueError if there's no such pin.
+    """
+    number = pin
+    if isinstance(pin, str) and pin.startswith('pin'):
+        try:
+            number = int(pin[3:])
+        except ValueError:
+            pass
+    if number not in DIGITAL_PINS or isinstance(number, bool):
+        raise ValueError('No such pin: {!r}'.format(pin))
+    return number
+
+
+class PinSnapshot(namedtuple('PinSnapshot',
+                             'digital failed analog_pins analog')):
+    """
+    The pins read by Pins.snapshot(). digital and failed are bitmasks (bit
+    n for pin n) of the digital values read and of the pins which couldn't
+    be read. analog holds the readings of analog_pins, in the same order.
+    """
+    __slots__ = ()
+
+    def read_digital(self, pin):
+        return self.digital >> pin_number(pin) & 1
+
+    def read_analog(self, pin):
+        return self.analog[self.analog_pins.index(pin_number(pin))]
+
+
+class Pins:
+    """
+    Reads and writes the micro:bit's pins in bulk.
+
+    Use it via Device.pins.
+    """
+
+    def __init__(self, device):
+        self.device = device
+
+    def snapshot(self, digital=DIGITAL_PINS, analog=ANALOG_PINS):
+        """
+        Reads the digital values of the pins in digital and the analog
+        values of the pins in analog, all in one pass on the micro:bit.
+
+        Returns a PinSnapshot. A pin which can't be read, for example one
+        in use by the display, is marked as failed rather than failing the
+        whole snapshot.
+        """
+        analog_pins = tuple(sorted(set(pin_number(pin) for pin in analog)))
+        digital_mask = 0
+        for pin in digital:
+            digital_mask |= 1 << pin_number(pin)
+        analog_mask = 0
+        for pin in analog_pins:
+            analog_mask |= 1 << pin
+        values = self._run('print(_mps({}, {}))'.format(digital_mask,
+                                                        analog_mask))
+        return PinSnapshot(values[0], values[1], analog_pins,
+                           tuple(values[2:]))
+
+    def apply(self, digital=None, analog=None):
+        """
+        Writes the values of the dicts digital (pin to 0 or 1) and analog
+        (pin to 0 to 1023) to the pins, all in one round trip.
+
+        Every pin and value is checked before anything is sent, raising
+        ValueError if any is invalid, so that a mistake can't leave the
+        pins half written.
+        """
+        digital_pairs = []
+        for pin, value in (digital or {}).items():
+            if value not in (0, 1):
+                raise ValueError('Not a digital value: {!r}'.format(value))
+            digital_pairs.extend((pin_number(pin), int(value)))
+        analog_pairs = []
+        for pin, value in (analog or {}).items():
+            if isinstance(value, bool) or not isinstance(value, int) or \
+                    not 0 <= value <= 1023:
+                raise ValueError('Not an analog value: {!r}'.format(value))
+            analog_pairs.extend((pin_number(pin), value))
+        if digital_pairs or analog_pairs:
+            try:
+                self._run('_mpa({!r}, {!r})'.format(tuple(digital_pairs),
+                                                     tuple(analog_pairs)))
+            finally:
+                if self.device.cache is not None:
+                    self.device.cache.invalidate('microbit.pin')
+
+    def _run(self, command):
+        out, err = self.device._execute_helped('_mps', HELPER, command)
+        if err:
+            raise IOError(err)
+        return decode(out) if out else None
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+poller.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Chooses when to poll for the response to each Shim call, for connections
+which are polled rather than read as the response arrives (as execute() does
+when given a delay).
+
+    device.poller = AdaptivePoller()
+    microbit.display.get_pixel(0, 0)  # Polled on the schedule learned for
+                                      # microbit.display.get_pixel.
+    print(device.poller.snapshot())
+
+A fixed delay has to be guessed: too long and fast calls wait for nothing,
+too short and slow ones poll over and over. Instead, the poller keeps a
+moving estimate of how long each path takes to respond and first polls a
+little before it's due. A response which isn't there yet is polled for
+again after a short step, doubling each time.
+"""
+import threading
+
+
+__all__ = ['AdaptivePoller', 'Schedule']
+
+
+class Schedule:
+    """
+    Iterates over the seconds to wait before each poll for one response:
+    first, then steps starting at minimum and growing by backoff up to
+    maximum. waited is the total of the delays handed out so far, and
+    polls their number.
+    """
+
+    def __init__(self, first, minimum, maximum, backoff):
+        self.delay = first
+        self.step = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.waited = 0.0
+        self.polls = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        delay = self.delay
+        self.delay = self.step
+        self.step = min(self.step * self.backoff, self.maximum)
+        self.waited += delay
+        self.polls += 1
+        return delay
+
+
+class AdaptivePoller:
+    """
+    Learns how long the calls of each Shim path take to respond.
+
+    Paths without an estimate yet start from initial seconds. Each
+    response moves the estimate weight of the way towards the time waited
+    for it. The first poll is made after early times the estimate, then
+    after steps starting at minimum seconds and growing by backoff up to
+    maximum. A response which is there at the first poll may have taken
+    less time still, so the estimate keeps shrinking until one isn't.
+    """
+
+    def __init__(self, initial=0.01, minimum=0.001, maximum=0.25,
+                 weight=0.25, early=0.9, backoff=2.0):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.weight = weight
+        self.early = early
+        self.backoff = backoff
+        self.estimates = {}  # Path to seconds
+        self.calls = {}  # Path to responses recorded
+        self.polls = {}  # Path to polls made
+        self._lock = threading.Lock()
+
+    def delays(self, path):
+        """
+        Returns the Schedule to poll on for a response to a call of path.
+        """
+        estimate = self.estimates.get(path, self.initial)
+        return Schedule(max(self.minimum, estimate * self.early),
+                        self.minimum, self.maximum, self.backoff)
+
+    def record(self, path, schedule):
+        """
+        Updates the estimate for path with the Schedule a response arrived
+        on.
+        """
+        with self._lock:
+            estimate = self.estimates.get(path)
+            if estimate is None:
+                self.estimates[path] = schedule.waited
+            else:
+                self.estimates[path] = estimate + \
+                    self.weight * (schedule.waited - estimate)
+            self.calls[path] = self.calls.get(path, 0) + 1
+            self.polls[path] = self.polls.get(path, 0) + schedule.polls
+
+    def snapshot(self):
+        """
+        Returns a dict of each path to its estimate (in seconds), the
+        responses it was learned from and the polls made for them.
+        """
+        with self._lock:
+            return {path: {'estimate': estimate,
+                           'calls': self.calls.get(path, 0),
+                           'polls': self.polls.get(path, 0)}
+                    for path, estimate in self.estimates.items()}
+
+    def reset(self):
+        """
+        Forgets everything learned, as well as the counts.
+        """
+        with self._lock:
+            self.estimates.clear()
+            self.calls.clear()
+            self.polls.clear()
+
+    def reset_counts(self):
+        """
+        Zeroes the counts of responses and polls, keeping the estimates.
+        """
+        with self._lock:
+            self.calls.clear()
+            self.polls.clear()
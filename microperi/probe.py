@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+probe.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Opt-in instrumentation of the calls made on a Device, to show where the time
+goes in each one.
+
+    probe = device.instrument()
+    microbit.accelerometer.get_x()
+    print(probe.snapshot()['microbit.accelerometer.get_x'])
+
+While instrumenting, the device's connection is wrapped so that reads and
+writes can be timed. A device which isn't instrumented pays for nothing but
+a check that its probe is None.
+"""
+import math
+import time
+from array import array
+
+
+__all__ = ['Histogram', 'Probe', 'ProbedConnection']
+
+
+class Histogram:
+    """
+    A fixed-size histogram of durations in seconds.
+
+    Buckets grow geometrically, by a quarter of a doubling each, from
+    smallest up to smallest * 2 ** doublings. Anything outside that range is
+    counted in the first or last bucket, so memory use never grows.
+    Percentiles are therefore estimates, accurate to about 19%.
+    """
+
+    def __init__(self, smallest=1e-6, doublings=28, steps=4):
+        self.smallest = smallest
+        self.steps = steps
+        self.buckets = array('Q', bytes(8 * doublings * steps))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.buckets)):
+            self.buckets[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value > self.smallest:
+            i = int(math.log2(value / self.smallest) * self.steps)
+            i = min(i, len(self.buckets) - 1)
+        else:
+            i = 0
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        Returns an estimate of the p-th percentile (0-100), or None if
+        nothing has been added.
+        """
+        if not self.count:
+            return None
+        target = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                # The top of the bucket, but never beyond what was seen.
+                upper = self.smallest * 2 ** ((i + 1) / float(self.steps))
+                return max(self.min, min(upper, self.max))
+        return self.max
+
+    def snapshot(self):
+        """
+        Returns a dict summarising the histogram.
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class CallStats:
+    """
+    What a Probe knows about the calls to one path.
+
+    write is the time spent writing, first_byte and response the time from
+    the start of the call until the first and last bytes of the reply
+    arrived, and decode the time from then until the call returned.
+    """
+
+    TIMINGS = ('write', 'first_byte', 'response', 'decode')
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.histograms = {name: Histogram() for name in self.TIMINGS}
+
+    def snapshot(self):
+        result = {
+            'calls': self.calls,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+        }
+        for name, histogram in self.histograms.items():
+            result[name] = histogram.snapshot()
+        return result
+
+
+class Probe:
+    """
+    Records timings and byte counts for each call, keyed by path: the
+    Shim's dotted name, or <execute> and <batch> for Device.execute() and
+    batches.
+
+    At most max_paths paths are kept apart. Calls to any further paths are
+    recorded together under <other>, so memory use is bounded.
+    """
+
+    OTHER = '<other>'
+
+    def __init__(self, max_paths=256):
+        self.max_paths = max_paths
+        self.stats = {}
+        self._active = False
+        self._begin()
+
+    def reset(self):
+        self.stats = {}
+
+    def snapshot(self):
+        """
+        Returns a dict of path to a summary of its calls: the number of
+        calls, bytes sent and received, and a summary of each timing (see
+        Histogram.snapshot()).
+        """
+        return {path: stats.snapshot() for path, stats in self.stats.items()}
+
+    def measure(self, path, fn, *args):
+        """
+        Returns fn(*args), recording the call under path. A call made while
+        another is being measured is counted as part of the outer one.
+        """
+        if self._active:
+            return fn(*args)
+        self._begin()
+        self._active = True
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            end = time.perf_counter()
+            self._active = False
+            self._record(path, start, end)
+
+    def wrap(self, connection):
+        """
+        Returns connection wrapped so that this probe sees its traffic.
+        """
+        if isinstance(connection, ProbedConnection):
+            connection = connection.connection
+        return ProbedConnection(connection, self)
+
+    def _begin(self):
+        self._write_time = 0.0
+        self._sent = 0
+        self._received = 0
+        self._first_byte = None
+        self._last_byte = None
+
+    def _wrote(self, nbytes, duration):
+        if self._active:
+            self._write_time += duration
+            self._sent += nbytes
+
+    def _read(self, nbytes, when):
+        if self._active and nbytes:
+            if self._first_byte is None:
+                self._first_byte = when
+            self._last_byte = when
+            self._received += nbytes
+
+    def _record(self, path, start, end):
+        stats = self.stats.get(path)
+        if stats is None:
+            if len(self.stats) >= self.max_paths:
+                path = self.OTHER
+            stats = self.stats.get(path)
+            if stats is None:
+                stats = self.stats[path] = CallStats()
+        stats.calls += 1
+        stats.bytes_sent += self._sent
+        stats.bytes_received += self._received
+        histograms = stats.histograms
+        histograms['write'].add(self._write_time)
+        if self._first_byte is not None:
+            histograms['first_byte'].add(self._first_byte - start)
+            histograms['response'].add(self._last_byte - start)
+            histograms['decode'].add(end - self._last_byte)
+
+
+class ProbedConnection:
+    """
+    Wraps a serial connection, reporting the bytes written and read through
+    it to a Probe. Everything else is passed straight through.
+    """
+
+    def __init__(self, connection, probe):
+        self.connection = connection
+        self.probe = probe
+
+    def write(self, data):
+        start = time.perf_counter()
+        n = self.connection.write(data)
+        self.probe._wrote(len(data), time.perf_counter() - start)
+        return n
+
+    def read(self, size=1):
+        data = self.connection.read(size)
+        self.probe._read(len(data), time.perf_counter())
+        return data
+
+    def read_all(self):
+        return self.read(self.connection.in_waiting)
+
+    @property
+    def timeout(self):
+        return self.connection.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.connection.timeout = timeout
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+ringbuffer.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+A fixed-size sink for streamed samples, so that captures can run for hours
+without memory use growing.
+
+    ring = SampleRing(sampler.fields, capacity=10000)
+    with device.sample(['accelerometer'], rate=50) as sampler:
+        ring.capture(sampler, duration=60)
+    recent = ring.window(500)
+    print(recent['accelerometer_x'].mean())
+
+Samples are decoded in batches straight into a preallocated NumPy structured
+array when NumPy is installed, or into an array.array of int64 otherwise.
+"""
+import time
+from array import array
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+__all__ = ['SampleRing']
+
+
+class SampleRing:
+    """
+    Keeps the most recent capacity samples, each made up of a timestamp and
+    the given fields (e.g. Sampler.fields).
+
+    Every sample is written twice, capacity rows apart, so that the latest
+    samples are always contiguous in memory. That lets window() return a
+    view rather than a copy, at the cost of twice the memory.
+
+    If use_numpy is false, or NumPy isn't installed, the samples are kept in
+    an array.array instead.
+    """
+
+    def __init__(self, fields, capacity=4096, use_numpy=True):
+        self.fields = ('timestamp',) + tuple(fields)
+        self.capacity = capacity
+        self.total = 0  # Samples ever added, including overwritten ones.
+        self._next = 0  # Row the next sample goes into.
+        width = len(self.fields)
+        self.numpy = bool(use_numpy and numpy is not None)
+        if self.numpy:
+            self._data = numpy.zeros(
+                2 * capacity, dtype=[(f, numpy.int64) for f in self.fields])
+            # A plain 2D view of the same memory, for writing whole rows.
+            self._rows = self._data.view(numpy.int64).reshape(2 * capacity,
+                                                              width)
+        else:
+            self._data = array('q', bytes(8 * 2 * capacity * width))
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    @property
+    def overwritten(self):
+        """
+        The number of samples which have been pushed out of the buffer.
+        """
+        return self.total - len(self)
+
+    def extend(self, frames):
+        """
+        Adds a batch of sample frames, as yielded by Sampler.batches().
+        """
+        if not frames:
+            return
+        # Only the last capacity frames could survive anyway, but the rest
+        # still count as added (and overwritten).
+        self.total += max(0, len(frames) - self.capacity)
+        frames = frames[-self.capacity:]
+        width = len(self.fields)
+        if self.numpy:
+            text = b','.join(frames).replace(b'$', b'').decode('ascii')
+            values = numpy.fromstring(text, dtype=numpy.int64, sep=',')
+            self._put(values.reshape(-1, width))
+        else:
+            values = array('q', [int(v) for frame in frames
+                                 for v in frame[1:].split(b',')])
+            self._put(values)
+
+    def _put(self, rows):
+        width = len(self.fields)
+        n = len(rows) if self.numpy else len(rows) // width
+        start = self._next
+        first = min(n, self.capacity - start)  # Rows before wrapping.
+        for offset, count, src in ((start, first, 0),
+                                   (0, n - first, first)):
+            if count:
+                for base in (offset, offset + self.capacity):
+                    self._write(base, rows, src, count)
+        self._next = (start + n) % self.capacity
+        self.total += n
+
+    def _write(self, row, rows, src, count):
+        if self.numpy:
+            self._rows[row:row + count] = rows[src:src + count]
+        else:
+            width = len(self.fields)
+            self._data[row * width:(row + count) * width] = \
+                rows[src * width:(src + count) * width]
+
+    def window(self, n=None):
+        """
+        Returns the latest n samples (by default, all of them), oldest
+        first, without copying.
+
+        With NumPy this is a structured array, so window()['timestamp']
+        gives a column. Otherwise it's a memoryview of shape (n, fields).
+        """
+        n = len(self) if n is None else min(n, len(self))
+        # The copy starting at _next + capacity - n always holds the latest
+        # n rows contiguously.
+        end = self._next + self.capacity
+        start = end - n
+        if self.numpy:
+            return self._data[start:end]
+        width = len(self.fields)
+        view = memoryview(self._data)[start * width:end * width]
+        return view.cast('B').cast('q', [n, width])
+
+    def column(self, field, n=None):
+        """
+        Returns the latest n values of one field. A view with NumPy, a list
+        otherwise.
+        """
+        window = self.window(n)
+        if self.numpy:
+            return window[field]
+        index = self.fields.index(field)
+        return [row[index] for row in window.tolist()]
+
+    def capture(self, sampler, count=None, duration=None):
+        """
+        Adds samples from sampler until count samples have been added or
+        duration seconds have passed (or forever, if neither is given).
+        """
+        deadline = None if duration is None else time.monotonic() + duration
+        target = None if count is None else self.total + count
+        for frames in sampler.batches():
+            if target is not None:
+                frames = frames[:target - self.total]
+            self.extend(frames)
+            if target is not None and self.total >= target:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
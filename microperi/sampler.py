@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+sampler.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Streams sensor readings from a sampling loop running on the micro:bit,
+rather than asking for each reading with its own round trip.
+
+    with device.sample(['accelerometer', 'pin0'], rate=50) as samples:
+        for sample in samples:
+            print(sample.timestamp, sample.accelerometer_x, sample.pin0)
+
+While sampling the micro:bit is busy, so the device can't be used for
+anything else until the sampler is stopped.
+"""
+import re
+from collections import namedtuple
+
+from .stream import finish
+
+
+__all__ = ['Sampler', 'sensor_fields']
+
+
+# Field names and the expressions which read them, for each sensor.
+SENSORS = {
+    'accelerometer': [('accelerometer_x', 'accelerometer.get_x()'),
+                      ('accelerometer_y', 'accelerometer.get_y()'),
+                      ('accelerometer_z', 'accelerometer.get_z()')],
+    'compass': [('compass_x', 'compass.get_x()'),
+                ('compass_y', 'compass.get_y()'),
+                ('compass_z', 'compass.get_z()')],
+    'temperature': [('temperature', 'temperature()')],
+    'buttons': [('button_a', 'button_a.is_pressed()'),
+                ('button_b', 'button_b.is_pressed()')],
+}
+
+# e.g. pin0 (an analog reading) or pin0.digital
+PIN = re.compile(r'^pin(\d+)(\.digital)?$')
+
+# Runs on the micro:bit. Samples are printed as lines starting with $, made
+# up of the running time in ms followed by the readings.
+PROGRAM = """\
+from microbit import *
+_d = {period}
+_t = running_time()
+while True:
+    print('{format}' % (running_time(), {expressions}))
+    _t += _d
+    _w = _t - running_time()
+    if _w > 0:
+        sleep(_w)
+    else:
+        _t = running_time()
+"""
+
+
+def sensor_fields(sensor):
+    """
+    Returns a list of (field name, expression) pairs for a sensor, which is
+    one of the keys of SENSORS or a pin such as pin0 or pin0.digital.
+
+    Raises ValueError for anything else.
+    """
+    if sensor in SENSORS:
+        return SENSORS[sensor]
+    match = PIN.match(sensor)
+    if match:
+        if match.group(2):
+            return [('pin{}_digital'.format(match.group(1)),
+                     'pin{}.read_digital()'.format(match.group(1)))]
+        return [('pin{}'.format(match.group(1)),
+                 'pin{}.read_analog()'.format(match.group(1)))]
+    raise ValueError('Unknown sensor: {}'.format(sensor))
+
+
+class Sampler:
+    """
+    Runs a sampling loop on the micro:bit and iterates over the samples it
+    sends back, as namedtuples of the timestamp (the micro:bit's running
+    time in ms) and a field per reading.
+
+    rate is in samples per second. The loop is started when the sampler is
+    entered or first iterated over, and stopped with CTRL-C by stop().
+    """
+
+    def __init__(self, device, sensors=('accelerometer',), rate=50):
+        self.device = device
+        fields = []
+        for sensor in sensors:
+            fields.extend(sensor_fields(sensor))
+        self.fields = tuple(name for name, _ in fields)
+        self.Sample = namedtuple('Sample', ('timestamp',) + self.fields)
+        self.program = PROGRAM.format(
+            period=max(1, int(round(1000.0 / rate))),
+            format='$%d' + ',%d' * len(fields),
+            expressions=', '.join(expression for _, expression in fields))
+        self.running = False
+        self._buffer = bytearray()
+
+    def start(self):
+        if self.running:
+            return
+        self.device._start_program(self.program, 'Sampling',
+                                   'sampling program')
+        self._buffer = bytearray()
+        self.running = True
+
+    def stop(self, timeout=1.0):
+        """
+        Interrupts the sampling loop and waits (for up to timeout seconds)
+        until the micro:bit is back at the raw REPL prompt.
+        """
+        if not self.running:
+            return
+        self.running = False
+        connection = self.device.connection
+        connection.write(b'\x03')
+        # Samples still in flight are discarded; only the end matters.
+        finish(connection, timeout)
+        self._buffer = bytearray()
+
+    def batches(self):
+        """
+        Yields lists of the samples received together, each as it was sent:
+        a line of comma separated integers starting with $, without the
+        line ending. Handing samples on in batches keeps the per-sample
+        cost down for sinks such as SampleRing.
+        """
+        self.start()
+        connection = self.device.connection
+        buffer = self._buffer
+        while self.running:
+            chunk = connection.read(max(1, connection.in_waiting))
+            end = chunk.find(b'\x04')
+            if end >= 0:
+                # The loop ended by itself, so it must have failed.
+                self.running = False
+                raise IOError(self.device._program_ended(chunk[end + 1:]))
+            buffer.extend(chunk)
+            end = buffer.rfind(b'\r\n')
+            if end >= 0:
+                lines = bytes(buffer[:end]).split(b'\r\n')
+                del buffer[:end + 2]
+                batch = [line for line in lines if line[:1] == b'$']
+                if batch:
+                    yield batch
+
+    def frames(self):
+        """
+        Yields each sample as it was received (see batches()).
+        """
+        for batch in self.batches():
+            for frame in batch:
+                yield frame
+
+    def __iter__(self):
+        Sample = self.Sample
+        for frame in self.frames():
+            yield Sample(*map(int, frame[1:].split(b',')))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
@@ -82,8 +82,7 @@ class SerialTransport(asyncio.Transport):
     #~ def abort(self):
 
 
-@asyncio.coroutine
-def create_serial_connection(loop, protocol_factory, *args, **kwargs):
+async def create_serial_connection(loop, protocol_factory, *args, **kwargs):
     ser = serial.Serial(*args, **kwargs)
     protocol = protocol_factory()
     transport = SerialTransport(loop, protocol, ser)
@@ -0,0 +1,761 @@
+# -*- coding: utf-8 -*-
+"""
+sim.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+A simulated BBC micro:bit which speaks MicroPython's raw REPL protocol, so
+that MicroPeri can be benchmarked and regression tested without hardware.
+
+SimulatedMicrobit behaves like an open serial connection to a micro:bit, and
+can be given straight to Device(connection=...):
+
+    sim = SimulatedMicrobit(latency=0.005, raw=True)
+    device = Device(connection=sim)
+    sim.microbit.accelerometer.values = (0, 0, 1024)
+    print(device.microbit.accelerometer.get_z())
+
+Anywhere a port is taken, a microbit-sim:// URL opens a fresh simulation
+instead, with the latency and baudrate as query parameters:
+
+    device = Device(port='microbit-sim://?latency=0.005&baudrate=115200')
+    device.open()
+"""
+import builtins
+import math
+import random
+import struct
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+
+
+__all__ = ['SimulatedMicrobit', 'from_url', 'SCHEME']
+
+
+BANNER = b'MicroPython v1.9.2 on 2017-09-01; micro:bit with nRF51822\r\n' \
+    b'Type "help()" for more information.\r\n'
+RAW_PROMPT = b'raw REPL; CTRL-B to exit\r\n>'
+
+SCHEME = 'microbit-sim://'
+
+
+class MicroBitPin:
+    """
+    A stub of a single micro:bit pin. Tests can set digital and analog.
+    """
+
+    def __init__(self):
+        self.digital = 0
+        self.analog = 0
+        self.touched = False
+
+    def read_digital(self):
+        return self.digital
+
+    def write_digital(self, value):
+        self.digital = 1 if value else 0
+
+    def read_analog(self):
+        return self.analog
+
+    def write_analog(self, value):
+        self.analog = int(value)
+
+    def set_analog_period(self, period):
+        pass
+
+    def set_analog_period_microseconds(self, period):
+        pass
+
+    def is_touched(self):
+        return self.touched
+
+
+class Image:
+    """
+    A stub of microbit.Image, which is the canonical example of a value whose
+    repr can't be parsed back on the host.
+    """
+
+    def __init__(self, *args):
+        if not args:
+            args = (5, 5)
+        if isinstance(args[0], str):
+            rows = args[0].rstrip(':').split(':')
+            self._rows = [[int(c) for c in row] for row in rows]
+        else:
+            width, height = args[0], args[1]
+            buf = args[2] if len(args) > 2 else bytes(width * height)
+            self._rows = [list(buf[y * width:(y + 1) * width])
+                          for y in range(height)]
+
+    def width(self):
+        return len(self._rows[0]) if self._rows else 0
+
+    def height(self):
+        return len(self._rows)
+
+    def get_pixel(self, x, y):
+        return self._rows[y][x]
+
+    def set_pixel(self, x, y, value):
+        self._rows[y][x] = value
+
+    def invert(self):
+        return Image(':'.join(''.join(str(9 - v) for v in row)
+                              for row in self._rows))
+
+    def __repr__(self):
+        return "Image('{}:')".format(':'.join(''.join(str(v) for v in row)
+                                              for row in self._rows))
+
+
+Image.HEART = Image('09090:99999:99999:09990:00900')
+Image.HAPPY = Image('00000:09090:00000:90009:09990')
+Image.SAD = Image('00000:09090:00000:09990:90009')
+
+
+class Button:
+    def __init__(self):
+        self.pressed = False
+        self.presses = 0
+
+    def is_pressed(self):
+        return self.pressed
+
+    def was_pressed(self):
+        presses, self.presses = self.presses, 0
+        return presses > 0
+
+    def get_presses(self):
+        presses, self.presses = self.presses, 0
+        return presses
+
+
+class Accelerometer:
+    def __init__(self):
+        self.values = (0, 0, -1024)
+
+    def get_x(self):
+        return self.values[0]
+
+    def get_y(self):
+        return self.values[1]
+
+    def get_z(self):
+        return self.values[2]
+
+    def get_values(self):
+        return tuple(self.values)
+
+    def current_gesture(self):
+        return 'face up'
+
+
+class Compass:
+    def __init__(self):
+        self.values = (0, 0, 0)
+        self.calibrated = False
+
+    def calibrate(self):
+        self.calibrated = True
+
+    def is_calibrated(self):
+        return self.calibrated
+
+    def clear_calibration(self):
+        self.calibrated = False
+
+    def get_x(self):
+        return self.values[0]
+
+    def get_y(self):
+        return self.values[1]
+
+    def get_z(self):
+        return self.values[2]
+
+    def heading(self):
+        return int(math.degrees(math.atan2(self.values[1],
+                                           self.values[0]))) % 360
+
+    def get_field_strength(self):
+        return int(math.sqrt(sum(v * v for v in self.values)))
+
+
+class Display:
+    def __init__(self):
+        self.pixels = [0] * 25
+        self.light_level = 0
+        self.lit = True
+
+    def get_pixel(self, x, y):
+        return self.pixels[y * 5 + x]
+
+    def set_pixel(self, x, y, value):
+        self.pixels[y * 5 + x] = value
+
+    def clear(self):
+        self.pixels = [0] * 25
+
+    def show(self, image, delay=400, **kwargs):
+        if isinstance(image, Image):
+            self.pixels = [image.get_pixel(x, y)
+                           for y in range(5) for x in range(5)]
+
+    def scroll(self, text, delay=150, **kwargs):
+        pass
+
+    def on(self):
+        self.lit = True
+
+    def off(self):
+        self.lit = False
+
+    def is_on(self):
+        return self.lit
+
+    def read_light_level(self):
+        return self.light_level
+
+
+class I2C:
+    """
+    A stub I2C bus. Peripherals are dicts of register bytes keyed by address.
+    Writing sets the register pointer (and any bytes after it), reading
+    returns bytes from the register pointer onwards.
+    """
+
+    def __init__(self):
+        self.devices = {}
+        self._pointers = {}
+
+    def init(self, freq=100000, sda=None, scl=None):
+        pass
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def _device(self, addr):
+        if addr not in self.devices:
+            raise OSError(19)  # ENODEV, as MicroPython raises it
+        return self.devices[addr]
+
+    def read(self, addr, n, repeat=False):
+        regs = self._device(addr)
+        pointer = self._pointers.get(addr, 0)
+        self._pointers[addr] = pointer + n
+        return bytes(regs.get(pointer + i, 0) for i in range(n))
+
+    def write(self, addr, buf, repeat=False):
+        regs = self._device(addr)
+        if buf:
+            self._pointers[addr] = buf[0]
+            for i, b in enumerate(buf[1:]):
+                regs[buf[0] + i] = b
+
+
+class SPI:
+    """
+    A stub SPI bus, which echoes back what was written (as if MISO and MOSI
+    were looped together).
+    """
+
+    def __init__(self):
+        self.written = bytearray()
+
+    def init(self, baudrate=1000000, bits=8, mode=0, sclk=None, mosi=None,
+             miso=None):
+        pass
+
+    def write(self, buf):
+        self.written.extend(buf)
+
+    def read(self, n, out=0):
+        return bytes([out] * n)
+
+    def write_readinto(self, out, buf):
+        self.written.extend(out)
+        buf[:] = out[:len(buf)]
+
+
+class UART:
+    """
+    A stub of microbit.uart which is attached to the simulated serial line.
+    """
+
+    def __init__(self, sim):
+        self._sim = sim
+
+    def init(self, baudrate=9600, bits=8, parity=None, stop=1, tx=None,
+             rx=None):
+        pass
+
+    def any(self):
+        return self._sim._rx_any()
+
+    def read(self, nbytes=None):
+        return self._sim._rx_read(nbytes)
+
+    def readline(self):
+        return self._sim._rx_readline()
+
+    def write(self, buf):
+        if isinstance(buf, str):
+            buf = buf.encode('utf-8')
+        self._sim._emit(bytes(buf))
+        return len(buf)
+
+
+class Radio:
+    """
+    A stub of the radio module. Tests deliver messages with inject(), and
+    messages sent by the device are collected in sent.
+    """
+
+    def __init__(self, sim):
+        self._sim = sim
+        self.enabled = False
+        self.queue = deque(maxlen=3)
+        self.sent = []
+        self.dropped = 0
+
+    def on(self):
+        self.enabled = True
+
+    def off(self):
+        self.enabled = False
+
+    def config(self, **kwargs):
+        if 'queue' in kwargs:
+            self.queue = deque(self.queue, maxlen=kwargs['queue'])
+
+    def reset(self):
+        self.queue = deque(maxlen=3)
+
+    def inject(self, payload, rssi=-50):
+        """Delivers a message as if it was received over the air."""
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        # Timestamped in microseconds, as on the micro:bit.
+        self.queue.append((bytes(payload), rssi,
+                           int(self._sim._running_time() * 1000000)))
+
+    def _check(self):
+        if not self.enabled:
+            raise ValueError('radio is not enabled')
+
+    def send_bytes(self, message):
+        self._check()
+        self.sent.append(bytes(message))
+
+    def send(self, message):
+        self.send_bytes(b'\x01\x00\x01' + message.encode('utf-8'))
+
+    def receive_full(self):
+        self._check()
+        return self.queue.popleft() if self.queue else None
+
+    def receive_bytes(self):
+        full = self.receive_full()
+        return full[0] if full else None
+
+    def receive(self):
+        message = self.receive_bytes()
+        return message[3:].decode('utf-8') if message else None
+
+
+class Module:
+    """
+    A plain namespace standing in for a MicroPython module.
+    """
+
+    def __init__(self, name, **attrs):
+        self.__name__ = name
+        self.__dict__.update(attrs)
+
+    def __repr__(self):
+        return "<module '{}'>".format(self.__name__)
+
+
+class SimulatedMicrobit:
+    """
+    An in-process stand-in for a serial connection to a BBC micro:bit running
+    MicroPython.
+
+    It understands CTRL-A/B/C/D, replies with the usual raw REPL framing
+    (OK, stdout, CTRL-D, stderr, CTRL-D, >) and executes each program with
+    CPython against stub micro:bit modules.
+
+    latency is added to every command before it runs, and baudrate limits
+    the throughput in both directions (10 bits per byte, like 8N1). The stub
+    modules are reachable as attributes (sim.microbit, sim.radio) so that
+    sensor values can be set from the host.
+
+    If raw is true the simulation starts in raw mode, as if it had already
+    been through the handshake, so that Device(connection=sim) is usable
+    without calling open().
+    """
+
+    def __init__(self, latency=0.0, baudrate=None, timeout=1, raw=False):
+        self.latency = latency
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.port = SCHEME
+        self.is_open = True
+        self.commands = 0
+        self._lock = threading.Condition()
+        self._out = bytearray()
+        self._rx = bytearray()
+        self._input = threading.RLock()  # Orders bytes fed to the REPL.
+        self._thread = None
+        self._running = False
+        self._interrupted = False
+        self._soft_reset()
+        self._raw = raw
+
+    # Serial API
+
+    def write(self, data):
+        data = bytes(data)
+        self._pace(len(data))
+        with self._input:
+            for byte in data:
+                self._receive(byte)
+        return len(data)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None \
+            else time.monotonic() + self.timeout
+        with self._lock:
+            while len(self._out) < size and self.is_open:
+                remaining = None if deadline is None \
+                    else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            data = bytes(self._out[:size])
+            del self._out[:size]
+        return data
+
+    def read_all(self):
+        return self.read(self.in_waiting)
+
+    def read_until(self, terminator=b'\n', size=None):
+        line = bytearray()
+        while True:
+            c = self.read(1)
+            if not c:
+                break
+            line += c
+            if line.endswith(terminator):
+                break
+            if size is not None and len(line) >= size:
+                break
+        return bytes(line)
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            return len(self._out)
+
+    def reset_input_buffer(self):
+        with self._lock:
+            del self._out[:]
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        with self._lock:
+            self.is_open = False
+            self._lock.notify_all()
+        self._interrupt()
+
+    # REPL state machine
+
+    def _soft_reset(self):
+        self._raw = False
+        self._buffer = bytearray()
+        self._started = time.monotonic()
+        self.microbit = self._make_microbit()
+        self.radio = Radio(self)
+        self._globals = {'__name__': '__main__',
+                         '__builtins__': self._make_builtins()}
+
+    def _receive(self, byte):
+        if self._running:
+            if byte == 0x03:
+                self._interrupt()
+            else:
+                with self._lock:
+                    self._rx.append(byte)
+                    self._lock.notify_all()
+        elif self._raw:
+            if byte == 0x01:
+                self._buffer = bytearray()
+                self._emit(b'\r\n' + RAW_PROMPT)
+            elif byte == 0x02:
+                self._raw = False
+                self._emit(b'\r\n' + BANNER + b'>>> ')
+            elif byte == 0x03:
+                self._buffer = bytearray()
+            elif byte == 0x04:
+                if self._buffer:
+                    source = self._buffer.decode('utf-8')
+                    self._buffer = bytearray()
+                    self._emit(b'OK')
+                    self._run(source)
+                else:
+                    self._emit(b'OK\r\nMPY: soft reboot\r\n' + RAW_PROMPT)
+                    self._soft_reset()
+                    self._raw = True
+            else:
+                self._buffer.append(byte)
+        else:
+            if byte == 0x01:
+                self._raw = True
+                self._buffer = bytearray()
+                self._emit(b'\r\n' + RAW_PROMPT)
+            elif byte == 0x02:
+                self._emit(b'\r\n' + BANNER + b'>>> ')
+            elif byte == 0x03:
+                self._emit(b'\r\nKeyboardInterrupt\r\n>>> ')
+            elif byte == 0x04:
+                self._soft_reset()
+                self._emit(b'MPY: soft reboot\r\n' + BANNER + b'>>> ')
+            elif byte == 0x0d:
+                self._emit(b'\r\n>>> ')
+            else:
+                self._emit(bytes([byte]))  # Echo, but don't execute.
+
+    def _run(self, source):
+        self.commands += 1
+        self._running = True
+        self._interrupted = False
+        self._thread = threading.Thread(target=self._exec, args=(source,),
+                                        daemon=True)
+        self._thread.start()
+
+    def _exec(self, source):
+        if self.latency:
+            time.sleep(self.latency)
+        err = b''
+        sys.settrace(self._trace)
+        try:
+            code = compile(source, '<stdin>', 'exec')
+            exec(code, self._globals)
+        except BaseException as e:
+            err = self._format_exception(e).encode('utf-8')
+        sys.settrace(None)
+        with self._input:
+            self._running = False
+            self._emit(b'\x04' + err + b'\x04>')
+            # Anything the program didn't read is left for the REPL, just as
+            # the micro:bit's receive buffer would be.
+            with self._lock:
+                leftover = bytes(self._rx)
+                del self._rx[:]
+            for byte in leftover:
+                self._receive(byte)
+
+    def _format_exception(self, e):
+        lines = ['Traceback (most recent call last):']
+        tb = traceback.extract_tb(e.__traceback__)
+        for frame in tb:
+            if frame.filename == '<stdin>':
+                lines.append('  File "<stdin>", line {}, in {}'.format(
+                    frame.lineno, frame.name))
+        if isinstance(e, SyntaxError):
+            lines.append('SyntaxError: invalid syntax')
+        else:
+            message = str(e)
+            if isinstance(e, NameError):
+                message = message.replace('is not defined', "isn't defined")
+            lines.append('{}: {}'.format(type(e).__name__, message)
+                         if message else type(e).__name__)
+        return '\r\n'.join(lines) + '\r\n'
+
+    def _interrupt(self):
+        with self._lock:
+            if self._running:
+                self._interrupted = True
+            self._lock.notify_all()
+
+    def _check_interrupt(self):
+        if self._interrupted:
+            self._interrupted = False
+            raise KeyboardInterrupt
+
+    def _trace(self, frame, event, arg):
+        # Only programs sent to the REPL are traced, one line at a time, so
+        # that CTRL-C can break out of them like on the micro:bit.
+        if frame.f_code.co_filename != '<stdin>':
+            return None
+        self._check_interrupt()
+        return self._trace_line
+
+    def _trace_line(self, frame, event, arg):
+        self._check_interrupt()
+        return self._trace_line
+
+    def _emit(self, data):
+        self._pace(len(data))
+        with self._lock:
+            self._out.extend(data)
+            self._lock.notify_all()
+
+    def _pace(self, nbytes):
+        if self.baudrate:
+            time.sleep(nbytes * 10.0 / self.baudrate)
+
+    def _running_time(self):
+        return time.monotonic() - self._started
+
+    # Program side of the serial line (microbit.uart)
+
+    def _rx_any(self):
+        with self._lock:
+            if not self._rx:
+                # Avoid burning a whole core on device-side polling loops.
+                self._lock.wait(0.001)
+            return len(self._rx)
+
+    def _rx_read(self, nbytes=None):
+        with self._lock:
+            if not self._rx:
+                return None
+            nbytes = len(self._rx) if nbytes is None else nbytes
+            data = bytes(self._rx[:nbytes])
+            del self._rx[:nbytes]
+            return data
+
+    def _rx_readline(self):
+        with self._lock:
+            end = self._rx.find(b'\n')
+            if end < 0:
+                return None
+            data = bytes(self._rx[:end + 1])
+            del self._rx[:end + 1]
+            return data
+
+    # Stub modules
+
+    def _sleep_ms(self, ms):
+        # Sleep in slices so that CTRL-C can interrupt the program.
+        deadline = time.monotonic() + ms / 1000.0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._check_interrupt()
+            time.sleep(min(remaining, 0.01))
+
+    def _running_time_ms(self):
+        return int(self._running_time() * 1000)
+
+    def _make_microbit(self):
+        pins = {'pin{}'.format(n): MicroBitPin()
+                for n in list(range(17)) + [19, 20]}
+        return Module(
+            'microbit',
+            Image=Image,
+            accelerometer=Accelerometer(),
+            button_a=Button(),
+            button_b=Button(),
+            compass=Compass(),
+            display=Display(),
+            i2c=I2C(),
+            spi=SPI(),
+            uart=UART(self),
+            sleep=self._sleep_ms,
+            running_time=self._running_time_ms,
+            temperature=lambda: 21,
+            panic=lambda n=0: None,
+            reset=lambda: None,
+            **pins
+        )
+
+    def _make_modules(self):
+        utime = Module(
+            'utime',
+            sleep=lambda s: self._sleep_ms(s * 1000),
+            sleep_ms=self._sleep_ms,
+            sleep_us=lambda us: self._sleep_ms(us / 1000.0),
+            ticks_ms=self._running_time_ms,
+            ticks_us=lambda: int(self._running_time() * 1000000),
+            ticks_add=lambda a, b: a + b,
+            ticks_diff=lambda a, b: a - b,
+        )
+        return {
+            'microbit': self.microbit,
+            'radio': self.radio,
+            'music': Module('music', play=lambda *a, **k: None,
+                            pitch=lambda *a, **k: None,
+                            stop=lambda *a, **k: None,
+                            set_tempo=lambda *a, **k: None),
+            'neopixel': Module('neopixel', NeoPixel=lambda pin, n: [
+                (0, 0, 0)] * n),
+            'utime': utime,
+            'time': utime,
+            'ustruct': struct,
+            'struct': struct,
+            'math': math,
+            'random': random,
+            'gc': Module('gc', collect=lambda: None,
+                         mem_free=lambda: 10240, mem_alloc=lambda: 4096),
+            'micropython': Module('micropython', const=lambda x: x,
+                                  opt_level=lambda *a: 0),
+            'sys': Module('sys', platform='microbit',
+                          implementation=sys.implementation,
+                          print_exception=lambda e: None),
+        }
+
+    def _make_builtins(self):
+        modules = self._make_modules()
+
+        def _import(name, globals=None, locals=None, fromlist=(), level=0):
+            if name in modules:
+                return modules[name]
+            raise ImportError("no module named '{}'".format(name))
+
+        def _print(*args, sep=' ', end='\n', **kwargs):
+            text = sep.join(str(arg) for arg in args) + end
+            self._emit(text.replace('\n', '\r\n').encode('utf-8'))
+
+        namespace = dict(builtins.__dict__)
+        namespace['__import__'] = _import
+        namespace['print'] = _print
+        return namespace
+
+
+def from_url(url):
+    """
+    Returns a SimulatedMicrobit configured by a URL such as
+    microbit-sim://?latency=0.01&baudrate=115200. Both are optional.
+
+    Raises ValueError for anything else.
+    """
+    parts = urlsplit(url)
+    if not url.startswith(SCHEME) or parts.netloc or \
+            parts.path not in ('', '/'):
+        raise ValueError('Not a {} URL: {}'.format(SCHEME, url))
+    options = {}
+    for name, values in parse_qs(parts.query, strict_parsing=False).items():
+        if name not in ('latency', 'baudrate'):
+            raise ValueError('Unknown option {} in {}'.format(name, url))
+        options[name] = float(values[-1])
+    sim = SimulatedMicrobit(**options)
+    sim.port = url
+    return sim
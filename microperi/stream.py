@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+stream.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Runs a long-running program on the micro:bit and hands back what it prints
+as it arrives, rather than all at once when it finishes.
+
+    code = '''
+    from microbit import sleep
+    for i in range(100):
+        print(i)
+        sleep(100)
+    '''
+    with device.stream(code) as lines:
+        for line in lines:
+            print(line)
+            if line == '50':
+                break  # The program is interrupted on leaving the block.
+
+Only the current unfinished line is held on the host, so memory use stays
+the same however long the program runs.
+"""
+import codecs
+import time
+
+
+__all__ = ['Stream', 'finish']
+
+
+def finish(connection, timeout, ctrl_ds=0, data=b''):
+    """
+    Reads output until the end of a raw REPL response (the second CTRL-D,
+    then the prompt), of which ctrl_ds CTRL-Ds have already been read,
+    followed by data.
+
+    Returns data and what was read after it, up to the prompt. Raises
+    IOError if that takes longer than timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    data = bytearray(data)
+    ctrl_ds += data.count(b'\x04')
+    while ctrl_ds < 2 or not data.endswith(b'\x04>'):
+        if time.monotonic() > deadline:
+            raise IOError('micro:bit did not finish running its program.')
+        chunk = connection.read(max(1, connection.in_waiting))
+        ctrl_ds += chunk.count(b'\x04')
+        data += chunk
+    return bytes(data[:-2])
+
+
+class Stream:
+    """
+    Runs code on the micro:bit and iterates over its output as str: line by
+    line (without line endings) if lines is true, otherwise in chunks as
+    they arrive. Once more than max_line characters of a line have arrived
+    without its end, they're handed on as a piece of it.
+
+    Iterating raises IOError with the micro:bit's error output if the
+    program fails. cancel() interrupts it with CTRL-C.
+
+    Use it via Device.stream().
+    """
+
+    def __init__(self, device, code, lines=True, max_line=4096):
+        self.device = device
+        self.code = code
+        self.lines = lines
+        self.max_line = max_line
+        self.running = False
+        self.finished = False
+
+    def start(self):
+        if self.running or self.finished:
+            return
+        self.device._start_program(self.code, 'Streaming', 'program')
+        self.running = True
+
+    def cancel(self, timeout=1.0):
+        """
+        Interrupts the program, if it's still running, and waits (for up to
+        timeout seconds) until the micro:bit is back at the raw REPL prompt.
+        """
+        if not self.running:
+            return
+        self.running = False
+        self.finished = True
+        connection = self.device.connection
+        connection.write(b'\x03')
+        finish(connection, timeout)
+
+    def __iter__(self):
+        self.start()
+        connection = self.device.connection
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        line = ''
+        err = None
+        while self.running:
+            chunk = connection.read(max(1, connection.in_waiting))
+            end = chunk.find(b'\x04')
+            if end >= 0:
+                # Standard output is over. The error output is read before
+                # anything else is handed on, so the program is finished
+                # with even if iteration stops early.
+                err = self._read_errors(chunk[end + 1:])
+                text = decoder.decode(chunk[:end], True)
+            else:
+                text = decoder.decode(chunk)
+            if not self.lines:
+                if text:
+                    yield text
+                continue
+            line += text
+            while True:
+                newline = line.find('\n')
+                if newline < 0:
+                    break
+                yield line[:newline].rstrip('\r')
+                line = line[newline + 1:]
+            while len(line) > self.max_line:
+                yield line[:self.max_line]
+                line = line[self.max_line:]
+        if line:
+            yield line
+        if err:
+            raise IOError(err)
+
+    def _read_errors(self, err):
+        """
+        Reads the rest of the response, returning the error output.
+        """
+        self.running = False
+        self.finished = True
+        return self.device._program_ended(err)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.cancel()
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+wire.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+A compact binary RPC format, and a dispatcher which stays resident on the
+micro:bit to serve it.
+
+Normally each Shim call is sent as Python source, which the micro:bit has to
+compile, and the result comes back as a repr which the host has to parse.
+Once the dispatcher is running, a call is instead a few bytes naming a
+function slot plus its packed arguments, and the result is packed too.
+
+Frames in both directions are a little-endian unsigned short length followed
+by that many bytes. Responses start with a status byte (0 for a result, 1
+for an error message). Values are tagged:
+
+    N None, T True, F False, i int32, f float32, s str, b bytes,
+    t tuple, l list, r repr (anything else, parsed by the host)
+
+Lengths are unsigned shorts, except for R, a repr too long for r, which
+only the broker (see broker.py) sends.
+
+CTRL-C (0x03) would interrupt the dispatcher and CTRL-D (0x04) ends raw REPL
+output, so those bytes and the escape byte itself (DLE, 0x10) are sent as
+DLE followed by the byte XOR 0x40.
+"""
+import re
+import struct
+import time
+
+from .decoder import decode
+
+__all__ = ['Dispatcher', 'Unencodable', 'pack', 'unpack', 'escape',
+           'unescape']
+
+
+# Runs on the micro:bit. Defines the dispatcher without starting it: _mpl()
+# serves frames until it's asked to quit.
+DISPATCHER = """\
+from microbit import uart
+import ustruct as _S
+_mpf = []
+def _mpr(n):
+    b = bytearray()
+    e = 0
+    while len(b) < n:
+        while not uart.any():
+            pass
+        c = uart.read(1)[0]
+        if e:
+            b.append(c ^ 64)
+            e = 0
+        elif c == 16:
+            e = 1
+        else:
+            b.append(c)
+    return b
+def _mpd(b, i):
+    t = b[i]
+    i += 1
+    if t == 78:
+        return None, i
+    if t == 84:
+        return True, i
+    if t == 70:
+        return False, i
+    if t == 105:
+        return _S.unpack('<i', b[i:i + 4])[0], i + 4
+    if t == 102:
+        return _S.unpack('<f', b[i:i + 4])[0], i + 4
+    if t == 115 or t == 98:
+        n = _S.unpack('<H', b[i:i + 2])[0]
+        v = bytes(b[i + 2:i + 2 + n])
+        return (str(v, 'utf-8') if t == 115 else v), i + 2 + n
+    n = b[i]
+    i += 1
+    v = []
+    for _ in range(n):
+        x, i = _mpd(b, i)
+        v.append(x)
+    return (tuple(v) if t == 116 else v), i
+def _mpe(v, o):
+    k = type(v)
+    if v is None:
+        o.append(78)
+    elif v is True:
+        o.append(84)
+    elif v is False:
+        o.append(70)
+    elif k is int and -2147483648 <= v < 2147483648:
+        o.append(105)
+        o.extend(_S.pack('<i', v))
+    elif k is float:
+        o.append(102)
+        o.extend(_S.pack('<f', v))
+    elif k is str or k is bytes:
+        d = v.encode('utf-8') if k is str else v
+        o.append(115 if k is str else 98)
+        o.extend(_S.pack('<H', len(d)))
+        o.extend(d)
+    elif (k is tuple or k is list) and len(v) < 256:
+        o.append(116 if k is tuple else 108)
+        o.append(len(v))
+        for x in v:
+            _mpe(x, o)
+    else:
+        d = repr(v).encode('utf-8')
+        o.append(114)
+        o.extend(_S.pack('<H', len(d)))
+        o.extend(d)
+def _mpw(s, v):
+    o = bytearray()
+    if s:
+        o.extend(v.encode('utf-8'))
+    else:
+        _mpe(v, o)
+    f = bytearray()
+    for c in _S.pack('<BH', s, len(o)) + o:
+        if c == 3 or c == 4 or c == 16:
+            f.append(16)
+            f.append(c ^ 64)
+        else:
+            f.append(c)
+    uart.write(f)
+def _mpl():
+    while True:
+        b = _mpr(_S.unpack('<H', _mpr(2))[0])
+        try:
+            if b[0] == 81:
+                return
+            if b[0] == 68:
+                for k in _mpd(b, 1)[0]:
+                    _mph.pop(k, None)
+                _mpw(0, None)
+            elif b[0] == 82:
+                p = str(bytes(b[1:]), 'utf-8').split('.')
+                try:
+                    f = __import__(p[0])
+                except ImportError as e:
+                    raise ImportError('microperi import %s: %s' % (p[0], e))
+                globals()[p[0]] = f
+                for a in p[1:]:
+                    f = getattr(f, a)
+                _mpf.append(f)
+                _mpw(0, len(_mpf) - 1)
+            else:
+                a = []
+                i = 3
+                for _ in range(b[2]):
+                    v, i = _mpd(b, i)
+                    a.append(v)
+                k = {}
+                c = b[i]
+                i += 1
+                for _ in range(c):
+                    n, i = _mpd(b, i)
+                    k[n], i = _mpd(b, i)
+                _mpw(0, _mpf[b[1]](*a, **k))
+        except Exception as e:
+            _mpw(1, '{}: {}'.format(type(e).__name__, e))
+"""
+
+# Only plain dotted names can be looked up by the dispatcher.
+DOTTED_NAME = re.compile(r'^[A-Za-z_]\w*(\.[A-Za-z_]\w*)*$')
+
+SPECIAL = re.compile(b'[\x03\x04\x10]')
+ESCAPED = re.compile(b'\x10[\x00-\xff]')
+
+# The dispatcher keeps its functions in a list indexed by one byte.
+MAX_SLOTS = 256
+
+
+class Expired(Exception):
+    """
+    Raised within the Dispatcher when a call's deadline passes.
+    """
+
+
+class Unencodable(TypeError):
+    """
+    Raised when a call can't be expressed in the binary format, in which
+    case the source-based path should be used instead.
+    """
+
+
+def escape(data):
+    """
+    Returns data with the bytes the raw REPL treats specially escaped.
+    """
+    return SPECIAL.sub(lambda m: bytes((0x10, m.group()[0] ^ 0x40)), data)
+
+
+def unescape(data):
+    """
+    Returns data, which was escaped by escape(), as it was.
+    """
+    return ESCAPED.sub(lambda m: bytes((m.group()[1] ^ 0x40,)), data)
+
+
+def pack(value, out):
+    """
+    Appends the tagged encoding of value to the bytearray out.
+
+    Raises Unencodable for anything the dispatcher can't decode.
+    """
+    kind = type(value)
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif kind is int:
+        if not -2 ** 31 <= value < 2 ** 31:
+            raise Unencodable('int out of range: {!r}'.format(value))
+        out += b'i' + struct.pack('<i', value)
+    elif kind is float:
+        out += b'f' + struct.pack('<f', value)
+    elif kind is str or kind is bytes:
+        data = value.encode('utf-8') if kind is str else value
+        if len(data) > 0xffff:
+            raise Unencodable('{} too long'.format(kind.__name__))
+        out += (b's' if kind is str else b'b') + struct.pack('<H', len(data))
+        out += data
+    elif kind is tuple or kind is list:
+        if len(value) > 0xff:
+            raise Unencodable('{} too long'.format(kind.__name__))
+        out += (b't' if kind is tuple else b'l') + bytes((len(value),))
+        for item in value:
+            pack(item, out)
+    else:
+        raise Unencodable('cannot pack {!r}'.format(value))
+
+
+def unpack(data, i=0):
+    """
+    Decodes the tagged value at offset i of data.
+
+    Returns the value and the offset just after it.
+    """
+    tag = data[i:i + 1]
+    i += 1
+    if tag == b'N':
+        return None, i
+    if tag == b'T':
+        return True, i
+    if tag == b'F':
+        return False, i
+    if tag == b'i':
+        return struct.unpack_from('<i', data, i)[0], i + 4
+    if tag == b'f':
+        # The micro:bit's floats are single precision, so round to the
+        # digits its own repr would have shown.
+        value = struct.unpack_from('<f', data, i)[0]
+        return float('{:.7g}'.format(value)), i + 4
+    if tag in (b's', b'b', b'r'):
+        n = struct.unpack_from('<H', data, i)[0]
+        value = bytes(data[i + 2:i + 2 + n])
+        i += 2 + n
+        if tag == b'b':
+            return value, i
+        if tag == b's':
+            return value.decode('utf-8'), i
+        return decode(value), i
+    if tag == b'R':
+        n = struct.unpack_from('<I', data, i)[0]
+        return decode(bytes(data[i + 4:i + 4 + n])), i + 4 + n
+    if tag in (b't', b'l'):
+        items = []
+        i += 1
+        for _ in range(data[i - 1]):
+            item, i = unpack(data, i)
+            items.append(item)
+        return (tuple(items) if tag == b't' else items), i
+    raise ValueError('unknown tag {!r}'.format(tag))
+
+
+class Dispatcher:
+    """
+    Host side of the resident dispatcher, attached to a connection which is
+    in raw mode.
+
+    install() defines the dispatcher on the micro:bit, which then runs
+    whenever calls are made and is stopped (handing the raw REPL back) by
+    stop(). Each dotted name is looked up on the micro:bit once, the first
+    time it's called, and is referred to by its slot number afterwards.
+    Looking it up imports its module as a program's import header would
+    (see microperi.IMPORT), failing with the same error.
+    release() frees kept objects (see microperi.RemoteHandle) without
+    stopping it.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.slots = {}
+        self.installed = False
+        self.running = False
+        self._deadline = None
+
+    def install(self):
+        from .microperi import execute
+        self.stop()
+        _, err = execute(DISPATCHER, self.connection)
+        if err:
+            raise IOError(err)
+        self.slots = {}
+        self.installed = True
+
+    def start(self):
+        if not self.running:
+            self.connection.write(b'_mpl()\x04')
+            self.connection.read(2)  # OK
+            self.running = True
+
+    def stop(self):
+        """
+        Stops the dispatcher so that the raw REPL can be used directly.
+
+        If it doesn't stop within RECOVERY_TIMEOUT seconds, it's interrupted
+        with CTRL-C instead, and IOError is raised if even that fails.
+        """
+        from .microperi import RECOVERY_TIMEOUT, Timeout, read_response
+        if self.running:
+            self._send(b'Q')
+            self.running = False
+            try:
+                read_response(self.connection, RECOVERY_TIMEOUT)
+            except Timeout as e:
+                if e.recovery is None:
+                    raise IOError('micro:bit did not stop the dispatcher.')
+
+    def release(self, keys):
+        """
+        Frees the objects kept in the handle table on the micro:bit under
+        keys (up to 255 of them).
+        """
+        frame = bytearray(b'D')
+        pack(tuple(keys), frame)
+        self.start()
+        self._send(frame)
+        self._receive()
+
+    def call(self, name, args, kwargs):
+        """
+        Calls name on the micro:bit with the given arguments.
+
+        Raises Unencodable, before anything is sent, if the call can't be
+        made through the dispatcher. Otherwise returns the result, or raises
+        IOError with the micro:bit's error message. If the _timeout keyword
+        argument is given, the call is interrupted (stopping the dispatcher)
+        after that many seconds and Timeout is raised.
+        """
+        slot = self.slots.get(name)
+        if slot is None and not DOTTED_NAME.match(name):
+            raise Unencodable('not a dotted name: {}'.format(name))
+        timeout = kwargs.get('_timeout')
+        frame = bytearray(b'C\x00')
+        frame.append(len(args))
+        for arg in args:
+            pack(arg, frame)
+        kwargs = [(k, v) for k, v in kwargs.items() if not k.startswith('_')]
+        frame.append(len(kwargs))
+        for k, v in kwargs:
+            pack(k, frame)
+            pack(v, frame)
+        if len(frame) > 0xffff:
+            raise Unencodable('too many arguments')
+        if slot is None and len(self.slots) >= MAX_SLOTS:
+            raise Unencodable('no free slots')
+        self.start()
+        if timeout is None:
+            return self._call(name, slot, frame)
+        from .microperi import READ_SLICE, RECOVERY_TIMEOUT, Timeout, \
+            interrupt
+        connection = self.connection
+        original_timeout = connection.timeout
+        connection.timeout = READ_SLICE
+        self._deadline = time.monotonic() + timeout
+        try:
+            return self._call(name, slot, frame)
+        except Expired:
+            self.running = False
+            raise Timeout(timeout, b'',
+                          interrupt(connection, RECOVERY_TIMEOUT))
+        finally:
+            self._deadline = None
+            connection.timeout = original_timeout
+
+    def _call(self, name, slot, frame):
+        if slot is None:
+            self._send(b'R' + name.encode('utf-8'))
+            slot = self._receive()
+            self.slots[name] = slot
+        frame[1] = slot
+        self._send(frame)
+        return self._receive()
+
+    def _send(self, frame):
+        self.connection.write(escape(struct.pack('<H', len(frame)) + frame))
+
+    def _receive(self):
+        header = self._read(3)
+        status, length = struct.unpack('<BH', header)
+        body = self._read(length)
+        if status:
+            raise IOError(body.decode('utf-8'))
+        return unpack(body)[0]
+
+    def _read(self, n):
+        data = bytearray()
+        escaped = False
+        while len(data) < n:
+            if self._deadline is not None and \
+                    time.monotonic() > self._deadline:
+                raise Expired()
+            # The dispatcher sends nothing unasked, so it's safe to wait for
+            # at least as many bytes as are still missing.
+            for c in self.connection.read(n - len(data)):
+                if escaped:
+                    data.append(c ^ 0x40)
+                    escaped = False
+                elif c == 0x10:
+                    escaped = True
+                else:
+                    data.append(c)
+        return bytes(data)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+worker.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Lets several threads share one micro:bit. In threaded mode a single I/O
+thread owns the connection and works through a queue of requests, so bytes
+from different callers can never be interleaved.
+
+    device.open(threaded=True)
+    # From any thread:
+    x = device.microbit.accelerometer.get_x()
+    future = device.submit(device.microbit.accelerometer.get_y)
+
+Shim calls which are waiting in the queue together are sent as one batch,
+so the more callers there are, the fewer round trips each call costs.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+
+
+__all__ = ['Worker']
+
+
+class Worker:
+    """
+    The I/O thread of a Device opened with threaded=True.
+
+    Requests are queued with call() (for Shim calls, which can be batched)
+    or submit() (for anything else), and each gets a Future. Up to
+    max_batch queued Shim calls are sent in a single round trip.
+    """
+
+    def __init__(self, device, max_batch=32):
+        self.device = device
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name='microperi-io', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Finishes the requests already queued, then stops the thread.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            if threading.current_thread() is not self._thread:
+                self._thread.join()
+            self._thread = None
+
+    def owns_thread(self):
+        """
+        Returns whether the calling thread is the I/O thread.
+        """
+        return threading.current_thread() is self._thread
+
+    def call(self, shim, args, kwargs):
+        """
+        Queues a call of shim, returning a Future for its result. A call
+        with underscore keyword arguments, such as _timeout, is made on
+        its own so that they apply to it alone.
+        """
+        future = Future()
+        if any(k.startswith('_') for k in kwargs):
+            self._queue.put((future, self.device._make_call,
+                             (shim, args, kwargs), {}, False))
+        else:
+            self._queue.put((future, shim, args, kwargs, True))
+        return future
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues fn(*args, **kwargs) to be run on the I/O thread, returning a
+        Future for its result.
+        """
+        future = Future()
+        self._queue.put((future, fn, args, kwargs, False))
+        return future
+
+    def _run(self):
+        held = []  # A request taken off the queue which can't be batched.
+        while True:
+            request = held.pop() if held else self._queue.get()
+            if request is None:
+                return
+            self._serve(request, held)
+            # Let go of it before waiting for the next, so that nothing
+            # (such as a RemoteHandle) is kept alive by this thread.
+            request = None
+
+    def _serve(self, request, held):
+        future, fn, args, kwargs, batchable = request
+        if not batchable:
+            if future.set_running_or_notify_cancel():
+                self._settle(future, fn, *args, **kwargs)
+            return
+        # Take every call which is already waiting, up to max_batch.
+        calls = [request]
+        while len(calls) < self.max_batch:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None or not request[4]:
+                held.append(request)
+                break
+            calls.append(request)
+        self._send_calls(calls)
+
+    def _send_calls(self, calls):
+        calls = [c for c in calls if c[0].set_running_or_notify_cancel()]
+        if len(calls) == 1:
+            future, shim, args, kwargs, _ = calls[0]
+            self._settle(future, self.device._make_call, shim, args,
+                         kwargs)
+        elif calls:
+            batch = self.device.batch()
+            pending = [(future, batch.add(shim, args, kwargs))
+                       for future, shim, args, kwargs, _ in calls]
+            try:
+                batch.send()
+            except Exception as e:
+                for future, _ in pending:
+                    future.set_exception(e)
+                return
+            for future, result in pending:
+                error = result.exception()
+                if error is None:
+                    future.set_result(result.result())
+                else:
+                    future.set_exception(error)
+
+    def _settle(self, future, fn, *args, **kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
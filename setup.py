@@ -18,6 +18,10 @@ setup(
     scripts=[],
     license='mit',
     install_requires=[],
+    extras_require={'numpy': ['numpy']},
     packages=find_packages(),
+    entry_points={
+        'console_scripts': ['microperi-broker = microperi.broker:main'],
+    },
     package_data={'': ['README.rst', ]},
 )
@@ -0,0 +1,218 @@
+"""
+test_device.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Tests of Device's call paths against a simulated micro:bit (see sim.py):
+Shim calls sent as source and through the resident dispatcher, and how
+errors and timeouts come back from each. Run them from the root of the
+repository with:
+
+    python3 -m unittest discover tests
+"""
+import gc
+import unittest
+
+from microperi.microperi import Device, Timeout
+from microperi.cache import ResultCache
+
+
+PORT = 'microbit-sim://?latency=0'
+
+
+class CallPathTests:
+    """
+    Tests run against each way of making calls. Subclasses set OPEN to the
+    keyword arguments for Device.open().
+    """
+
+    OPEN = {}
+
+    def setUp(self):
+        self.device = Device(port=PORT)
+        self.device.open(**self.OPEN)
+        self.microbit = self.device.microbit
+
+    def tearDown(self):
+        self.device.close()
+
+    def assertUsable(self):
+        self.assertEqual(self.microbit.accelerometer.get_z(), -1024)
+
+    def test_result(self):
+        self.microbit.display.set_pixel(1, 2, 7)
+        self.assertEqual(self.microbit.display.get_pixel(1, 2), 7)
+        self.assertEqual(self.microbit.accelerometer.get_values(),
+                         (0, 0, -1024))
+
+    def test_keyword_arguments(self):
+        self.assertIsNone(self.microbit.display.scroll('hi', delay=1,
+                                                       wait=False))
+
+    def test_unparseable_result(self):
+        # An Image's repr can't be parsed on the host.
+        with self.assertRaises(ValueError):
+            self.microbit.Image('90009:09090:00900:09090:90009')
+
+    def test_handle(self):
+        image = self.microbit.Image('90009:09090:00900:09090:90009',
+                                    _handle=True)
+        self.microbit.display.show(image)
+        self.assertEqual(self.microbit.display.get_pixel(0, 0), 9)
+        self.assertEqual(image.invert(_handle=True).get_pixel(0, 0), 0)
+
+    def test_temporary_handle_in_batch(self):
+        with self.device.batch():
+            shown = self.microbit.display.show(self.microbit.Image(
+                '90009:09090:00900:09090:90009', _handle=True))
+        self.assertIsNone(shown.result())
+        self.assertEqual(self.microbit.display.get_pixel(0, 0), 9)
+        # Released once the batch no longer needs it.
+        gc.collect()
+        self.device.flush_releases()
+        self.assertEqual(self.device.execute('print(len(_mph))'),
+                         (b'0\r\n', b''))
+
+    def test_error(self):
+        with self.assertRaises(IOError) as raised:
+            self.microbit.display.get_pixel(7, 7)
+        self.assertNotIsInstance(raised.exception, Timeout)
+        # The connection is still usable afterwards.
+        self.assertEqual(self.microbit.display.get_pixel(0, 0), 0)
+
+    def test_missing_attribute(self):
+        with self.assertRaises(IOError):
+            self.microbit.no_such_function()
+        self.assertUsable()
+
+    def test_module_which_cannot_be_imported(self):
+        with self.assertRaises(IOError) as raised:
+            self.device.microbti.foo()
+        self.assertIn('microbti', str(raised.exception))
+        # execute() would try to import it again if it were still due.
+        self.assertEqual(self.device.execute('print(1)'), (b'1\r\n', b''))
+        self.assertUsable()
+
+    def test_timeout(self):
+        with self.assertRaises(Timeout) as raised:
+            self.microbit.sleep(10000, _timeout=0.2)
+        self.assertEqual(raised.exception.timeout, 0.2)
+        self.assertIsNotNone(raised.exception.recovery)
+        self.assertUsable()
+
+    def test_device_timeout(self):
+        self.device.timeout = 0.2
+        with self.assertRaises(Timeout):
+            self.microbit.sleep(10000)
+        self.assertUsable()
+
+    def test_execute(self):
+        self.assertEqual(self.device.execute('print(6 * 7)'),
+                         (b'42\r\n', b''))
+        out, err = self.device.execute('raise ValueError("bad")')
+        self.assertIn(b'ValueError: bad', err)
+
+    def test_execute_timeout(self):
+        with self.assertRaises(Timeout):
+            self.device.execute('import microbit\nmicrobit.sleep(10000)',
+                                timeout=0.2)
+        self.assertEqual(self.device.execute('print(1)'), (b'1\r\n', b''))
+
+    def test_batch(self):
+        with self.device.batch():
+            x = self.microbit.accelerometer.get_x()
+            bad = self.microbit.display.get_pixel(7, 7)
+            z = self.microbit.accelerometer.get_z()
+        self.assertEqual((x.result(), z.result()), (0, -1024))
+        with self.assertRaises(IOError):
+            bad.result()
+
+    def test_batch_timeout(self):
+        with self.assertRaises(Timeout):
+            with self.device.batch():
+                first = self.microbit.accelerometer.get_z()
+                self.microbit.sleep(10000, _timeout=0.2)
+        with self.assertRaises(Timeout):
+            first.result()
+        self.assertUsable()
+
+    def test_cache_forgets_batched_writes(self):
+        self.device.cache = ResultCache({'microbit.display.get_pixel': 60})
+        self.microbit.display.set_pixel(1, 1, 9)
+        self.assertEqual(self.microbit.display.get_pixel(1, 1), 9)
+        with self.device.batch():
+            self.microbit.display.set_pixel(1, 1, 7)
+        self.assertEqual(self.microbit.display.get_pixel(1, 1), 7)
+
+
+class SourceTests(CallPathTests, unittest.TestCase):
+    OPEN = {}
+
+
+class RpcTests(CallPathTests, unittest.TestCase):
+    OPEN = {'rpc': True}
+
+    def test_dispatcher_used(self):
+        self.microbit.accelerometer.get_x()
+        self.assertIn('microbit.accelerometer.get_x',
+                      self.device.dispatcher.slots)
+
+    def test_wedged_dispatcher_stopped(self):
+        self.microbit.accelerometer.get_x()
+        # Announces a frame which never comes, so the dispatcher takes the
+        # request to quit as part of it.
+        self.device.connection.write(b'\x05\x00')
+        self.assertEqual(self.device.execute('print(1)'), (b'1\r\n', b''))
+
+    def test_released_while_dispatching(self):
+        image = self.microbit.Image('90009:09090:00900:09090:90009',
+                                    _handle=True)
+        self.microbit.display.show(image)
+        del image
+        gc.collect()
+        self.microbit.accelerometer.get_x()
+        self.assertTrue(self.device.dispatcher.running)
+        self.assertFalse(self.device._released)
+        self.assertEqual(self.device.execute('print(len(_mph))'),
+                         (b'0\r\n', b''))
+
+
+class ThreadedTests(CallPathTests, unittest.TestCase):
+    OPEN = {'threaded': True}
+
+    def test_submit(self):
+        futures = [self.device.submit(self.microbit.display.get_pixel, 0, 0)
+                   for _ in range(10)]
+        self.assertEqual([f.result() for f in futures], [0] * 10)
+
+    def test_timeout_not_lost_when_batched(self):
+        worker = self.device.worker
+        others = [worker.call(self.microbit.accelerometer.get_z, (), {})
+                  for _ in range(3)]
+        slow = worker.call(self.microbit.sleep, (10000,), {'_timeout': 0.2})
+        with self.assertRaises(Timeout):
+            slow.result(5)
+        self.assertEqual([f.result() for f in others], [-1024] * 3)
+
+    def test_mirror_error_raised(self):
+        mirror = self.device.mirror(['microbit.accelerometer.get_z'],
+                                    interval=0.01)
+        self.assertEqual(self.microbit.accelerometer.get_z(), -1024)
+
+        def refresh():
+            raise ValueError('bad')
+        mirror.refresh = refresh
+        mirror._thread.join(1)
+        with self.assertRaises(ValueError):
+            self.microbit.accelerometer.get_z()
+        self.device.unmirror()
+        self.assertUsable()
+
+    def test_sampling_refused(self):
+        with self.assertRaises(IOError):
+            self.device.sample().start()
+
+
+if __name__ == '__main__':
+    unittest.main()
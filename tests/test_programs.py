@@ -0,0 +1,245 @@
+"""
+test_programs.py
+Part of MicroPeri https://github.com/JoeGlancy/microperi
+
+See LICENSE file for copyright and license details
+
+Tests of the features built on long-running programs (streaming, sampling,
+the display stream and the radio gateway), the broker and AsyncDevice,
+against a simulated micro:bit (see sim.py).
+"""
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from microperi.microperi import Device, Timeout
+from microperi.aio import AsyncDevice
+from microperi.broker import Broker, BrokerDevice
+from microperi.ringbuffer import SampleRing
+
+
+PORT = 'microbit-sim://?latency=0'
+
+
+class ProgramTests(unittest.TestCase):
+
+    def setUp(self):
+        self.device = Device(port=PORT)
+        self.device.open()
+        self.microbit = self.device.microbit
+
+    def tearDown(self):
+        self.device.close()
+
+    def assertUsable(self):
+        self.assertEqual(self.microbit.accelerometer.get_z(), -1024)
+
+    def test_stream(self):
+        lines = list(self.device.stream('for i in range(3):\n    print(i)'))
+        self.assertEqual(lines, ['0', '1', '2'])
+        self.assertUsable()
+
+    def test_stream_error(self):
+        with self.assertRaises(IOError) as raised:
+            list(self.device.stream('print(1)\nraise ValueError("bad")'))
+        self.assertIn(b'ValueError: bad', raised.exception.args[0])
+        self.assertUsable()
+
+    def test_stream_cancelled(self):
+        code = 'import microbit\nwhile True:\n    print(1)\n' \
+            '    microbit.sleep(10)\n'
+        with self.device.stream(code) as lines:
+            self.assertEqual(next(iter(lines)), '1')
+        self.assertUsable()
+
+    def test_sample(self):
+        with self.device.sample(['accelerometer'], rate=200) as samples:
+            for i, sample in enumerate(samples):
+                if i == 2:
+                    break
+        self.assertEqual(sample.accelerometer_z, -1024)
+        self.assertUsable()
+
+    def test_sample_ring_counts_oversized_batches(self):
+        ring = SampleRing(('x',), capacity=4, use_numpy=False)
+        ring.extend([b'$%d,%d' % (i, i) for i in range(5)])
+        ring.extend([b'$%d,%d' % (i, i) for i in range(10)])
+        self.assertEqual((ring.total, ring.overwritten), (15, 11))
+        self.assertEqual(ring.column('x'), [6, 7, 8, 9])
+
+    def test_display_stream(self):
+        with self.device.display_stream() as display:
+            display.show('09090:99999:99999:09990:00900')
+        self.assertEqual(self.microbit.display.get_pixel(1, 0), 9)
+
+    def test_radio_gateway(self):
+        radio = self.device.connection.radio
+        with self.device.radio_gateway(queue=5) as gateway:
+            gateway.send(b'hello', b'\x03\x04\x10')
+            for i in range(3):
+                radio.inject(bytes((i, 4)))
+            messages = [gateway.receive(1) for _ in range(3)]
+        self.assertEqual([m.payload for m in messages],
+                         [b'\x00\x04', b'\x01\x04', b'\x02\x04'])
+        self.assertEqual(radio.sent, [b'hello', b'\x03\x04\x10'])
+        self.assertUsable()
+
+    def test_radio_gateway_timestamps(self):
+        radio = self.device.connection.radio
+        with self.device.radio_gateway() as gateway:
+            radio.inject(b'first')
+            time.sleep(0.05)
+            radio.inject(b'second')
+            first, second = gateway.receive(1), gateway.receive(1)
+        # In microseconds, as on the micro:bit.
+        self.assertGreater(second.timestamp - first.timestamp, 40000)
+        self.assertLess(second.timestamp - first.timestamp, 1000000)
+
+
+class ThreadedProgramTests(unittest.TestCase):
+
+    def test_programs_refused(self):
+        device = Device(port=PORT)
+        device.open(threaded=True)
+        try:
+            for start in (device.sample().start,
+                          device.stream('pass').start,
+                          device.display_stream().start,
+                          device.radio_gateway().start):
+                with self.assertRaises(IOError):
+                    start()
+        finally:
+            device.close()
+
+
+class BrokerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'microperi.sock')
+        self.device = Device(port=PORT)
+        self.broker = Broker(self.device, self.path)
+        threading.Thread(target=self.broker.serve_forever,
+                         daemon=True).start()
+        while not os.path.exists(self.path):
+            time.sleep(0.01)
+        self.client = BrokerDevice(self.path)
+        self.client.open()
+
+    def tearDown(self):
+        self.client.close()
+        self.broker.close()
+        self.device.close()
+
+    def test_call(self):
+        self.assertEqual(self.client.microbit.accelerometer.get_z(), -1024)
+
+    def test_gather_first(self):
+        # The module is only imported by the batch's own program.
+        microbit = self.client.microbit
+        self.assertEqual(self.client.gather(microbit.accelerometer.get_x,
+                                            microbit.button_a.is_pressed),
+                         [0, False])
+
+    def test_reads_which_clear_not_shared(self):
+        self.device.connection.microbit.button_a.presses = 3
+        futures = [self.broker._handle('C', 'microbit.button_a.get_presses',
+                                       (), ()) for _ in range(2)]
+        self.assertEqual(sorted(f.result() for f in futures), [0, 3])
+        self.assertEqual(self.broker.stats['coalesced'], 0)
+
+    def test_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(Timeout) as raised:
+            self.client.microbit.sleep(3000, _timeout=0.2)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(raised.exception.timeout, 0.2)
+        self.assertEqual(self.client.microbit.accelerometer.get_z(), -1024)
+
+    def test_device_timeout(self):
+        self.client.timeout = 0.2
+        with self.assertRaises(Timeout):
+            self.client.microbit.sleep(3000)
+        with self.assertRaises(Timeout):
+            self.client.execute('import microbit\nmicrobit.sleep(3000)')
+
+    def test_connection_lost(self):
+        self.client._socket.shutdown(socket.SHUT_RDWR)
+        self.client._receiver.join(1)
+        with self.assertRaises(IOError):
+            self.client.microbit.accelerometer.get_z()
+        self.client.open()
+        self.assertEqual(self.client.microbit.accelerometer.get_z(), -1024)
+
+    def test_many_threads(self):
+        get_z = self.client.microbit.accelerometer.get_z
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: get_z(), range(200)))
+        self.assertEqual(results, [-1024] * 200)
+
+    def test_socket_in_use(self):
+        with self.assertRaises(IOError):
+            Broker(Device(port=PORT), self.path).serve_forever()
+        self.assertEqual(self.client.microbit.accelerometer.get_z(), -1024)
+
+    def test_not_a_socket(self):
+        path = os.path.join(os.path.dirname(self.path), 'file')
+        with open(path, 'w') as f:
+            f.write('keep')
+        with self.assertRaises(IOError):
+            Broker(Device(port=PORT), path).serve_forever()
+        self.assertTrue(os.path.exists(path))
+
+    def test_stale_socket_replaced(self):
+        path = os.path.join(os.path.dirname(self.path), 'stale.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        device = Device(port=PORT)
+        broker = Broker(device, path)
+        threading.Thread(target=broker.serve_forever, daemon=True).start()
+        client = BrokerDevice(path)
+        try:
+            for _ in range(100):
+                try:
+                    client.open()
+                    break
+                except (ConnectionRefusedError, FileNotFoundError):
+                    time.sleep(0.01)
+            self.assertEqual(client.microbit.accelerometer.get_z(), -1024)
+        finally:
+            client.close()
+            broker.close()
+            device.close()
+
+    def test_large_result(self):
+        out, err = self.client.execute('print("x" * 70000)')
+        self.assertEqual(len(out), 70002)
+
+
+class AsyncTests(unittest.TestCase):
+
+    def test_timeout_interrupts(self):
+        async def run():
+            device = AsyncDevice(port=PORT)
+            await device.open()
+            try:
+                microbit = device.microbit
+                hung = asyncio.ensure_future(microbit.sleep(10 ** 6,
+                                                            _timeout=0.2))
+                behind = asyncio.ensure_future(
+                    microbit.accelerometer.get_z())
+                with self.assertRaises(asyncio.TimeoutError):
+                    await hung
+                return await asyncio.wait_for(behind, 2)
+            finally:
+                device.close()
+        self.assertEqual(asyncio.run(run()), -1024)
+
+
+if __name__ == '__main__':
+    unittest.main()